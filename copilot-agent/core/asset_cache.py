@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+CopilotPrivateAgent Static Asset Cache
+In-memory cache for branding and JavaScript assets with strong ETags
+and precompressed gzip/brotli variants
+
+Owner: Dib Anouar
+License: LUP v1.0 (personal and non-commercial use only)
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# Try to import brotli for br-encoded variants, fallback to gzip only
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+
+@dataclass
+class CachedAsset:
+    """A static asset held in memory with its precompressed variants"""
+    path: Path
+    media_type: str
+    mtime_ns: int
+    size: int
+    body: bytes
+    etag: str
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """Strong ETag for the identity or an encoded representation"""
+        if encoding is None:
+            return f'"{self.etag}"'
+        return f'"{self.etag}-{encoding}"'
+
+
+class AssetCache:
+    """
+    Serve small static files from memory
+
+    Files are read and compressed once, when registered or when their
+    mtime/size changes. Requests only pay for an os.stat() call.
+    """
+
+    def __init__(self, min_compress_size: int = 256):
+        self.min_compress_size = min_compress_size
+        self._sources: Dict[str, tuple] = {}
+        self._assets: Dict[str, CachedAsset] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, path: Path, media_type: str,
+                 transform: Optional[Callable[[bytes], bytes]] = None):
+        """Register an asset and load it immediately if present"""
+        self._sources[name] = (Path(path), media_type, transform)
+        self.get(name)
+
+    def get(self, name: str) -> Optional[CachedAsset]:
+        """Return the cached asset, reloading it if the file changed on disk"""
+        path, media_type, transform = self._sources[name]
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._assets.pop(name, None)
+            return None
+
+        asset = self._assets.get(name)
+        if asset and asset.mtime_ns == st.st_mtime_ns and asset.size == st.st_size:
+            return asset
+
+        with self._lock:
+            asset = self._assets.get(name)
+            if asset and asset.mtime_ns == st.st_mtime_ns and asset.size == st.st_size:
+                return asset
+            try:
+                asset = self._load(path, media_type, transform, st)
+            except OSError:
+                self._assets.pop(name, None)
+                return None
+            self._assets[name] = asset
+            return asset
+
+    def _load(self, path: Path, media_type: str,
+              transform: Optional[Callable[[bytes], bytes]],
+              st: os.stat_result) -> CachedAsset:
+        """Read the file and precompute its ETag and compressed variants"""
+        with open(path, 'rb') as f:
+            raw = f.read()
+        body = transform(raw) if transform else raw
+
+        variants = {}
+        if len(body) >= self.min_compress_size:
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                variants['gzip'] = gz
+            if HAS_BROTLI:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    variants['br'] = br
+
+        return CachedAsset(
+            path=path,
+            media_type=media_type,
+            mtime_ns=st.st_mtime_ns,
+            size=st.st_size,
+            body=body,
+            etag=hashlib.sha256(body).hexdigest()[:32],
+            variants=variants
+        )
+
+    def response(self, name: str, request: Request) -> Optional[Response]:
+        """
+        Build the response for a cached asset
+
+        Returns None if the asset file does not exist, so callers can
+        keep their own fallback behaviour.
+        """
+        asset = self.get(name)
+        if asset is None:
+            return None
+
+        accepted = _accepted_encodings(request.headers.get('accept-encoding', ''))
+        encoding = None
+        for candidate in ('br', 'gzip'):
+            if candidate in accepted and candidate in asset.variants:
+                encoding = candidate
+                break
+
+        etag = asset.etag_for(encoding)
+        headers = {
+            'ETag': etag,
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': 'no-cache'
+        }
+
+        if _etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers['Content-Encoding'] = encoding
+            body = asset.variants[encoding]
+        else:
+            body = asset.body
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+
+def _accepted_encodings(header: str) -> Set[str]:
+    """Parse Accept-Encoding, ignoring codings with q=0"""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(coding)
+    if '*' in accepted:
+        accepted.update(('br', 'gzip'))
+    return accepted
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as required for If-None-Match (RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -14,12 +14,66 @@ import logging
 import hashlib
 import datetime
 import subprocess
+import threading
 import ipaddress
 from pathlib import Path
 from typing import Dict, List, Optional, Union
 from dataclasses import dataclass
 from enum import Enum
 
+# Cross-process file locking (POSIX), fallback to thread-only locking if not available
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+class FileLock:
+    """
+    Exclusive advisory lock on a sidecar file
+
+    Serializes threads in this process and, where fcntl is available,
+    every worker process that opens the same lock file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if HAS_FCNTL:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._thread_lock.release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+        return False
+
+class LockedFileHandler(logging.FileHandler):
+    """FileHandler that writes each record under a cross-process lock"""
+
+    def __init__(self, filename, file_lock: FileLock, **kwargs):
+        super().__init__(filename, mode='a', **kwargs)
+        self.file_lock = file_lock
+
+    def emit(self, record):
+        with self.file_lock:
+            super().emit(record)
+
 class OperationMode(Enum):
     """Operational modes for the CopilotPrivateAgent"""
     DEFEND = "DEFEND"  # Default: defensive operations only
@@ -74,12 +128,16 @@ class CopilotPrivateAgent:
         """Setup secure logging with SHA-256 audit trail"""
         log_file = self.logs_dir / "copilot_agent.log"
         
+        # Locks shared by all worker processes using the same logs directory
+        self._log_lock = FileLock(self.logs_dir / ".copilot_agent.log.lock")
+        self._chain_lock = FileLock(self.logs_dir / ".audit_chain.lock")
+        
         # Configure logging
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
             handlers=[
-                logging.FileHandler(log_file),
+                LockedFileHandler(log_file, self._log_lock),
                 logging.StreamHandler(sys.stdout)
             ]
         )
@@ -135,44 +193,118 @@ class CopilotPrivateAgent:
             return default_config
 
     def _update_log_chain(self):
-        """Update SHA-256 audit trail for log integrity (optimized with streaming)"""
-        chain_file = self.logs_dir / "audit_chain.json"
+        """
+        Update SHA-256 audit trail for log integrity (optimized with streaming)
         
-        # Calculate current log hash using streaming for large files
-        log_file = self.logs_dir / "copilot_agent.log"
-        hasher = hashlib.sha256()
+        The whole read-modify-write runs under the chain lock, and the log is
+        hashed under the log lock, so concurrent workers append one linear chain.
+        """
+        chain_file = self.logs_dir / "audit_chain.json"
         
-        if log_file.exists():
+        with self._chain_lock:
+            # Calculate current log hash using streaming for large files
+            log_file = self.logs_dir / "copilot_agent.log"
+            hasher = hashlib.sha256()
+            log_size = 0
+            
+            with self._log_lock:
+                if log_file.exists():
+                    try:
+                        with open(log_file, 'rb') as f:
+                            # Read in chunks to handle large log files efficiently
+                            for chunk in iter(lambda: f.read(65536), b''):
+                                hasher.update(chunk)
+                                log_size += len(chunk)
+                    except (IOError, OSError):
+                        # If file can't be read, use empty hash
+                        hasher = hashlib.sha256()
+                        log_size = 0
+            
+            current_hash = hasher.hexdigest()
+            
+            # Load existing chain
             try:
-                with open(log_file, 'rb') as f:
-                    # Read in chunks to handle large log files efficiently
-                    for chunk in iter(lambda: f.read(65536), b''):
-                        hasher.update(chunk)
-            except (IOError, OSError):
-                # If file can't be read, use empty hash
-                pass
+                with open(chain_file, 'r') as f:
+                    chain = json.load(f)
+            except FileNotFoundError:
+                chain = {"entries": []}
+            
+            # Add new entry
+            chain["entries"].append({
+                "timestamp": datetime.datetime.now().isoformat(),
+                "log_hash": current_hash,
+                "log_size": log_size,
+                "prev_hash": chain["entries"][-1]["log_hash"] if chain["entries"] else "genesis",
+                "pid": os.getpid()
+            })
+            
+            # Keep only last 100 entries
+            chain["entries"] = chain["entries"][-100:]
+            
+            # Atomic replace so readers never see a half-written chain
+            tmp_file = chain_file.with_name(f"{chain_file.name}.{os.getpid()}.tmp")
+            with open(tmp_file, 'w') as f:
+                json.dump(chain, f, indent=2)
+            os.replace(tmp_file, chain_file)
+
+    def verify_log_chain(self) -> Dict:
+        """
+        Check the audit chain against the log file it protects
         
-        current_hash = hasher.hexdigest()
+        The log is append-only, so each entry's log_hash must equal the hash
+        of the log's first log_size bytes. The log is streamed once and the
+        running hash compared at every recorded size: an edited, truncated or
+        rotated log breaks the chain at the first entry it no longer matches.
+        Entries written before log_size was recorded can only be link-checked.
+        """
+        chain_file = self.logs_dir / "audit_chain.json"
+        log_file = self.logs_dir / "copilot_agent.log"
         
-        # Load existing chain
-        try:
-            with open(chain_file, 'r') as f:
-                chain = json.load(f)
-        except FileNotFoundError:
-            chain = {"entries": []}
+        with self._chain_lock:
+            try:
+                with open(chain_file, 'r') as f:
+                    entries = json.load(f).get("entries", [])
+            except FileNotFoundError:
+                entries = []
         
-        # Add new entry
-        chain["entries"].append({
-            "timestamp": datetime.datetime.now().isoformat(),
-            "log_hash": current_hash,
-            "prev_hash": chain["entries"][-1]["log_hash"] if chain["entries"] else "genesis"
-        })
+        broken = {
+            i for i in range(1, len(entries))
+            if entries[i].get("prev_hash") != entries[i - 1].get("log_hash")
+        }
         
-        # Keep only last 100 entries
-        chain["entries"] = chain["entries"][-100:]
+        checked = [(i, e) for i, e in enumerate(entries) if isinstance(e.get("log_size"), int)]
+        if checked:
+            hasher = hashlib.sha256()
+            offset = 0
+            with self._log_lock:
+                try:
+                    f = open(log_file, 'rb')
+                except (IOError, OSError):
+                    f = None
+                try:
+                    for i, entry in checked:
+                        size = entry["log_size"]
+                        # Sizes only grow: a smaller one means the log was cut
+                        while f is not None and offset < size:
+                            chunk = f.read(min(65536, size - offset))
+                            if not chunk:
+                                break
+                            hasher.update(chunk)
+                            offset += len(chunk)
+                        if offset != size or hasher.hexdigest() != entry.get("log_hash"):
+                            broken.update(j for j, _ in checked if j >= i)
+                            break
+                finally:
+                    if f is not None:
+                        f.close()
         
-        with open(chain_file, 'w') as f:
-            json.dump(chain, f, indent=2)
+        return {
+            "valid": not broken,
+            "entries": len(entries),
+            "broken_links": sorted(broken),
+            "unverified_entries": len(entries) - len(checked),
+            "timestamp": datetime.datetime.now().isoformat()
+        }
 
     def _parse_allowlist_cache(self):
         """Parse and cache IP networks from allowlist (performance optimization)"""
@@ -443,6 +575,7 @@ def main():
     parser.add_argument("--target", "-t", default="localhost", help="Target system (default: localhost)")
     parser.add_argument("--real", action="store_true", help="Execute real operation (default: dry-run)")
     parser.add_argument("--status", action="store_true", help="Show agent status")
+    parser.add_argument("--verify-chain", action="store_true", help="Verify the audit chain links")
     parser.add_argument("--config-dir", help="Configuration directory path")
     
     args = parser.parse_args()
@@ -455,8 +588,12 @@ def main():
         print(json.dumps(status, indent=2))
         return
     
+    if args.verify_chain:
+        print(json.dumps(agent.verify_log_chain(), indent=2))
+        return
+    
     if not args.prompt:
-        parser.error("--prompt is required when not using --status")
+        parser.error("--prompt is required when not using --status or --verify-chain")
     
     # Execute operation
     result = agent.execute_operation(
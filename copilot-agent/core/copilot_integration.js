@@ -14,6 +14,7 @@ class CopilotPrivateAgent {
      * @param {string} config.baseUrl - Base URL for agent API (default: http://localhost:8787)
      * @param {string} config.token - Bearer token for authentication
      * @param {boolean} config.enableLogging - Enable console logging (default: true)
+     * @param {boolean} config.useWebSocket - Multiplex requests over /copilot/ws (default: true)
      */
     constructor(config = {}) {
         this.baseUrl = config.baseUrl || 'http://localhost:8787';
@@ -21,6 +22,11 @@ class CopilotPrivateAgent {
         this.enableLogging = config.enableLogging !== false;
         this.wsConnection = null;
         this.eventHandlers = {};
+        this.useWebSocket = config.useWebSocket !== false;
+        
+        // In-flight WebSocket session requests, keyed by request id
+        this.pendingRequests = new Map();
+        this.requestCounter = 0;
         
         // Security context
         this.currentMode = 'DEFEND';
@@ -34,6 +40,11 @@ class CopilotPrivateAgent {
         
         // Load initial status
         this.loadStatus();
+        
+        // Open the multiplexed session; HTTP is used until it is ready
+        if (this.useWebSocket && typeof WebSocket !== 'undefined') {
+            this.connectSession();
+        }
     }
 
     /**
@@ -402,12 +413,16 @@ class CopilotPrivateAgent {
         this.logOutput(`Executing operation: ${finalPrompt}`, 'info');
         this.logOutput(`Target: ${target}, Dry Run: ${dryRun}`, 'info');
         
+        const operation = {
+            prompt: finalPrompt,
+            target: target,
+            dry_run: dryRun
+        };
+        
         try {
-            const result = await this.callAPI('/copilot/execute', {
-                prompt: finalPrompt,
-                target: target,
-                dry_run: dryRun
-            });
+            const result = this.isSessionOpen()
+                ? await this.sendRequest('execute', operation)
+                : await this.runJob(operation);
             
             this.logOutput('Operation Result:', 'success');
             this.logOutput(JSON.stringify(result, null, 2), 'result');
@@ -424,7 +439,9 @@ class CopilotPrivateAgent {
         this.logOutput('Loading agent status...', 'info');
         
         try {
-            const status = await this.callAPI('/copilot/status');
+            const status = this.isSessionOpen()
+                ? await this.sendRequest('status')
+                : await this.callAPI('/copilot/status', null, 'GET');
             
             this.logOutput('Agent Status:', 'success');
             this.logOutput(JSON.stringify(status, null, 2), 'result');
@@ -443,19 +460,109 @@ class CopilotPrivateAgent {
         }
     }
 
+    /**
+     * Submit an operation as a background job and wait for its result
+     * Retries reuse the same idempotency key, so the server never runs the work twice
+     * @param {Object} operation - Operation payload (prompt, target, dry_run)
+     * @param {number} retries - Submission retries on network or 5xx errors (default: 3)
+     */
+    async runJob(operation, retries = 3) {
+        const idempotencyKey = this.newIdempotencyKey();
+        let job = null;
+        
+        for (let attempt = 0; ; attempt++) {
+            try {
+                job = await this.callAPI('/copilot/jobs', operation, 'POST', {
+                    'Idempotency-Key': idempotencyKey
+                });
+                break;
+            } catch (error) {
+                const retryable = !error.status || error.status >= 500;
+                if (!retryable || attempt >= retries) throw error;
+                this.log(`Job submission failed, retrying (${attempt + 1}/${retries})`, 'warning');
+                await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+            }
+        }
+        
+        this.logOutput(`Job queued: ${job.id}`, 'info');
+        const finished = await this.waitForJob(job.id);
+        
+        if (finished.status === 'failed') {
+            throw new Error(finished.error || 'Job failed');
+        }
+        return finished.result;
+    }
+
+    /**
+     * Wait for a job to finish, following its progress stream
+     * Falls back to polling when EventSource is unavailable or a token is required
+     * @param {string} jobId - Job identifier
+     */
+    waitForJob(jobId) {
+        const endpoint = `/copilot/jobs/${encodeURIComponent(jobId)}`;
+        const isDone = (job) => job.status === 'completed' || job.status === 'failed';
+        
+        const poll = async () => {
+            for (;;) {
+                const job = await this.callAPI(endpoint, null, 'GET');
+                this.emit('job_progress', job);
+                if (isDone(job)) return job;
+                await new Promise(resolve => setTimeout(resolve, 1000));
+            }
+        };
+        
+        if (typeof EventSource === 'undefined' || this.token) {
+            return poll();
+        }
+        
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`${this.baseUrl}${endpoint}/events`);
+            
+            source.addEventListener('progress', (event) => {
+                const job = JSON.parse(event.data);
+                this.emit('job_progress', job);
+                if (job.message) {
+                    this.log(`Job ${jobId}: ${job.message} (${job.progress}%)`, 'debug');
+                }
+                if (isDone(job)) {
+                    source.close();
+                    resolve(job);
+                }
+            });
+            
+            source.onerror = () => {
+                // Stream dropped before completion: continue by polling
+                source.close();
+                poll().then(resolve, reject);
+            };
+        });
+    }
+
+    /**
+     * Generate a unique idempotency key for a job submission
+     */
+    newIdempotencyKey() {
+        if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+            return window.crypto.randomUUID();
+        }
+        return `${Date.now().toString(16)}-${Math.random().toString(16).slice(2)}`;
+    }
+
     /**
      * Call API endpoint
      * @param {string} endpoint - API endpoint path
      * @param {Object} data - Request data
      * @param {string} method - HTTP method (default: POST)
+     * @param {Object} headers - Extra request headers
      */
-    async callAPI(endpoint, data = null, method = 'POST') {
+    async callAPI(endpoint, data = null, method = 'POST', headers = {}) {
         const url = `${this.baseUrl}${endpoint}`;
         
         const options = {
             method: method,
             headers: {
                 'Content-Type': 'application/json',
+                ...headers
             }
         };
         
@@ -472,7 +579,9 @@ class CopilotPrivateAgent {
         const response = await fetch(url, options);
         
         if (!response.ok) {
-            throw new Error(`API call failed: ${response.status} ${response.statusText}`);
+            const error = new Error(`API call failed: ${response.status} ${response.statusText}`);
+            error.status = response.status;
+            throw error;
         }
         
         return await response.json();
@@ -562,6 +671,48 @@ class CopilotPrivateAgent {
         return div.innerHTML;
     }
 
+    /**
+     * Open the multiplexed WebSocket session at /copilot/ws
+     */
+    connectSession() {
+        const wsUrl = `${this.baseUrl.replace(/^http/, 'ws')}/copilot/ws`;
+        this.initWebSocket(wsUrl);
+    }
+
+    /**
+     * Check whether the WebSocket session can carry requests
+     */
+    isSessionOpen() {
+        return this.wsConnection !== null && this.wsConnection.readyState === WebSocket.OPEN;
+    }
+
+    /**
+     * Send a tagged request over the WebSocket session
+     * @param {string} type - Request type (execute, status, ping)
+     * @param {Object} payload - Request fields
+     * @returns {Promise<Object>} Resolves with the result data
+     */
+    sendRequest(type, payload = {}) {
+        if (!this.isSessionOpen()) {
+            return Promise.reject(new Error('WebSocket session not connected'));
+        }
+        
+        const id = `req-${++this.requestCounter}`;
+        return new Promise((resolve, reject) => {
+            this.pendingRequests.set(id, { resolve, reject });
+            this.wsConnection.send(JSON.stringify({ id, type, ...payload }));
+        });
+    }
+
+    /**
+     * Reject every in-flight session request
+     * @param {string} reason - Error message
+     */
+    rejectPendingRequests(reason) {
+        this.pendingRequests.forEach(({ reject }) => reject(new Error(reason)));
+        this.pendingRequests.clear();
+    }
+
     /**
      * Initialize WebSocket connection for real-time updates
      * @param {string} wsUrl - WebSocket URL
@@ -589,6 +740,7 @@ class CopilotPrivateAgent {
         
         this.wsConnection.onclose = () => {
             this.log('WebSocket connection closed', 'warning');
+            this.rejectPendingRequests('WebSocket connection closed');
             this.updateConnectionStatus(false);
         };
         
@@ -603,7 +755,17 @@ class CopilotPrivateAgent {
      * @param {Object} data - Message data
      */
     handleWebSocketMessage(data) {
-        if (data.type === 'operation_update') {
+        const pending = data.id ? this.pendingRequests.get(data.id) : null;
+        
+        if (pending) {
+            if (data.type === 'result' || data.type === 'pong') {
+                this.pendingRequests.delete(data.id);
+                pending.resolve(data.data);
+            } else if (data.type === 'error') {
+                this.pendingRequests.delete(data.id);
+                pending.reject(new Error(data.message));
+            }
+        } else if (data.type === 'operation_update') {
             this.logOutput(`Operation Update: ${data.message}`, 'info');
         } else if (data.type === 'status_change') {
             this.logOutput(`Status Change: ${data.message}`, 'warning');
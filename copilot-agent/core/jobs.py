@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+CopilotPrivateAgent Job Queue
+Persistent, bounded job table for long-running operations
+
+Owner: Dib Anouar
+License: LUP v1.0 (personal and non-commercial use only)
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import datetime
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+
+class JobStatus(Enum):
+    """Lifecycle states of a job"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+TERMINAL_STATUSES = (JobStatus.COMPLETED.value, JobStatus.FAILED.value)
+
+
+class JobQueueFull(Exception):
+    """Raised when the job table already holds the maximum number of active jobs"""
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key is reused with a different request"""
+
+
+class JobStore:
+    """
+    SQLite-backed job table
+
+    Shared by every worker process, so a job submitted to one worker can be
+    polled or streamed from any other. Finished jobs are kept for
+    ``retention_seconds`` and capped at ``max_jobs`` rows; at most ``max_jobs``
+    jobs may be queued or running at once.
+    """
+
+    def __init__(self, db_path: Path, retention_seconds: int = 86400, max_jobs: int = 1000):
+        self.db_path = Path(db_path)
+        self.retention_seconds = retention_seconds
+        self.max_jobs = max_jobs
+        self._last_purge = 0.0
+
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    idempotency_key TEXT UNIQUE,
+                    request_hash TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    message TEXT,
+                    result TEXT,
+                    error TEXT,
+                    pid INTEGER,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a short-lived connection (one per call, safe across threads)"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, request: Dict, idempotency_key: Optional[str] = None) -> Tuple[Dict, bool]:
+        """
+        Insert a new queued job
+
+        Returns (job, created). If the idempotency key was already used for
+        the same request, the existing job is returned with created=False.
+        """
+        request_json = json.dumps(request, sort_keys=True)
+        request_hash = hashlib.sha256(request_json.encode()).hexdigest()
+
+        if idempotency_key:
+            existing = self._get_by_key(idempotency_key)
+            if existing is not None:
+                return self._check_replay(existing, request_hash), False
+
+        self.purge()
+
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                active = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE finished_at IS NULL"
+                ).fetchone()[0]
+                if active >= self.max_jobs:
+                    raise JobQueueFull(f"Job queue full ({self.max_jobs} active jobs)")
+                conn.execute(
+                    "INSERT INTO jobs (id, idempotency_key, request_hash, request, status, "
+                    "message, pid, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, idempotency_key, request_hash, request_json,
+                     JobStatus.QUEUED.value, "Job queued", os.getpid(), now, now)
+                )
+                conn.execute("COMMIT")
+            except sqlite3.IntegrityError:
+                # Another worker inserted the same idempotency key first
+                conn.execute("ROLLBACK")
+                return self._check_replay(self._get_by_key(idempotency_key), request_hash), False
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        return self.get(job_id), True
+
+    def _check_replay(self, job: Dict, request_hash: str) -> Dict:
+        """Return the stored job for a retried request, rejecting mismatched payloads"""
+        if job["request_hash"] != request_hash:
+            raise IdempotencyConflict("Idempotency key already used for a different request")
+        return job
+
+    def _get_by_key(self, idempotency_key: str) -> Optional[Dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Fetch a job by id"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def update(self, job_id: str, status: JobStatus, progress: int, message: str,
+               result: Optional[Dict] = None, error: Optional[str] = None):
+        """Record a progress step; terminal statuses also set finished_at"""
+        now = time.time()
+        finished_at = now if status.value in TERMINAL_STATUSES else None
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, message = ?, result = ?, error = ?, "
+                "updated_at = ?, finished_at = ? WHERE id = ?",
+                (status.value, progress, message,
+                 json.dumps(result) if result is not None else None,
+                 error, now, finished_at, job_id)
+            )
+
+    def purge(self, force: bool = False):
+        """Drop finished jobs past retention and keep at most max_jobs finished rows"""
+        now = time.time()
+        if not force and now - self._last_purge < 60:
+            return
+        self._last_purge = now
+
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (now - self.retention_seconds,)
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE finished_at IS NOT NULL "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_jobs,)
+            )
+
+    def fail_orphans(self):
+        """Mark jobs owned by processes that no longer exist as failed"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, pid FROM jobs WHERE finished_at IS NULL"
+            ).fetchall()
+        for row in rows:
+            if row["pid"] != os.getpid() and not _pid_alive(row["pid"]):
+                self.update(row["id"], JobStatus.FAILED, 100, "Job interrupted",
+                            error="Worker process exited before the job finished")
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict:
+        def iso(ts):
+            return datetime.datetime.fromtimestamp(ts).isoformat() if ts else None
+
+        return {
+            "id": row["id"],
+            "idempotency_key": row["idempotency_key"],
+            "request_hash": row["request_hash"],
+            "request": json.loads(row["request"]),
+            "status": row["status"],
+            "progress": row["progress"],
+            "message": row["message"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": iso(row["created_at"]),
+            "updated_at": iso(row["updated_at"]),
+            "finished_at": iso(row["finished_at"])
+        }
+
+
+class JobManager:
+    """Run queued jobs against the agent on a bounded thread pool"""
+
+    def __init__(self, agent, store: JobStore, max_workers: int = 5):
+        self.agent = agent
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="copilot-job")
+        self.store.fail_orphans()
+
+    def submit(self, prompt: str, target: str, dry_run: bool,
+               idempotency_key: Optional[str] = None) -> Tuple[Dict, bool]:
+        """Queue an operation; retries with the same key return the original job"""
+        request = {"prompt": prompt, "target": target, "dry_run": dry_run}
+        job, created = self.store.create(request, idempotency_key)
+        if created:
+            self.executor.submit(self._run, job["id"], request)
+        return job, created
+
+    def _run(self, job_id: str, request: Dict):
+        self.store.update(job_id, JobStatus.RUNNING, 10, "Operation running")
+        try:
+            result = self.agent.execute_operation(**request)
+        except Exception as e:
+            self.store.update(job_id, JobStatus.FAILED, 100, "Operation failed", error=str(e))
+            return
+        self.store.update(job_id, JobStatus.COMPLETED, 100, "Operation completed", result=result)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def public_job(job: Dict) -> Dict:
+    """Job representation returned by the API (internal fields removed)"""
+    return {k: v for k, v in job.items() if k != "request_hash"}
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows; assume it is alive
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
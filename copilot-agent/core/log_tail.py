@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+CopilotPrivateAgent Real-Time Log Tail
+Follows copilot_agent.log and fans structured records out to subscribers
+
+Owner: Dib Anouar
+License: LUP v1.0 (personal and non-commercial use only)
+"""
+
+import os
+import re
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+# Matches the format configured in CopilotPrivateAgent._setup_logging
+LOG_LINE = re.compile(
+    r'^(?P<timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - '
+    r'(?P<logger>.+?) - (?P<level>[A-Z]+) - (?P<message>.*)$'
+)
+MODE_FIELD = re.compile(r'\bMode: (?P<mode>[A-Z]+)')
+TARGET_FIELD = re.compile(r'\bTarget: (?P<target>[^,\s]+)')
+
+
+def parse_log_line(line: str, previous: Optional[Dict] = None) -> Dict:
+    """Turn one log line into a structured record"""
+    match = LOG_LINE.match(line)
+    if not match:
+        # Continuation line (e.g. a traceback): inherit the previous record's fields
+        base = previous or {}
+        return {
+            "timestamp": base.get("timestamp"),
+            "logger": base.get("logger"),
+            "level": base.get("level", "INFO"),
+            "message": line,
+            "mode": base.get("mode"),
+            "target": base.get("target"),
+            "continuation": True
+        }
+
+    record = match.groupdict()
+    mode = MODE_FIELD.search(record["message"])
+    target = TARGET_FIELD.search(record["message"])
+    record["mode"] = mode.group("mode") if mode else None
+    record["target"] = target.group("target") if target else None
+    record["continuation"] = False
+    return record
+
+
+class LogSubscriber:
+    """A client of the tail with its own server-side filter and bounded queue"""
+
+    def __init__(self, level: Optional[str] = None, target: Optional[str] = None,
+                 mode: Optional[str] = None, queue_size: int = 256):
+        self.min_level = logging.getLevelName(level.upper()) if level else logging.NOTSET
+        if not isinstance(self.min_level, int):
+            raise ValueError(f"Unknown log level: {level}")
+        self.target = target
+        self.mode = mode.upper() if mode else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def matches(self, record: Dict) -> bool:
+        level = logging.getLevelName(record["level"])
+        if isinstance(level, int) and level < self.min_level:
+            return False
+        if self.target and record["target"] != self.target:
+            return False
+        if self.mode and record["mode"] != self.mode:
+            return False
+        return True
+
+    def offer(self, record: Dict):
+        """Enqueue without blocking the reader; a slow client loses its oldest records"""
+        if not self.matches(record):
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(record)
+
+
+class LogTailer:
+    """
+    Single reader for the agent log
+
+    Polls the file by offset (no extra dependencies, works on every
+    platform), handles truncation and rotation, and runs only while at
+    least one subscriber is connected.
+    """
+
+    def __init__(self, log_file: Path, poll_interval: float = 0.25, max_read: int = 1 << 20):
+        self.log_file = Path(log_file)
+        self.poll_interval = poll_interval
+        self.max_read = max_read
+        self.subscribers: Set[LogSubscriber] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, subscriber: LogSubscriber) -> LogSubscriber:
+        self.subscribers.add(subscriber)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._follow())
+        return subscriber
+
+    def unsubscribe(self, subscriber: LogSubscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _follow(self):
+        # New subscribers see records written from now on
+        offset, inode = self._stat_position()
+        pending = b''
+        previous = None
+
+        while self.subscribers:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                st = os.stat(self.log_file)
+            except OSError:
+                continue
+
+            if st.st_ino != inode or st.st_size < offset:
+                # Rotated or truncated: start over from the beginning
+                offset, inode, pending = 0, st.st_ino, b''
+            if st.st_size == offset:
+                continue
+
+            chunk = await asyncio.to_thread(self._read, offset)
+            offset += len(chunk)
+            pending += chunk
+
+            *lines, pending = pending.split(b'\n')
+            records: List[Dict] = []
+            for raw in lines:
+                line = raw.decode('utf-8', errors='replace').rstrip('\r')
+                if not line:
+                    continue
+                previous = parse_log_line(line, previous)
+                records.append(previous)
+
+            for subscriber in list(self.subscribers):
+                for record in records:
+                    subscriber.offer(record)
+
+    def _stat_position(self):
+        try:
+            st = os.stat(self.log_file)
+            return st.st_size, st.st_ino
+        except OSError:
+            return 0, None
+
+    def _read(self, offset: int) -> bytes:
+        with open(self.log_file, 'rb') as f:
+            f.seek(offset)
+            return f.read(self.max_read)
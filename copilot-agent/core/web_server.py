@@ -9,38 +9,71 @@ License: LUP v1.0 (personal and non-commercial use only)
 
 import os
 import json
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Request, Header, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional
 
-# Try to import aiofiles for async I/O, fallback to sync if not available
-try:
-    import aiofiles
-    HAS_AIOFILES = True
-except ImportError:
-    HAS_AIOFILES = False
-
 from copilot_agent import CopilotPrivateAgent
+from asset_cache import AssetCache
+from jobs import (JobStore, JobManager, JobQueueFull, IdempotencyConflict,
+                  TERMINAL_STATUSES, public_job)
+from ws_session import WebSocketSession
+from log_tail import LogTailer, LogSubscriber
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup/shutdown hooks for background services"""
+    yield
+    jobs.shutdown()
+    await log_tailer.stop()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="CopilotPrivateAgent API",
     description="DibTauroS/Ordo-ab-Chao cybersecurity framework web interface",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Initialize agent
 agent = CopilotPrivateAgent()
 
+# Static assets are loaded once and served from memory (ETag + gzip/br)
+BRANDING_DIR = Path(__file__).parent.parent / "branding"
+assets = AssetCache()
+assets.register("integration_js", Path(__file__).parent / "copilot_integration.js",
+                "application/javascript")
+assets.register("banner", BRANDING_DIR / "html_banner.html", "text/html; charset=utf-8")
+assets.register("splash", BRANDING_DIR / "splash.txt", "application/json",
+                transform=lambda raw: json.dumps({"splash": raw.decode("utf-8")}).encode("utf-8"))
+
+# Persistent job table shared by all workers (see jobs.py)
+job_store = JobStore(
+    Path(os.getenv("COPILOT_JOBS_DB", str(agent.logs_dir / "copilot_jobs.db"))),
+    retention_seconds=int(os.getenv("JOB_RETENTION_SECONDS", "86400")),
+    max_jobs=int(os.getenv("JOB_MAX_ENTRIES", "1000"))
+)
+jobs = JobManager(agent, job_store, max_workers=int(os.getenv("MAX_CONCURRENT_OPERATIONS", "5")))
+
+# Live log tail: one reader per process shared by all subscribers
+REAL_TIME_LOGGING = os.getenv("ENABLE_REAL_TIME_LOGGING", "true").lower() == "true"
+log_tailer = LogTailer(agent.logs_dir / "copilot_agent.log")
+
 # Request models
 class OperationRequest(BaseModel):
     prompt: str
     target: str = "localhost"
     dry_run: bool = True
 
+class JobRequest(OperationRequest):
+    idempotency_key: Optional[str] = None
+
 @app.get("/", response_class=HTMLResponse)
 async def web_interface():
     """Serve the main web interface"""
@@ -89,48 +122,128 @@ async def execute_operation(request: OperationRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/copilot/jobs", status_code=202)
+async def create_job(request: JobRequest, idempotency_key: Optional[str] = Header(None)):
+    """Queue an operation and return its job id immediately"""
+    key = idempotency_key or request.idempotency_key
+    try:
+        job, created = await run_in_threadpool(
+            jobs.submit, request.prompt, request.target, request.dry_run, key
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return JSONResponse(status_code=202 if created else 200, content=public_job(job))
+
+@app.get("/copilot/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get job status and, once finished, its result"""
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_job(job)
+
+@app.get("/copilot/jobs/{job_id}/events")
+async def stream_job(job_id: str):
+    """Stream job progress as Server-Sent Events until the job finishes"""
+    if await run_in_threadpool(job_store.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last = None
+        while True:
+            job = await run_in_threadpool(job_store.get, job_id)
+            if job is None:
+                yield "event: gone\ndata: {}\n\n"
+                return
+            state = (job["status"], job["progress"], job["message"])
+            if state != last:
+                last = state
+                yield f"event: progress\ndata: {json.dumps(public_job(job))}\n\n"
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.websocket("/copilot/ws")
+async def copilot_ws(websocket: WebSocket):
+    """Multiplexed session: many tagged operation requests over one connection"""
+    session = WebSocketSession(
+        agent, websocket,
+        max_inflight=int(os.getenv("WS_MAX_INFLIGHT", "8")),
+        send_queue_size=int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+    )
+    await session.run()
+
+@app.websocket("/copilot/logs/ws")
+async def tail_logs(websocket: WebSocket, level: Optional[str] = None,
+                    target: Optional[str] = None, mode: Optional[str] = None):
+    """Stream new log records, filtered server-side by level, target and mode"""
+    if not REAL_TIME_LOGGING:
+        await websocket.close(code=1008, reason="Real-time logging disabled")
+        return
+    try:
+        subscriber = LogSubscriber(level=level, target=target, mode=mode,
+                                   queue_size=int(os.getenv("LOG_TAIL_QUEUE_SIZE", "256")))
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+
+    await websocket.accept()
+    log_tailer.subscribe(subscriber)
+
+    async def drain_client():
+        # Detect disconnects even when no records are flowing
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    client = asyncio.create_task(drain_client())
+    try:
+        while not client.done():
+            getter = asyncio.create_task(subscriber.queue.get())
+            await asyncio.wait({getter, client}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                break
+            if subscriber.dropped:
+                await websocket.send_json({"type": "dropped", "count": subscriber.dropped})
+                subscriber.dropped = 0
+            await websocket.send_json({"type": "log", **getter.result()})
+    except Exception:
+        pass
+    finally:
+        log_tailer.unsubscribe(subscriber)
+        client.cancel()
+
 @app.get("/static/copilot_integration.js")
-async def serve_js():
-    """Serve the JavaScript integration file"""
-    js_file = Path(__file__).parent / "copilot_integration.js"
-    if js_file.exists():
-        return FileResponse(js_file, media_type="application/javascript")
-    else:
+async def serve_js(request: Request):
+    """Serve the JavaScript integration file (cached in memory)"""
+    response = assets.response("integration_js", request)
+    if response is None:
         raise HTTPException(status_code=404, detail="JavaScript file not found")
+    return response
 
 @app.get("/branding/banner")
-async def get_banner():
-    """Get HTML banner for branding (optimized with async I/O)"""
-    banner_file = Path(__file__).parent.parent / "branding" / "html_banner.html"
-    if banner_file.exists():
-        if HAS_AIOFILES:
-            # Use async I/O if available
-            async with aiofiles.open(banner_file, 'r') as f:
-                content = await f.read()
-            return HTMLResponse(content=content)
-        else:
-            # Fallback to sync I/O if aiofiles not available
-            with open(banner_file, 'r') as f:
-                return HTMLResponse(content=f.read())
-    else:
+async def get_banner(request: Request):
+    """Get HTML banner for branding (cached in memory)"""
+    response = assets.response("banner", request)
+    if response is None:
         return {"message": "Banner not found"}
+    return response
 
 @app.get("/branding/splash")
-async def get_splash():
-    """Get text splash banner (optimized with async I/O)"""
-    splash_file = Path(__file__).parent.parent / "branding" / "splash.txt"
-    if splash_file.exists():
-        if HAS_AIOFILES:
-            # Use async I/O if available
-            async with aiofiles.open(splash_file, 'r') as f:
-                content = await f.read()
-            return {"splash": content}
-        else:
-            # Fallback to sync I/O if aiofiles not available
-            with open(splash_file, 'r') as f:
-                return {"splash": f.read()}
-    else:
+async def get_splash(request: Request):
+    """Get text splash banner (cached in memory)"""
+    response = assets.response("splash", request)
+    if response is None:
         return {"splash": "CopilotPrivateAgent - DibTauroS Framework"}
+    return response
 
 if __name__ == "__main__":
     import uvicorn
@@ -138,10 +251,18 @@ if __name__ == "__main__":
     # Security: only bind to localhost
     host = os.getenv("COPILOT_HOST", "127.0.0.1")
     port = int(os.getenv("COPILOT_PORT", "8787"))
+    # Multi-process mode: workers coordinate the audit chain and log via file locks
+    workers = int(os.getenv("COPILOT_WORKERS", "1"))
     
     print(f"Starting CopilotPrivateAgent web server on {host}:{port}")
     print("Framework: DibTauroS/Ordo-ab-Chao")
     print("Owner: Dib Anouar")
     print("License: LUP v1.0")
     
-    uvicorn.run(app, host=host, port=port, log_level="info")
\ No newline at end of file
+    if workers > 1:
+        print(f"Workers: {workers}")
+        # uvicorn needs an import string to spawn worker processes
+        uvicorn.run("web_server:app", host=host, port=port, workers=workers,
+                    app_dir=str(Path(__file__).parent), log_level="info")
+    else:
+        uvicorn.run(app, host=host, port=port, log_level="info")
\ No newline at end of file
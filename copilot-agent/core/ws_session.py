@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+CopilotPrivateAgent WebSocket Session
+Multiplexes many operation requests over one WebSocket connection
+
+Owner: Dib Anouar
+License: LUP v1.0 (personal and non-commercial use only)
+
+Protocol (JSON text frames):
+    client -> {"id": "1", "type": "execute", "prompt": "...", "target": "localhost", "dry_run": true}
+    client -> {"id": "2", "type": "status"}
+    client -> {"id": "3", "type": "ping"}
+    server -> {"id": "1", "type": "result", "data": {...}}
+    server -> {"id": "1", "type": "error", "message": "..."}
+"""
+
+import asyncio
+from typing import Dict, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+
+
+class WebSocketSession:
+    """
+    One client connection
+
+    Requests run concurrently, each tagged with the client's request id.
+    Backpressure: at most ``max_inflight`` requests run per connection (the
+    socket is not read while the limit is reached), and outgoing messages go
+    through a bounded queue drained by a single sender.
+    """
+
+    def __init__(self, agent, websocket: WebSocket, max_inflight: int = 8, send_queue_size: int = 64):
+        self.agent = agent
+        self.websocket = websocket
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=send_queue_size)
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def run(self):
+        """Serve the connection until the client disconnects"""
+        await self.websocket.accept()
+        sender = asyncio.create_task(self._sender())
+        try:
+            while True:
+                await self._inflight.acquire()
+                try:
+                    message = await self.websocket.receive_json()
+                except BaseException:
+                    self._inflight.release()
+                    raise
+                task = asyncio.create_task(self._handle(message))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        except WebSocketDisconnect:
+            pass
+        except ValueError:
+            # Non-JSON frame: protocol violation, close the session
+            await self.websocket.close(code=1003)
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            sender.cancel()
+
+    async def _sender(self):
+        """Single writer: drains the outbox so frames are never interleaved"""
+        while True:
+            message = await self._outbox.get()
+            try:
+                await self.websocket.send_json(message)
+            except Exception:
+                return
+
+    async def _send(self, request_id: Optional[str], msg_type: str, **fields):
+        await self._outbox.put({"id": request_id, "type": msg_type, **fields})
+
+    async def _handle(self, message: Dict):
+        request_id = message.get("id") if isinstance(message, dict) else None
+        try:
+            if not isinstance(message, dict):
+                await self._send(None, "error", message="Message must be a JSON object")
+                return
+
+            msg_type = message.get("type")
+            if msg_type == "execute":
+                prompt = message.get("prompt")
+                if not isinstance(prompt, str) or not prompt.strip():
+                    await self._send(request_id, "error", message="'prompt' is required")
+                    return
+                result = await run_in_threadpool(
+                    self.agent.execute_operation,
+                    prompt=prompt,
+                    target=message.get("target", "localhost"),
+                    dry_run=bool(message.get("dry_run", True))
+                )
+                await self._send(request_id, "result", data=result)
+            elif msg_type == "status":
+                status = await run_in_threadpool(self.agent.get_status)
+                await self._send(request_id, "result", data=status)
+            elif msg_type == "ping":
+                await self._send(request_id, "pong")
+            else:
+                await self._send(request_id, "error", message=f"Unknown message type: {msg_type}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._send(request_id, "error", message=str(e))
+        finally:
+            self._inflight.release()
@@ -0,0 +1,15 @@
+"""
+Test fixtures for the CopilotPrivateAgent server modules
+
+The modules in core/ import each other by bare name (as when web_server.py
+is started from that directory), so core/ is put on sys.path.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "core"))
@@ -0,0 +1,167 @@
+"""In-memory static asset cache: ETags, precompressed variants, reload on change"""
+
+import gzip
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import asset_cache
+from asset_cache import AssetCache
+
+BODY = b"console.log('copilot');\n" * 64
+
+
+@pytest.fixture
+def asset(tmp_path):
+    path = tmp_path / "app.js"
+    path.write_bytes(BODY)
+    return path
+
+
+def make_client(cache, name="app"):
+    app = FastAPI()
+
+    @app.get("/asset")
+    async def serve(request: Request):
+        return cache.response(name, request)
+
+    return TestClient(app)
+
+
+def get(client, **headers):
+    # httpx would decode the body: keep the encoded bytes for the checks
+    headers.setdefault("accept-encoding", "identity")
+    with client.stream("GET", "/asset", headers=headers) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_identity_response_with_strong_etag(asset):
+    cache = AssetCache()
+    cache.register("app", asset, "application/javascript")
+
+    response, body = get(make_client(cache))
+
+    assert response.status_code == 200
+    assert body == BODY
+    assert "content-encoding" not in response.headers
+    assert response.headers["etag"].startswith('"') and not response.headers["etag"].startswith('W/')
+    assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_gzip_variant_is_precompressed(asset):
+    cache = AssetCache()
+    cache.register("app", asset, "application/javascript")
+
+    response, body = get(make_client(cache), **{"accept-encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(body) == BODY
+    assert body == cache.get("app").variants["gzip"]
+    # Each representation has its own ETag
+    assert response.headers["etag"] == cache.get("app").etag_for("gzip")
+
+
+@pytest.mark.skipif(not asset_cache.HAS_BROTLI, reason="brotli not installed")
+def test_brotli_preferred_when_accepted(asset):
+    cache = AssetCache()
+    cache.register("app", asset, "application/javascript")
+
+    response, _ = get(make_client(cache), **{"accept-encoding": "gzip, br"})
+
+    assert response.headers["content-encoding"] == "br"
+
+
+def test_rejected_encoding_not_used(asset):
+    cache = AssetCache()
+    cache.register("app", asset, "application/javascript")
+
+    response, body = get(make_client(cache), **{"accept-encoding": "gzip;q=0, identity"})
+
+    assert "content-encoding" not in response.headers
+    assert body == BODY
+
+
+def test_small_assets_not_compressed(tmp_path):
+    path = tmp_path / "tiny.txt"
+    path.write_bytes(b"ok")
+    cache = AssetCache(min_compress_size=256)
+    cache.register("tiny", path, "text/plain")
+
+    assert cache.get("tiny").variants == {}
+
+
+def test_if_none_match_returns_304(asset):
+    cache = AssetCache()
+    cache.register("app", asset, "application/javascript")
+    client = make_client(cache)
+    first, _ = get(client, **{"accept-encoding": "gzip"})
+
+    response, body = get(client, **{"accept-encoding": "gzip", "if-none-match": f'W/{first.headers["etag"]}'})
+
+    assert response.status_code == 304
+    assert body == b""
+    assert response.headers["etag"] == first.headers["etag"]
+
+    # The gzip ETag does not validate the identity representation
+    response, _ = get(client, **{"if-none-match": first.headers["etag"]})
+    assert response.status_code == 200
+
+
+def test_reloads_when_file_changes(asset):
+    cache = AssetCache()
+    cache.register("app", asset, "application/javascript")
+    old = cache.get("app")
+
+    asset.write_bytes(BODY + b"// v2\n")
+    st = asset.stat()
+    os.utime(asset, ns=(st.st_atime_ns, old.mtime_ns + 10**9))
+    new = cache.get("app")
+
+    assert new is not old
+    assert new.body.endswith(b"// v2\n")
+    assert new.etag != old.etag
+
+
+def test_unchanged_file_is_not_reread(asset, monkeypatch):
+    cache = AssetCache()
+    cache.register("app", asset, "application/javascript")
+    first = cache.get("app")
+
+    def fail(*args):
+        raise AssertionError("asset reloaded")
+
+    monkeypatch.setattr(cache, "_load", fail)
+    assert cache.get("app") is first
+
+
+def test_missing_file_gives_no_response(tmp_path):
+    cache = AssetCache()
+    cache.register("gone", tmp_path / "missing.js", "application/javascript")
+
+    assert cache.get("gone") is None
+    app = FastAPI()
+
+    @app.get("/asset")
+    async def serve(request: Request):
+        return cache.response("gone", request) or {"fallback": True}
+
+    assert TestClient(app).get("/asset").json() == {"fallback": True}
+
+
+def test_transform_applied_once(tmp_path):
+    path = tmp_path / "splash.txt"
+    path.write_text("ciao", encoding="utf-8")
+    calls = []
+
+    def transform(raw):
+        calls.append(raw)
+        return raw.upper()
+
+    cache = AssetCache()
+    cache.register("splash", path, "text/plain", transform=transform)
+    cache.get("splash")
+
+    assert cache.get("splash").body == b"CIAO"
+    assert len(calls) == 1
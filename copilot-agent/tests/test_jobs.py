@@ -0,0 +1,200 @@
+"""Persistent job table: idempotency, bounds, retention and orphaned jobs"""
+
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from jobs import IdempotencyConflict, JobManager, JobQueueFull, JobStatus, JobStore, public_job
+
+REQUEST = {"prompt": "scan", "target": "localhost", "dry_run": True}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(tmp_path / "jobs.db", retention_seconds=3600, max_jobs=3)
+
+
+def set_column(store, job_id, column, value):
+    with sqlite3.connect(store.db_path) as conn:
+        conn.execute(f"UPDATE jobs SET {column} = ? WHERE id = ?", (value, job_id))
+
+
+def finish(store, job_id, finished_at=None):
+    store.update(job_id, JobStatus.COMPLETED, 100, "done", result={"ok": True})
+    if finished_at is not None:
+        set_column(store, job_id, "finished_at", finished_at)
+
+
+def test_create_queues_job(store):
+    job, created = store.create(REQUEST)
+
+    assert created
+    assert job["status"] == "queued"
+    assert job["request"] == REQUEST
+    assert job["finished_at"] is None
+    assert "request_hash" not in public_job(job)
+
+
+def test_same_key_same_request_returns_original(store):
+    job, _ = store.create(REQUEST, "key-1")
+    again, created = store.create(dict(REQUEST), "key-1")
+
+    assert not created
+    assert again["id"] == job["id"]
+
+
+def test_same_key_other_request_conflicts(store):
+    store.create(REQUEST, "key-1")
+
+    with pytest.raises(IdempotencyConflict):
+        store.create({**REQUEST, "target": "10.0.0.1"}, "key-1")
+
+
+def test_key_inserted_concurrently_is_replayed(store, monkeypatch):
+    # Another worker inserts the same key between the lookup and the insert
+    job, _ = store.create(REQUEST, "key-1")
+    lookups = iter([None, job])
+    monkeypatch.setattr(store, "_get_by_key", lambda key: next(lookups))
+
+    again, created = store.create(REQUEST, "key-1")
+
+    assert not created
+    assert again["id"] == job["id"]
+
+
+def test_active_jobs_bounded(store):
+    for _ in range(3):
+        store.create(REQUEST)
+
+    with pytest.raises(JobQueueFull):
+        store.create(REQUEST)
+
+
+def test_finished_jobs_free_slots(store):
+    jobs = [store.create(REQUEST)[0] for _ in range(3)]
+    finish(store, jobs[0]["id"])
+
+    _, created = store.create(REQUEST)
+    assert created
+
+
+def test_update_records_result_and_finish_time(store):
+    job, _ = store.create(REQUEST)
+    store.update(job["id"], JobStatus.RUNNING, 10, "running")
+    assert store.get(job["id"])["finished_at"] is None
+
+    finish(store, job["id"])
+    done = store.get(job["id"])
+
+    assert done["status"] == "completed"
+    assert done["progress"] == 100
+    assert done["result"] == {"ok": True}
+    assert done["finished_at"] is not None
+
+
+def test_purge_drops_jobs_past_retention(store):
+    old, _ = store.create(REQUEST)
+    recent, _ = store.create(REQUEST)
+    running, _ = store.create(REQUEST)
+    finish(store, old["id"], finished_at=time.time() - 7200)
+    finish(store, recent["id"])
+    set_column(store, running["id"], "created_at", time.time() - 7200)
+
+    store.purge(force=True)
+
+    assert store.get(old["id"]) is None
+    assert store.get(recent["id"]) is not None
+    # Unfinished jobs are never purged
+    assert store.get(running["id"]) is not None
+
+
+def test_purge_keeps_newest_finished_jobs(store):
+    now = time.time()
+    ids = []
+    for age in range(5):
+        job, _ = store.create(REQUEST)
+        finish(store, job["id"], finished_at=now - age)
+        ids.append(job["id"])
+
+    store.purge(force=True)
+
+    assert [store.get(job_id) is not None for job_id in ids] == [True, True, True, False, False]
+
+
+def test_purge_is_rate_limited(store):
+    job, _ = store.create(REQUEST)
+    finish(store, job["id"], finished_at=time.time() - 7200)
+    store.purge(force=True)
+    stale, _ = store.create(REQUEST)
+    finish(store, stale["id"], finished_at=time.time() - 7200)
+
+    store.purge()
+    assert store.get(stale["id"]) is not None
+
+    store.purge(force=True)
+    assert store.get(stale["id"]) is None
+
+
+def test_fail_orphans_marks_jobs_of_dead_workers(store):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    orphan, _ = store.create(REQUEST)
+    set_column(store, orphan["id"], "pid", dead.pid)
+    mine, _ = store.create(REQUEST)
+
+    store.fail_orphans()
+
+    failed = store.get(orphan["id"])
+    assert failed["status"] == "failed"
+    assert failed["finished_at"] is not None
+    assert store.get(mine["id"])["status"] == "queued"
+
+
+class FakeAgent:
+    def __init__(self, error=None):
+        self.error = error
+
+    def execute_operation(self, prompt, target="localhost", dry_run=True):
+        if self.error:
+            raise self.error
+        return {"status": "simulated", "prompt": prompt}
+
+
+def wait_finished(store, job_id):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        job = store.get(job_id)
+        if job["finished_at"] is not None:
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def test_manager_runs_job_once(store):
+    manager = JobManager(FakeAgent(), store, max_workers=1)
+    try:
+        job, created = manager.submit("scan", "localhost", True, "key-1")
+        replay, replay_created = manager.submit("scan", "localhost", True, "key-1")
+        done = wait_finished(store, job["id"])
+    finally:
+        manager.shutdown()
+
+    assert created and not replay_created
+    assert replay["id"] == job["id"]
+    assert done["status"] == "completed"
+    assert done["result"] == {"status": "simulated", "prompt": "scan"}
+
+
+def test_manager_records_failure(store):
+    manager = JobManager(FakeAgent(RuntimeError("boom")), store, max_workers=1)
+    try:
+        job, _ = manager.submit("scan", "localhost", True)
+        done = wait_finished(store, job["id"])
+    finally:
+        manager.shutdown()
+
+    assert done["status"] == "failed"
+    assert done["error"] == "boom"
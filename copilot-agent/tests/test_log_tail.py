@@ -0,0 +1,172 @@
+"""Real-time log tail: parsing, server-side filters, rotation and truncation"""
+
+import asyncio
+import os
+
+import pytest
+
+from log_tail import LogSubscriber, LogTailer, parse_log_line
+
+
+def line(level, message, timestamp="2026-10-19 10:00:00,000"):
+    return f"{timestamp} - CopilotPrivateAgent - {level} - {message}\n"
+
+
+def append(path, *lines):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(lines))
+
+
+async def receive(subscriber, count, timeout=2):
+    return [await asyncio.wait_for(subscriber.queue.get(), timeout) for _ in range(count)]
+
+
+async def settle(tailer):
+    """Let the reader run a few polls"""
+    await asyncio.sleep(tailer.poll_interval * 5)
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = tmp_path / "copilot_agent.log"
+    path.write_text(line("INFO", "written before the tail started"), encoding="utf-8")
+    return path
+
+
+def run(scenario):
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+
+def test_parse_structured_fields():
+    record = parse_log_line(line("INFO", "Operation requested - Mode: TEST, Target: 10.0.0.1, Wassim: True").rstrip())
+
+    assert record["level"] == "INFO"
+    assert record["mode"] == "TEST"
+    assert record["target"] == "10.0.0.1"
+    assert not record["continuation"]
+
+
+def test_continuation_inherits_previous_record():
+    error = parse_log_line(line("ERROR", "Operation failed - Target: localhost").rstrip())
+    trace = parse_log_line('  File "copilot_agent.py", line 1', error)
+
+    assert trace["continuation"]
+    assert trace["level"] == "ERROR" and trace["target"] == "localhost"
+
+
+def test_unknown_level_rejected():
+    with pytest.raises(ValueError):
+        LogSubscriber(level="LOUD")
+
+
+def test_new_lines_only(log_file):
+    async def scenario():
+        tailer = LogTailer(log_file, poll_interval=0.01)
+        subscriber = tailer.subscribe(LogSubscriber())
+        await settle(tailer)
+        append(log_file, line("INFO", "first"), line("WARNING", "second"))
+        records = await receive(subscriber, 2)
+        tailer.unsubscribe(subscriber)
+        assert [r["message"] for r in records] == ["first", "second"]
+        assert subscriber.queue.empty()
+
+    run(scenario)
+
+
+def test_partial_line_waits_for_newline(log_file):
+    async def scenario():
+        tailer = LogTailer(log_file, poll_interval=0.01)
+        subscriber = tailer.subscribe(LogSubscriber())
+        await settle(tailer)
+        full = line("INFO", "split in two writes")
+        append(log_file, full[:20])
+        await settle(tailer)
+        assert subscriber.queue.empty()
+        append(log_file, full[20:])
+        (record,) = await receive(subscriber, 1)
+        tailer.unsubscribe(subscriber)
+        assert record["message"] == "split in two writes"
+
+    run(scenario)
+
+
+def test_filters_applied_server_side(log_file):
+    async def scenario():
+        tailer = LogTailer(log_file, poll_interval=0.01)
+        warnings = tailer.subscribe(LogSubscriber(level="warning"))
+        test_mode = tailer.subscribe(LogSubscriber(mode="test", target="10.0.0.1"))
+        await settle(tailer)
+        append(log_file,
+               line("INFO", "Operation requested - Mode: TEST, Target: 10.0.0.1"),
+               line("INFO", "Operation requested - Mode: SAFE, Target: 10.0.0.1"),
+               line("INFO", "Operation requested - Mode: TEST, Target: localhost"),
+               line("ERROR", "Operation failed"),
+               "Traceback (most recent call last):\n")
+        errors = await receive(warnings, 2)
+        matched = await receive(test_mode, 1)
+        await settle(tailer)
+        tailer.unsubscribe(warnings)
+        tailer.unsubscribe(test_mode)
+        assert [r["message"] for r in errors] == ["Operation failed", "Traceback (most recent call last):"]
+        assert matched[0]["mode"] == "TEST" and matched[0]["target"] == "10.0.0.1"
+        assert warnings.queue.empty() and test_mode.queue.empty()
+
+    run(scenario)
+
+
+def test_truncation_restarts_from_beginning(log_file):
+    async def scenario():
+        tailer = LogTailer(log_file, poll_interval=0.01)
+        subscriber = tailer.subscribe(LogSubscriber())
+        await settle(tailer)
+        log_file.write_text(line("INFO", "after truncate"), encoding="utf-8")
+        (record,) = await receive(subscriber, 1)
+        tailer.unsubscribe(subscriber)
+        assert record["message"] == "after truncate"
+
+    run(scenario)
+
+
+def test_rotation_follows_new_file(log_file):
+    async def scenario():
+        tailer = LogTailer(log_file, poll_interval=0.01)
+        subscriber = tailer.subscribe(LogSubscriber())
+        await settle(tailer)
+        os.rename(log_file, log_file.with_suffix(".log.1"))
+        # Longer than the old file, so only the inode reveals the rotation
+        append(log_file, line("INFO", "in the new file " + "x" * 200))
+        (record,) = await receive(subscriber, 1)
+        tailer.unsubscribe(subscriber)
+        assert record["message"].startswith("in the new file")
+
+    run(scenario)
+
+
+def test_slow_subscriber_drops_oldest(log_file):
+    async def scenario():
+        tailer = LogTailer(log_file, poll_interval=0.01)
+        subscriber = tailer.subscribe(LogSubscriber(queue_size=2))
+        await settle(tailer)
+        append(log_file, *(line("INFO", f"record {i}") for i in range(5)))
+        await settle(tailer)
+        tailer.unsubscribe(subscriber)
+        kept = [subscriber.queue.get_nowait()["message"] for _ in range(subscriber.queue.qsize())]
+        assert kept == ["record 3", "record 4"]
+        assert subscriber.dropped == 3
+
+    run(scenario)
+
+
+def test_reader_runs_only_with_subscribers(log_file):
+    async def scenario():
+        tailer = LogTailer(log_file, poll_interval=0.01)
+        first = tailer.subscribe(LogSubscriber())
+        second = tailer.subscribe(LogSubscriber())
+        task = tailer._task
+        tailer.unsubscribe(first)
+        assert tailer._task is task and not task.done()
+        tailer.unsubscribe(second)
+        await asyncio.sleep(0)
+        assert tailer._task is None and task.cancelled()
+
+    run(scenario)
@@ -0,0 +1,169 @@
+"""WebSocket session: tagged requests multiplexed over one connection"""
+
+import asyncio
+import threading
+
+import pytest
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+from ws_session import WebSocketSession
+
+
+class FakeAgent:
+    def __init__(self):
+        self.status_on_loop = None
+
+    def get_status(self):
+        try:
+            asyncio.get_running_loop()
+            self.status_on_loop = True
+        except RuntimeError:
+            self.status_on_loop = False
+        return {"mode": "SAFE"}
+
+    def execute_operation(self, prompt, target="localhost", dry_run=True):
+        return {"status": "simulated", "prompt": prompt, "target": target, "dry_run": dry_run}
+
+
+def make_client(agent, **session_options):
+    app = FastAPI()
+
+    @app.websocket("/ws")
+    async def endpoint(websocket: WebSocket):
+        await WebSocketSession(agent, websocket, **session_options).run()
+
+    return TestClient(app)
+
+
+def test_status_runs_off_the_event_loop():
+    agent = FakeAgent()
+    with make_client(agent).websocket_connect("/ws") as ws:
+        ws.send_json({"id": "1", "type": "status"})
+        assert ws.receive_json() == {"id": "1", "type": "result", "data": {"mode": "SAFE"}}
+    assert agent.status_on_loop is False
+
+
+def test_execute_replies_with_result_only():
+    with make_client(FakeAgent()).websocket_connect("/ws") as ws:
+        ws.send_json({"id": "7", "type": "execute", "prompt": "scan", "target": "10.0.0.1"})
+        reply = ws.receive_json()
+    assert reply["id"] == "7"
+    assert reply["type"] == "result"
+    assert reply["data"]["target"] == "10.0.0.1"
+    assert reply["data"]["dry_run"] is True
+
+
+class BlockingAgent(FakeAgent):
+    """execute_operation for prompt "slow" waits until released"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        # Never hang the suite if the order under test is wrong
+        threading.Timer(5, self.release.set).start()
+
+    def execute_operation(self, prompt, target="localhost", dry_run=True):
+        if prompt == "slow":
+            self.release.wait()
+        return super().execute_operation(prompt, target, dry_run)
+
+
+def test_requests_run_concurrently_and_reply_by_id():
+    agent = BlockingAgent()
+    with make_client(agent).websocket_connect("/ws") as ws:
+        ws.send_json({"id": "slow", "type": "execute", "prompt": "slow"})
+        ws.send_json({"id": "fast", "type": "execute", "prompt": "fast"})
+        ws.send_json({"id": "p", "type": "ping"})
+        early = [ws.receive_json(), ws.receive_json()]
+        released = not agent.release.is_set()
+        agent.release.set()
+        late = ws.receive_json()
+
+    assert released
+    assert {(m["id"], m["type"]) for m in early} == {("fast", "result"), ("p", "pong")}
+    assert late["id"] == "slow" and late["data"]["prompt"] == "slow"
+
+
+def test_inflight_limit_stops_reading():
+    # With one request in flight the ping is not even read until the slow request ends
+    agent = BlockingAgent()
+    with make_client(agent, max_inflight=1).websocket_connect("/ws") as ws:
+        ws.send_json({"id": "slow", "type": "execute", "prompt": "slow"})
+        ws.send_json({"id": "p", "type": "ping"})
+        threading.Timer(0.3, agent.release.set).start()
+        order = [ws.receive_json()["id"], ws.receive_json()["id"]]
+
+    assert order == ["slow", "p"]
+
+
+@pytest.mark.parametrize("message, error", [
+    ({"id": "1", "type": "reboot"}, "Unknown message type: reboot"),
+    ({"id": "1", "type": "execute", "prompt": "  "}, "'prompt' is required"),
+    ([1, 2], "Message must be a JSON object"),
+])
+def test_invalid_requests_get_errors(message, error):
+    with make_client(FakeAgent()).websocket_connect("/ws") as ws:
+        ws.send_json(message)
+        reply = ws.receive_json()
+        # The session stays usable
+        ws.send_json({"id": "2", "type": "ping"})
+        pong = ws.receive_json()
+
+    assert reply["type"] == "error" and reply["message"] == error
+    assert reply["id"] == (None if isinstance(message, list) else "1")
+    assert pong == {"id": "2", "type": "pong"}
+
+
+def test_non_json_frame_closes_session():
+    with make_client(FakeAgent()).websocket_connect("/ws") as ws:
+        ws.send_text("not json")
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+
+    assert closed.value.code == 1003
+
+
+class FakeWebSocket:
+    """In-memory socket whose sends block until ``gate`` is opened"""
+
+    def __init__(self, messages):
+        self.incoming = asyncio.Queue()
+        for message in messages:
+            self.incoming.put_nowait(message)
+        self.sent = []
+        self.gate = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def receive_json(self):
+        return await self.incoming.get()
+
+    async def send_json(self, message):
+        await self.gate.wait()
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        pass
+
+
+def test_slow_client_backpressure():
+    async def scenario():
+        socket = FakeWebSocket([{"id": str(i), "type": "ping"} for i in range(6)])
+        session = WebSocketSession(FakeAgent(), socket, max_inflight=2, send_queue_size=1)
+        runner = asyncio.create_task(session.run())
+        await asyncio.sleep(0.1)
+        # One reply being sent, one queued, two handlers waiting on the full queue:
+        # with both in-flight slots taken the remaining requests stay unread
+        unread = socket.incoming.qsize()
+        socket.gate.set()
+        while len(socket.sent) < 6:
+            await asyncio.sleep(0.01)
+        runner.cancel()
+        return unread, socket.sent
+
+    unread, sent = asyncio.run(asyncio.wait_for(scenario(), 5))
+
+    assert unread == 2
+    assert sorted(m["id"] for m in sent) == [str(i) for i in range(6)]
@@ -7,290 +7,3982 @@ Salva tutti i progressi con timestamp e log dettagliati
 """
 
 import os
+import re
 import sys
+import math
+import bisect
 import json
+import stat
+import time
+import zlib
+import errno
+import struct
+import sqlite3
+import difflib
 import shutil
 import hashlib
+import getpass
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+# zstandard è opzionale: senza, gli archivi usano gzip
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+# watchdog è opzionale: senza, il watch controlla il progetto a intervalli
+try:
+    from watchdog.observers import Observer
+    HAS_WATCHDOG = True
+except ImportError:
+    HAS_WATCHDOG = False
+
+# cryptography è opzionale: senza, gli archivi cifrati (--encrypt) non sono disponibili
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+    HAS_CRYPTOGRAPHY = True
+except ImportError:
+    HAS_CRYPTOGRAPHY = False
+
+# fcntl esiste solo su POSIX: altrove uno snapshot interrotto viene ripreso senza
+# controllare che un altro processo lo stia ancora scrivendo
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+# psutil è opzionale: senza, --nice abbassa solo la priorità di CPU e non quella di I/O
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
 # Configurazione
 PROJECT_ROOT = Path(__file__).parent
 BACKUP_DIR = PROJECT_ROOT / "backups"
+OBJECTS_DIR = BACKUP_DIR / "objects"
 LOG_FILE = PROJECT_ROOT / "scatola-nera.log"
 STATE_FILE = PROJECT_ROOT / "scatola-nera-state.json"
+STAT_CACHE_FILE = BACKUP_DIR / "stat-cache.json"
+REFCOUNT_FILE = BACKUP_DIR / "refcounts.json"
+SCRUB_STATE_FILE = BACKUP_DIR / "scrub-state.json"
+HISTORY_FILE = BACKUP_DIR / "history.db"
+MATERIALIZE_DIR = BACKUP_DIR / "materialized"
+ARCHIVE_INDEX_DIR = BACKUP_DIR / "archive-index"
+QUARANTINE_DIR = BACKUP_DIR / "quarantine"
+
+# Ogni quanti giorni ignorare la stat cache e rielaborare tutti gli hash
+PARANOID_INTERVAL_DAYS = 7
+
+# Thread per hashing e copia (configurabile con --workers=N) e buffer di lettura
+DEFAULT_WORKERS = min(32, os.cpu_count() or 4)
+READ_BUFFER_SIZE = 1024 * 1024
+
+# Algoritmo degli hash di contenuto (i manifest più vecchi usano md5)
+HASH_ALGORITHM = 'blake2b'
 
-# Escludi questi file/cartelle dal backup
+# Content-defined chunking: i file grandi sono divisi in chunk i cui tagli dipendono
+# solo dal contenuto locale, così una modifica o un append salvano solo i chunk nuovi
+CHUNK_THRESHOLD = 8 * 1024 * 1024
+CHUNK_MIN_SIZE = 512 * 1024
+CHUNK_MAX_SIZE = 4 * 1024 * 1024
+CHUNK_WINDOW = 64
+
+# Escludi questi file/cartelle dal backup (sintassi .gitignore: un nome senza "/"
+# corrisponde a file o cartelle con quel nome a qualsiasi profondità)
 EXCLUDE_PATTERNS = [
-    'backups',
+    '/backups/',
     '.git',
-    'node_modules',
-    '__pycache__',
+    'node_modules/',
+    '__pycache__/',
     '*.pyc',
     '.DS_Store',
-    'build',
-    'dist',
+    'build/',
+    'dist/',
     '*.apk',
     '*.aab',
-    '.gradle'
+    '.gradle/',
+    # Log e stato della scatola nera cambiano a ogni esecuzione
+    '/scatola-nera.log',
+    '/scatola-nera-state.json'
 ]
 
-class ScatolaNera:
+# Applica anche le regole dei file .gitignore del progetto
+USE_GITIGNORE = True
+
+# Usa stat e id degli oggetti dell'index di git per i file tracciati (anche con --git)
+USE_GIT_INDEX = False
+# Id di oggetti git -> hash dei contenuti ricordati nella stat cache (i meno usati escono per primi)
+GIT_OID_CACHE_SIZE = 200000
+
+# Formato degli snapshot: 1 = copia completa dei file, 2 = manifest JSON + blob store,
+# 3 = manifest indicizzato (SQLite, una riga per file ordinata per percorso) + blob store
+SNAPSHOT_FORMAT = 3
+MANIFEST_FILE = 'manifest.db'
+LEGACY_MANIFEST_FILE = 'metadata.json'
+
+# Snapshot in corso: cartella di lavoro (rinominata solo a snapshot completo) con il
+# journal dei file già salvati, per riprendere dopo un'interruzione
+STAGING_SUFFIX = '.tmp'
+JOURNAL_FILE = 'journal.jsonl'
+JOURNAL_SYNC_SECONDS = 5
+
+# Lock della cartella dei backup: esclusivo per chi la modifica, condiviso per la replica
+REPO_LOCK_FILE = BACKUP_DIR / ".lock"
+
+# Replica (replicate): lock contro esecuzioni sovrapposte e journal dei blob in copia
+REPLICA_LOCK_FILE = 'replicate.lock'
+REPLICA_JOURNAL_FILE = 'replicate-journal.txt'
+
+# Durante l'hashing la stat cache viene salvata periodicamente (ripresa della scansione)
+SCAN_CHECKPOINT_SECONDS = 30
+
+# Backup in sottofondo (--limit, --nice, --pause-when-busy)
+THROTTLE_BURST_SECONDS = 1  # credito massimo del limite di banda, in secondi di trasferimento
+NICE_INCREMENT = 10
+BUSY_CHECK_INTERVAL = 2
+# Job dell'agent ancora attivi (finished_at vuoto): stessa variabile e percorso di web_server.py
+AGENT_JOBS_DB = Path(os.environ.get('COPILOT_JOBS_DB', PROJECT_ROOT / "logs" / "copilot_jobs.db"))
+
+# Archivi: snapshot in un unico file compresso (snapshot --archive, export)
+ARCHIVE_SUFFIX = '.snar'
+ARCHIVE_COMPRESSION = 'gzip'
+ARCHIVE_CODECS = ('gzip', 'zstd')
+ARCHIVE_READ_SIZE = 64 * 1024
+
+# Archivi cifrati (--encrypt): membri e indice divisi in frame autenticati uno per uno,
+# con una chiave derivata dalla passphrase (scrypt, sale casuale per archivio)
+ENCRYPTION_CIPHERS = ('aes-gcm', 'chacha20')
+ENCRYPTION_FRAME_SIZE = 1024 * 1024
+PASSPHRASE_ENV = 'SCATOLA_NERA_PASSPHRASE'
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 15, 8, 1
+
+# Oltre questa lunghezza la catena di incrementali viene compattata in uno snapshot completo
+MAX_CHAIN_LENGTH = 10
+
+# Retention (prune): ultimi N snapshot, più il più recente di ogni giorno/settimana
+RETENTION_KEEP_LAST = 10
+RETENTION_KEEP_DAILY = 7
+RETENTION_KEEP_WEEKLY = 4
+
+# Watch: attesa di quiete dopo l'ultimo evento, ritardo massimo di un backup,
+# intervallo del controllo a polling e del backup completo di riallineamento
+WATCH_DEBOUNCE_SECONDS = 2
+WATCH_MAX_DELAY_SECONDS = 30
+WATCH_POLL_INTERVAL = 5
+WATCH_FULL_SCAN_INTERVAL = 3600
+
+# diff --content: oltre questa dimensione (per versione) il diff testuale non viene mostrato
+DIFF_MAX_SIZE = 1024 * 1024
+
+# Con prune --full i blob non referenziati più vecchi di così vengono rimossi
+ORPHAN_GRACE_SECONDS = 3600
+
+
+class IOThrottle:
+    """
+    Limiti di I/O condivisi da tutti i thread di un'esecuzione
+
+    Un token bucket limita i byte letti o copiati al secondo (--limit) e,
+    se configurato, il lavoro si ferma finché ``busy_check`` indica che
+    l'agent è occupato (--pause-when-busy). Ogni ciclo di lettura o copia
+    chiama consume() a ogni blocco; senza limiti il costo è un solo test.
+    """
+
     def __init__(self):
-        self.backup_dir = BACKUP_DIR
-        self.log_file = LOG_FILE
-        self.state_file = STATE_FILE
-        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.active = False
+        self.rate = 0
+        self.busy_check = None
+        self.log = print
+        self._lock = threading.Lock()
+        self._busy_lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._next_check = 0.0
+
+    def configure(self, rate=0, busy_check=None, log=print):
+        """``rate`` in byte/s (0 = nessun limite); ``busy_check`` restituisce il motivo di una pausa o None"""
+        self.rate = rate
+        self.busy_check = busy_check
+        self.log = log
+        self.active = bool(rate or busy_check)
+        self._tokens = 0.0
+        self._last = time.monotonic()
+
+    def consume(self, num_bytes):
+        """Conta ``num_bytes`` di I/O e attende se il limite è superato"""
+        if not self.active:
+            return
+        if self.busy_check:
+            self.wait_idle()
+        if self.rate:
+            # Il debito si accumula sotto lock e ogni thread dorme la sua parte:
+            # la banda totale resta quella impostata qualunque sia il numero di worker
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate * THROTTLE_BURST_SECONDS,
+                                   self._tokens + (now - self._last) * self.rate) - num_bytes
+                self._last = now
+                delay = -self._tokens / self.rate
+            if delay > 0:
+                time.sleep(delay)
+
+    def wait_idle(self):
+        """Blocca finché l'agent è occupato (un solo thread controlla, gli altri aspettano)"""
+        if time.monotonic() < self._next_check:
+            return
+        with self._busy_lock:
+            if time.monotonic() < self._next_check:
+                return
+            reason = self.busy_check()
+            if reason:
+                paused = time.monotonic()
+                self.log(f"⏸️  In pausa: {reason}")
+                while reason:
+                    time.sleep(BUSY_CHECK_INTERVAL)
+                    reason = self.busy_check()
+                self.log(f"▶️  Ripresa dopo {time.monotonic() - paused:.0f}s di pausa")
+            self._next_check = time.monotonic() + BUSY_CHECK_INTERVAL
+
+
+# Un solo limitatore per processo: lo usano le funzioni di lettura e copia
+IO_THROTTLE = IOThrottle()
+
+
+def pid_alive(pid):
+    """True se esiste un processo con questo pid"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def agent_busy(max_load=None):
+    """
+    Motivo per cui l'agent è occupato, o None
+
+    L'agent è occupato se nella sua tabella dei job c'è un job non concluso
+    di un processo ancora vivo, oppure (con ``max_load``) se il carico medio
+    dell'ultimo minuto supera la soglia.
+    """
+    if AGENT_JOBS_DB.exists():
+        try:
+            conn = sqlite3.connect(f"{AGENT_JOBS_DB.resolve().as_uri()}?mode=ro", uri=True, timeout=1)
+            try:
+                pids = [row[0] for row in conn.execute("SELECT pid FROM jobs WHERE finished_at IS NULL")]
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pids = []
+        running = sum(1 for pid in pids if pid_alive(pid))
+        if running:
+            return f"{running} job dell'agent in corso"
+    if max_load and hasattr(os, 'getloadavg'):
+        load = os.getloadavg()[0]
+        if load > max_load:
+            return f"carico del sistema {load:.1f} (soglia {max_load:g})"
+    return None
+
+
+def lower_priority():
+    """Abbassa la priorità di CPU e di I/O del processo; restituisce cosa è stato applicato"""
+    applied = []
+    if hasattr(os, 'nice'):
+        os.nice(NICE_INCREMENT)
+        applied.append(f"nice +{NICE_INCREMENT}")
+    if HAS_PSUTIL and hasattr(psutil, 'IOPRIO_CLASS_IDLE'):
+        psutil.Process().ionice(psutil.IOPRIO_CLASS_IDLE)
+        applied.append("I/O idle")
+    elif HAS_PSUTIL and hasattr(psutil, 'IOPRIO_VERYLOW'):
+        psutil.Process().ionice(psutil.IOPRIO_VERYLOW)
+        applied.append("I/O very low")
+    return applied
+
+
+def new_hasher():
+    """Algoritmo di hash usato per identificare i contenuti (BLAKE2b-256)"""
+    return hashlib.blake2b(digest_size=32)
+
+
+def hash_file(filepath, algorithm=HASH_ALGORITHM):
+    """Hash di un file con letture grandi e buffer riutilizzato"""
+    hasher = new_hasher() if algorithm == HASH_ALGORITHM else hashlib.new(algorithm)
+    buffer = bytearray(READ_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(filepath, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            IO_THROTTLE.consume(n)
+            hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+# Candidati al taglio: sequenze di 10 byte "marcatori" (metà dei valori possibili,
+# scelti in modo deterministico). Trovarle costa una translate() e una find() in C,
+# invece di un rolling hash byte per byte in Python (~30 volte più lento).
+CHUNK_MARKER_TABLE = bytes(
+    1 if hashlib.blake2b(bytes([i]), digest_size=1).digest()[0] & 1 else 0
+    for i in range(256)
+)
+CHUNK_MARKER_RUN = b'\x01' * 10
+# Un candidato diventa taglio se l'hash dei 64 byte che lo precedono ha 9 bit a zero
+CHUNK_CUT_MASK = (1 << 9) - 1
+# Hash di finestre calcolati al massimo per chunk: con dati casuali un taglio arriva in
+# media dopo 512 (superare il limite ha probabilità ~1e-7), con dati a bassa entropia
+# (tutti marcatori) il costo resta limitato invece di un hash per ogni byte
+CHUNK_MAX_CANDIDATES = 8192
+# Sequenze di byte uguali, una regex per valore (più veloce di un backreference)
+_BYTE_RUNS = [re.compile(re.escape(bytes([i])) + b'*') for i in range(256)]
+
+
+def find_chunk_boundary(buffer):
+    """
+    Posizione di taglio del prossimo chunk in ``buffer``
+
+    I primi CHUNK_MIN_SIZE byte vengono saltati (come in FastCDC); il taglio
+    cade alla fine di una finestra di CHUNK_WINDOW byte il cui hash soddisfa
+    CHUNK_CUT_MASK, o a CHUNK_MAX_SIZE. Dipende solo dal contenuto locale,
+    quindi i tagli si riallineano dopo inserimenti e cancellazioni. Il
+    chiamante passa almeno CHUNK_MAX_SIZE byte, o tutto ciò che resta del
+    file: un buffer più corto è la coda del file.
+
+    Sui dati a bassa entropia (zeri, padding, testo ripetitivo) quasi ogni
+    posizione è un candidato: una sequenza di byte uguali ha la stessa
+    finestra in ogni punto, quindi viene valutata una volta e saltata in C,
+    e oltre CHUNK_MAX_CANDIDATES finestre il chunk si chiude a CHUNK_MAX_SIZE.
+    """
+    size = len(buffer)
+    if size <= CHUNK_MIN_SIZE:
+        return size
+    limit = min(size, CHUNK_MAX_SIZE)
+
+    start = CHUNK_MIN_SIZE - CHUNK_WINDOW
+    marked = bytes(buffer[start:limit]).translate(CHUNK_MARKER_TABLE)
+    run = len(CHUNK_MARKER_RUN)
+    pos = marked.find(CHUNK_MARKER_RUN, CHUNK_WINDOW - run)
+    for _ in range(CHUNK_MAX_CANDIDATES):
+        if pos == -1:
+            break
+        end = start + pos + run
+        if end > limit:
+            break
+        window = buffer[end - CHUNK_WINDOW:end]
+        digest = hashlib.blake2b(window, digest_size=8).digest()
+        if not int.from_bytes(digest, 'big') & CHUNK_CUT_MASK:
+            return end
+        if window.count(window[-1]) == CHUNK_WINDOW:
+            # Finestra di byte tutti uguali: stesso hash fino alla fine della sequenza,
+            # il prossimo candidato utile è la prima finestra che la supera
+            end = _BYTE_RUNS[window[-1]].match(buffer, end - 1, limit).end() + 1
+            pos = marked.find(CHUNK_MARKER_RUN, max(end - start - run, pos + 1))
+        else:
+            pos = marked.find(CHUNK_MARKER_RUN, pos + 1)
+    return limit
+
+
+# Errori per cui copy_file_range non è supportato tra questi due file
+_COPY_RANGE_FALLBACK = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                        errno.EBADF, errno.EPERM, errno.ETXTBSY}
+
+# Reflink (ioctl FICLONE di Linux): su btrfs/XFS il file nuovo condivide i blocchi
+# della sorgente finché uno dei due non viene modificato, senza copiare byte
+HAS_FICLONE = HAS_FCNTL and sys.platform.startswith('linux')
+FICLONE = 0x40049409
+# Errori per cui il reflink non è disponibile tra questi due file
+_CLONE_FALLBACK = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                   errno.ENOTTY, errno.EBADF, errno.EPERM}
+# Coppie di dispositivi (sorgente, destinazione) su cui il reflink è già fallito
+_NO_REFLINK = set()
+
+
+def _reflink(fsrc, fdst):
+    """Clona fsrc in fdst se il filesystem lo permette; False altrimenti"""
+    if not HAS_FICLONE:
+        return False
+    devices = (os.fstat(fsrc.fileno()).st_dev, os.fstat(fdst.fileno()).st_dev)
+    if devices in _NO_REFLINK:
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError as e:
+        if e.errno not in _CLONE_FALLBACK:
+            raise
+        _NO_REFLINK.add(devices)
+        return False
+
+
+def reflink_file(src, dst):
+    """Crea ``dst`` come reflink di ``src``; False (e nessun file) se non supportato"""
+    if not HAS_FICLONE or (os.stat(src).st_dev, os.stat(os.path.dirname(dst)).st_dev) in _NO_REFLINK:
+        return False
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if _reflink(fsrc, fdst):
+            return True
+    os.unlink(dst)
+    return False
+
+
+def copy_file_fast(src, dst):
+    """
+    Copia il contenuto di un file senza passare dallo spazio utente
+
+    Prova prima il reflink (nessun byte copiato), poi os.copy_file_range
+    dove il kernel lo supporta, infine shutil.copyfile (che usa sendfile
+    su Linux e fcopyfile su macOS). Con un limite di I/O attivo la copia
+    procede a blocchi di READ_BUFFER_SIZE. Restituisce 'reflink' o 'copy'.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if _reflink(fsrc, fdst):
+            return 'reflink'
+        block = READ_BUFFER_SIZE if IO_THROTTLE.active else 1 << 30
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while n := os.copy_file_range(fsrc.fileno(), fdst.fileno(), block):
+                    IO_THROTTLE.consume(n)
+                return 'copy'
+            except OSError as e:
+                if e.errno not in _COPY_RANGE_FALLBACK:
+                    raise
+        if IO_THROTTLE.active:
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            for chunk in iter(lambda: fsrc.read(block), b''):
+                IO_THROTTLE.consume(len(chunk))
+                fdst.write(chunk)
+            return 'copy'
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+class BlobStore:
+    """
+    Archivio content-addressed dei file salvati
+
+    Ogni contenuto è salvato una sola volta in objects/<hh>/<hash>,
+    qualunque sia il numero di snapshot che lo contengono.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.tmp_dir = self.root / "tmp"
+
+    def path_for(self, digest):
+        """Percorso del blob per un hash"""
+        return self.root / digest[:2] / digest[2:]
+
+    def has(self, digest):
+        return self.path_for(digest).exists()
+
+    def put_bytes(self, data, digest):
+        """Salva un blob già in memoria; False se era già presente"""
+        dst = self.path_for(digest)
+        if dst.exists():
+            return False
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_name, dst)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+        return True
+
+    def put_chunked(self, src, previous_chunks=None):
+        """
+        Salva un file grande come sequenza di chunk content-defined
+
+        Se il file aveva già dei chunk (``previous_chunks``), il prefisso
+        invariato viene solo verificato con l'hash e il chunking riparte
+        dall'ultimo chunk precedente: un append su un log da 500 MB
+        elabora e salva solo la parte nuova. Restituisce
+        (hash_file, [[hash_chunk, dimensione], ...], byte_nuovi).
+        """
+        file_hasher = new_hasher()
+        chunks = []
+        new_bytes = 0
+
+        with open(src, 'rb') as f:
+            offset = 0
+            for digest, size in (previous_chunks or [])[:-1]:
+                data = f.read(size)
+                IO_THROTTLE.consume(len(data))
+                hasher = new_hasher()
+                hasher.update(data)
+                if len(data) != size or hasher.hexdigest() != digest or not self.has(digest):
+                    break
+                file_hasher.update(data)
+                chunks.append([digest, size])
+                offset += size
+            f.seek(offset)
+
+            buffer = bytearray()
+            eof = False
+            while True:
+                while not eof and len(buffer) < CHUNK_MAX_SIZE:
+                    data = f.read(CHUNK_MAX_SIZE)
+                    IO_THROTTLE.consume(len(data))
+                    if data:
+                        buffer += data
+                    else:
+                        eof = True
+                if not buffer:
+                    break
+
+                cut = find_chunk_boundary(buffer)
+                chunk = bytes(buffer[:cut])
+                del buffer[:cut]
+
+                file_hasher.update(chunk)
+                hasher = new_hasher()
+                hasher.update(chunk)
+                digest = hasher.hexdigest()
+                if self.put_bytes(chunk, digest):
+                    new_bytes += len(chunk)
+                chunks.append([digest, len(chunk)])
+
+        return file_hasher.hexdigest(), chunks, new_bytes
+
+    def put_file(self, src, expected_hash=None, st=None):
+        """
+        Salva un file nello store e restituisce il suo hash
+
+        Se il blob esiste già non viene letto nulla. Con hash e stat della
+        scansione il file viene copiato dal kernel (zero-copy) e accettato
+        solo se nel frattempo non è cambiato; altrimenti viene copiato e
+        hashato in un solo passaggio, così il nome del blob corrisponde
+        sempre al contenuto effettivamente salvato.
+        """
+        if expected_hash and self.has(expected_hash):
+            return expected_hash
+
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        try:
+            digest = None
+            if expected_hash and st is not None:
+                copy_file_fast(src, tmp_path)
+                after = os.stat(src)
+                if (after.st_size, after.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                    digest = expected_hash
+
+            if digest is None:
+                hasher = new_hasher()
+                with open(src, 'rb') as fsrc, open(tmp_path, 'wb') as fdst:
+                    for chunk in iter(lambda: fsrc.read(READ_BUFFER_SIZE), b''):
+                        IO_THROTTLE.consume(len(chunk))
+                        hasher.update(chunk)
+                        fdst.write(chunk)
+                digest = hasher.hexdigest()
+
+            dst = self.path_for(digest)
+            if dst.exists():
+                tmp_path.unlink()
+            else:
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, dst)
+            return digest
+        except BaseException:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+
+    def copy_to(self, digest, target):
+        """
+        Copia un blob in un altro store (``target``) verificandone l'hash
+
+        Il contenuto viene hashato mentre passa: un blob locale danneggiato
+        non viene propagato (ValueError). Restituisce i byte copiati.
+        """
+        target.tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=target.tmp_dir)
+        try:
+            hasher = new_hasher()
+            size = 0
+            with open(self.path_for(digest), 'rb') as fsrc, os.fdopen(fd, 'wb') as fdst:
+                for chunk in iter(lambda: fsrc.read(READ_BUFFER_SIZE), b''):
+                    IO_THROTTLE.consume(len(chunk))
+                    hasher.update(chunk)
+                    fdst.write(chunk)
+                    size += len(chunk)
+            if hasher.hexdigest() != digest:
+                raise ValueError("hash non corrispondente, blob locale danneggiato")
+            dst = target.path_for(digest)
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_name, dst)
+            return size
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+
+
+ARCHIVE_MAGIC = b'SNARCH01'
+ARCHIVE_MAGIC_ENCRYPTED = b'SNARENC1'
+# Footer a lunghezza fissa: offset e lunghezza dell'indice, poi di nuovo il magic
+ARCHIVE_FOOTER = struct.Struct('<QQ8s')
+# Archivi cifrati, dopo il magic: cifrario, sale e parametri scrypt
+ENCRYPTION_HEADER = struct.Struct('<B16sIBB')
+# Nonce di un frame: offset del membro nell'archivio e numero del frame
+FRAME_NONCE = struct.Struct('<QI')
+FRAME_TAG_SIZE = 16
+
+_passphrase = None
+_derived_keys = {}
+_key_lock = threading.Lock()
+
+
+class ArchiveAuthError(ValueError):
+    """Archivio cifrato illeggibile: passphrase mancante o errata, o dati alterati"""
+
+
+def archive_passphrase(confirm=False):
+    """Passphrase degli archivi cifrati: dalla variabile d'ambiente o chiesta una volta"""
+    global _passphrase
+    if _passphrase is None:
+        if os.environ.get(PASSPHRASE_ENV):
+            _passphrase = os.environ[PASSPHRASE_ENV]
+        elif sys.stdin.isatty():
+            passphrase = getpass.getpass("🔐 Passphrase: ")
+            if confirm and getpass.getpass("🔐 Ripeti la passphrase: ") != passphrase:
+                raise ArchiveAuthError("Le passphrase non coincidono")
+            if not passphrase:
+                raise ArchiveAuthError("Passphrase vuota")
+            _passphrase = passphrase
+        else:
+            raise ArchiveAuthError(f"Archivio cifrato: imposta la passphrase in {PASSPHRASE_ENV}")
+    return _passphrase
+
+
+class FrameCipher:
+    """
+    Cifratura autenticata a frame (AES-GCM o ChaCha20-Poly1305)
+
+    Un flusso (membro o indice dell'archivio) è diviso in frame da
+    ENCRYPTION_FRAME_SIZE cifrati e autenticati singolarmente: si legge e
+    si verifica un file senza decifrare il resto, e senza tenerlo tutto
+    in memoria. Il nonce è (offset del flusso, numero del frame) e
+    l'ultimo frame è marcato nei dati autenticati, quindi frame spostati,
+    tolti o aggiunti non passano la verifica. La chiave è unica per
+    archivio (sale casuale), quindi un nonce non si ripete mai.
+    """
+
+    def __init__(self, header):
+        cipher_id, salt, n, r, p = ENCRYPTION_HEADER.unpack(header)
+        if not HAS_CRYPTOGRAPHY:
+            raise ValueError("Archivio cifrato: pip install cryptography")
+        if not 1 <= cipher_id <= len(ENCRYPTION_CIPHERS):
+            raise ValueError(f"Cifrario sconosciuto: {cipher_id}")
+        self.name = ENCRYPTION_CIPHERS[cipher_id - 1]
+        with _key_lock:
+            key = _derived_keys.get(header)
+            if key is None:
+                passphrase = archive_passphrase()
+                key = Scrypt(salt=salt, length=32, n=n, r=r, p=p).derive(passphrase.encode('utf-8'))
+                _derived_keys[header] = key
+        self.aead = AESGCM(key) if self.name == 'aes-gcm' else ChaCha20Poly1305(key)
+
+    @staticmethod
+    def new_header(name):
+        """Intestazione di un nuovo archivio cifrato (sale casuale)"""
+        if not HAS_CRYPTOGRAPHY:
+            raise ValueError("Cifratura non disponibile: pip install cryptography")
+        if name not in ENCRYPTION_CIPHERS:
+            raise ValueError(f"Cifrario non supportato: {name} (disponibili: {', '.join(ENCRYPTION_CIPHERS)})")
+        archive_passphrase(confirm=True)
+        return ENCRYPTION_HEADER.pack(ENCRYPTION_CIPHERS.index(name) + 1, os.urandom(16),
+                                      SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+    def encrypt(self, offset, index, data, last):
+        return self.aead.encrypt(FRAME_NONCE.pack(offset, index), data, b'\x01' if last else b'\x00')
+
+    def decrypt(self, offset, index, data, last):
+        try:
+            return self.aead.decrypt(FRAME_NONCE.pack(offset, index), data, b'\x01' if last else b'\x00')
+        except InvalidTag:
+            raise ArchiveAuthError("Autenticazione fallita: archivio danneggiato o passphrase errata") from None
+
+
+class FrameWriter:
+    """Scrive un flusso cifrato in frame a partire da ``offset``"""
+
+    def __init__(self, f, cipher, offset):
+        self.f = f
+        self.cipher = cipher
+        self.offset = offset
+        self.index = 0
+        self.buffer = bytearray()
+
+    def write(self, data):
+        # Un frame pieno resta nel buffer finché non arrivano altri dati: l'ultimo
+        # frame va marcato alla chiusura. I frame interi dei blocchi grandi sono
+        # cifrati direttamente, senza passare dal buffer
+        view = memoryview(data)
+        if self.buffer:
+            missing = ENCRYPTION_FRAME_SIZE - len(self.buffer)
+            self.buffer += view[:missing]
+            view = view[missing:]
+            if not view:
+                return
+            self.emit(self.buffer)
+            self.buffer = bytearray()
+        while len(view) > ENCRYPTION_FRAME_SIZE:
+            self.emit(view[:ENCRYPTION_FRAME_SIZE])
+            view = view[ENCRYPTION_FRAME_SIZE:]
+        self.buffer += view
+
+    def emit(self, frame, last=False):
+        self.f.write(self.cipher.encrypt(self.offset, self.index, frame, last))
+        self.index += 1
+
+    def close(self):
+        self.emit(self.buffer, last=True)
+        self.buffer = bytearray()
+
+
+def read_frames(f, cipher, offset, length):
+    """Decifra un flusso di ``length`` byte scritto da FrameWriter (f posizionato all'inizio)"""
+    remaining = length
+    index = 0
+    while remaining:
+        data = f.read(min(ENCRYPTION_FRAME_SIZE + FRAME_TAG_SIZE, remaining))
+        if len(data) < FRAME_TAG_SIZE:
+            raise ValueError("Archivio troncato")
+        remaining -= len(data)
+        IO_THROTTLE.consume(len(data))
+        yield cipher.decrypt(offset, index, data, not remaining)
+        index += 1
+
+
+class _StoredCodec:
+    """Membro non compresso (per contenuti già compressi: immagini, zip, ...)"""
+
+    def compress(self, data):
+        return bytes(data)
+
+    decompress = compress
+
+    def flush(self):
+        return b''
+
+
+def looks_compressed(sample):
+    """True se un campione non si riduce: comprimerlo costerebbe solo CPU"""
+    return len(zlib.compress(sample, 1)) > len(sample) * 0.95
+
+
+def new_compressor(codec):
+    """Compressore per un membro dell'archivio (un membro gzip o un frame zstd)"""
+    if codec == 'store':
+        return _StoredCodec()
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def new_decompressor(codec):
+    if codec == 'store':
+        return _StoredCodec()
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+class ArchiveWriter:
+    """
+    Scrive uno snapshot come unico file compresso
+
+    Layout: magic, un membro compresso indipendente per ogni file, l'indice
+    (il manifest JSON con offset e lunghezza di ogni membro, compresso) e
+    un footer di lunghezza fissa che punta all'indice. I file vengono letti
+    e compressi in streaming, senza copie temporanee; l'archivio compare
+    con il nome definitivo solo quando è completo.
+
+    Con ``encryption`` (un cifrario di ENCRYPTION_CIPHERS) dopo il magic c'è
+    l'intestazione della cifratura e ogni membro compresso, come l'indice,
+    è scritto in frame cifrati (FrameCipher).
+    """
+
+    def __init__(self, path, codec=ARCHIVE_COMPRESSION, encryption=None):
+        if codec not in ARCHIVE_CODECS:
+            raise ValueError(f"Compressione non supportata: {codec} (disponibili: {', '.join(ARCHIVE_CODECS)})")
+        if codec == 'zstd' and not HAS_ZSTD:
+            raise ValueError("Compressione zstd non disponibile: pip install zstandard")
+        self.cipher = None
+        header = b''
+        if encryption:
+            header = FrameCipher.new_header(encryption)
+            self.cipher = FrameCipher(header)
+        self.magic = ARCHIVE_MAGIC_ENCRYPTED if self.cipher else ARCHIVE_MAGIC
+        self.path = Path(path)
+        self.codec = codec
+        self.tmp_path = self.path.with_name(self.path.name + '.tmp')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.f = open(self.tmp_path, 'wb')
+        self.f.write(self.magic + header)
+        self.buffer = bytearray(READ_BUFFER_SIZE)
+
+    def stream(self, offset):
+        """Destinazione dei dati di un membro o dell'indice: il file o i frame cifrati"""
+        return FrameWriter(self.f, self.cipher, offset) if self.cipher else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.f.closed:
+            self.f.close()
+            self.tmp_path.unlink(missing_ok=True)
+
+    def add(self, sources):
+        """
+        Comprime in un membro il contenuto di ``sources`` (letti in ordine)
+
+        Se il primo blocco letto non si comprime il membro viene salvato
+        così com'è. Restituisce (hash, offset, lunghezza_compressa,
+        dimensione, codec).
+        """
+        offset = self.f.tell()
+        frames = self.stream(offset)
+        write = frames.write if frames else self.f.write
+        hasher = new_hasher()
+        codec = compressor = None
+        view = memoryview(self.buffer)
+        size = 0
+        for src in sources:
+            with open(src, 'rb', buffering=0) as fsrc:
+                while True:
+                    n = fsrc.readinto(self.buffer)
+                    if not n:
+                        break
+                    IO_THROTTLE.consume(n)
+                    if compressor is None:
+                        codec = 'store' if looks_compressed(view[:min(n, ARCHIVE_READ_SIZE)]) else self.codec
+                        compressor = new_compressor(codec)
+                    hasher.update(view[:n])
+                    write(compressor.compress(view[:n]))
+                    size += n
+        if compressor is None:
+            codec, compressor = self.codec, new_compressor(self.codec)
+        write(compressor.flush())
+        if frames:
+            frames.close()
+        return hasher.hexdigest(), offset, self.f.tell() - offset, size, codec
+
+    def finish(self, metadata):
+        """Scrive indice e footer e pubblica l'archivio"""
+        index_offset = self.f.tell()
+        index = zlib.compress(json.dumps(metadata).encode('utf-8'), 6)
+        frames = self.stream(index_offset)
+        if frames:
+            frames.write(index)
+            frames.close()
+        else:
+            self.f.write(index)
+        self.f.write(ARCHIVE_FOOTER.pack(index_offset, self.f.tell() - index_offset, self.magic))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class ArchiveReader:
+    """
+    Legge uno snapshot archiviato
+
+    Legge solo footer e indice; ogni file si estrae leggendo esclusivamente
+    il suo membro, senza scorrere il resto dell'archivio. Ogni estrazione
+    apre il proprio handle, quindi più file si possono estrarre in parallelo.
+    In un archivio cifrato ogni frame letto viene autenticato prima di
+    essere decompresso.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.cipher = None
+        with open(self.path, 'rb') as f:
+            f.seek(-ARCHIVE_FOOTER.size, os.SEEK_END)
+            index_offset, index_length, magic = ARCHIVE_FOOTER.unpack(f.read(ARCHIVE_FOOTER.size))
+            if magic not in (ARCHIVE_MAGIC, ARCHIVE_MAGIC_ENCRYPTED):
+                raise ValueError(f"Archivio non valido o incompleto: {self.path}")
+            if magic == ARCHIVE_MAGIC_ENCRYPTED:
+                f.seek(len(magic))
+                self.cipher = FrameCipher(f.read(ENCRYPTION_HEADER.size))
+            f.seek(index_offset)
+            self.metadata = json.loads(zlib.decompress(b''.join(self.member_data(f, index_offset, index_length))))
+        self.codec = self.metadata.get('compression', 'gzip')
+        if self.codec == 'zstd' and not HAS_ZSTD:
+            raise ValueError("Archivio compresso con zstd: pip install zstandard")
+
+    def extract(self, info, dst):
+        """Decomprime un file in ``dst`` verificandone l'hash"""
+        with open(dst, 'wb') as fdst:
+            ok = self.read_member(info, fdst.write)
+        if not ok:
+            raise ValueError("hash non corrispondente, archivio danneggiato")
+
+    def read_member(self, info, write=None):
+        """Decomprime un membro (passando i dati a ``write``); False se l'hash non corrisponde"""
+        decompressor = new_decompressor(info.get('codec', self.codec))
+        hasher = new_hasher()
+        with open(self.path, 'rb') as fsrc:
+            fsrc.seek(info['offset'])
+            for data in self.member_data(fsrc, info['offset'], info['length']):
+                out = decompressor.decompress(data)
+                hasher.update(out)
+                if write:
+                    write(out)
+            out = decompressor.flush()
+            hasher.update(out)
+            if write:
+                write(out)
+        return self.metadata.get('hash_algorithm') != HASH_ALGORITHM or hasher.hexdigest() == info['hash']
+
+    def member_data(self, f, offset, length):
+        """Blocchi (decifrati) di un membro; ``f`` è già posizionato su ``offset``"""
+        if self.cipher:
+            yield from read_frames(f, self.cipher, offset, length)
+            return
+        remaining = length
+        while remaining:
+            data = f.read(min(ARCHIVE_READ_SIZE, remaining))
+            if not data:
+                raise ValueError(f"Archivio troncato: {self.path}")
+            remaining -= len(data)
+            IO_THROTTLE.consume(len(data))
+            yield data
+
+
+class ArchiveChain:
+    """
+    Archivi di uno snapshot archiviato e dei suoi genitori
+
+    In una catena di archivi incrementali ogni membro indica ('archive')
+    lo snapshot il cui archivio contiene il suo contenuto; i membri senza
+    questo campo (archivi completi delle versioni precedenti, export)
+    stanno nell'archivio dello snapshot stesso. Ogni archivio viene
+    aperto (e il suo indice letto) una volta sola, anche da più thread.
+    """
+
+    def __init__(self, path_for, snapshot_name):
+        self.path_for = path_for
+        self.snapshot_name = snapshot_name
+        self.readers = {}
+        self.lock = threading.Lock()
+
+    def reader(self, info):
+        name = info.get('archive', self.snapshot_name)
+        with self.lock:
+            if name not in self.readers:
+                self.readers[name] = ArchiveReader(self.path_for(name))
+            return self.readers[name]
+
+    def extract(self, info, dst):
+        self.reader(info).extract(info, dst)
+
+    def read_member(self, info, write=None):
+        return self.reader(info).read_member(info, write)
+
+
+def glob_to_regex(pattern):
+    """Traduce un glob stile .gitignore (*, ?, [..], **) in regex"""
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif c == '*':
+            out.append('[^/]*')
+            i += 1
+        elif c == '?':
+            out.append('[^/]')
+            i += 1
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+                i += 1
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end + 1
+        elif c == '\\' and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return ''.join(out)
+
+
+class ExcludeMatcher:
+    """
+    Regole di esclusione compilate (EXCLUDE_PATTERNS + .gitignore)
+
+    Le regole di EXCLUDE_PATTERNS escludono sempre; per quelle dei
+    .gitignore vale l'ultima regola che corrisponde (con negazione "!").
+    Le regole di un .gitignore valgono solo sotto la sua cartella.
+    """
+
+    def __init__(self, patterns):
+        self.fixed = self._compile_group([self._parse(p, '') for p in patterns])
+        self.rules = []
+        self.loaded = set()
+
+    @staticmethod
+    def _parse(line, base):
+        """Converte una riga in (regex, negata, solo_cartelle) o None"""
+        line = line.rstrip('\n').rstrip('\r')
+        if not line.endswith('\\ '):
+            line = line.rstrip(' ')
+        if not line or line.startswith('#'):
+            return None
+
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        elif line.startswith('\\!') or line.startswith('\\#'):
+            line = line[1:]
+
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            return None
+
+        anchored = '/' in line
+        line = line.lstrip('/')
+        prefix = re.escape(base + '/') if base else ''
+        body = glob_to_regex(line)
+        if not anchored:
+            body = '(?:.*/)?' + body
+        return re.compile(f"^{prefix}{body}$"), negate, dir_only
+
+    @staticmethod
+    def _compile_group(rules):
+        rules = [r for r in rules if r is not None]
+        files = [r[0].pattern for r in rules if not r[2]]
+        dirs = [r[0].pattern for r in rules]
+        return (re.compile('|'.join(files)) if files else None,
+                re.compile('|'.join(dirs)) if dirs else None)
+
+    def add_gitignore(self, base, path):
+        """Aggiunge le regole di un .gitignore (base = cartella relativa)"""
+        if base in self.loaded:
+            return
+        self.loaded.add(base)
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    rule = self._parse(line, base)
+                    if rule is not None:
+                        self.rules.append(rule)
+        except OSError:
+            pass
+
+    def excluded(self, rel_path, is_dir):
+        """Verifica un singolo percorso (le cartelle padre sono già state filtrate)"""
+        files_re, dirs_re = self.fixed
+        regex = dirs_re if is_dir else files_re
+        if regex is not None and regex.match(rel_path):
+            return True
+
+        result = False
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                result = not negate
+        return result
+
+    def excluded_path(self, rel_path, is_dir=False):
+        """Verifica un percorso e tutte le sue cartelle padre"""
+        parts = rel_path.split('/')
+        for i in range(1, len(parts)):
+            if self.excluded('/'.join(parts[:i]), True):
+                return True
+        return self.excluded(rel_path, is_dir)
+
+
+class StatCache:
+    """
+    Cache persistente path -> (size, mtime_ns, inode, ctime_ns, hash)
+
+    Come l'index di git: un file viene rielaborato solo se la sua tupla
+    di stat è cambiata. Le voci con mtime troppo vicina al momento della
+    scansione ("racy") non sono considerate affidabili, perché il file
+    potrebbe essere stato modificato di nuovo nello stesso intervallo.
+    """
+
+    RACY_WINDOW_NS = 2 * 10**9
+
+    def __init__(self, path, algorithm):
+        self.path = Path(path)
+        self.algorithm = algorithm
+        self.entries = {}
+        self.oids = {}
+        self.scanned_ns = 0
+        self.last_full_rehash = 0.0
+        self._new_entries = {}
+        self._scan_started_ns = 0
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('algorithm') == self.algorithm:
+                self.entries = data.get('entries', {})
+                self.oids = data.get('git_oids', {})
+                self.scanned_ns = data.get('scanned_ns', 0)
+                self.last_full_rehash = data.get('last_full_rehash', 0.0)
+        except (OSError, ValueError):
+            pass
+
+    def full_rehash_due(self):
+        """True se è ora di una verifica completa (modalità paranoica periodica)"""
+        return time.time() - self.last_full_rehash > PARANOID_INTERVAL_DAYS * 86400
+
+    def begin_scan(self):
+        self._new_entries = {}
+        self._scan_started_ns = time.time_ns()
+
+    def begin_update(self):
+        """
+        Inizio di un aggiornamento dei soli percorsi riletti (backup del watch)
+
+        Le altre voci restano, tranne quelle racy rispetto alla scansione
+        precedente: con scanned_ns spostato in avanti sembrerebbero affidabili.
+        """
+        self._scan_started_ns = time.time_ns()
+        racy_ns = self.scanned_ns - self.RACY_WINDOW_NS
+        self._new_entries = {rel_path: entry for rel_path, entry in self.entries.items() if entry[1] < racy_ns}
+
+    def update(self, rel_path, st, digest):
+        """Voce di un percorso riletto dopo begin_update() (``st`` None = rimosso); le mtime racy non si registrano"""
+        if st is None or digest is None or st.st_mtime_ns >= self._scan_started_ns - self.RACY_WINDOW_NS:
+            self._new_entries.pop(rel_path, None)
+        else:
+            self.record(rel_path, st, digest)
+
+    def lookup(self, rel_path, st):
+        """Hash in cache se la tupla di stat coincide e la voce non è racy"""
+        entry = self.entries.get(rel_path)
+        if entry is None:
+            return None
+        size, mtime_ns, inode, ctime_ns, digest = entry
+        if (size, mtime_ns, inode, ctime_ns) != (st.st_size, st.st_mtime_ns, st.st_ino, st.st_ctime_ns):
+            return None
+        if mtime_ns >= self.scanned_ns - self.RACY_WINDOW_NS:
+            return None
+        return digest
+
+    def record(self, rel_path, st, digest):
+        if digest is not None:
+            self._new_entries[rel_path] = [st.st_size, st.st_mtime_ns, st.st_ino, st.st_ctime_ns, digest]
+
+    def oid_digest(self, oid):
+        """Hash del contenuto di un oggetto git già visto (o None)"""
+        digest = self.oids.pop(oid, None) if oid else None
+        if digest is not None:
+            self.oids[oid] = digest
+        return digest
+
+    def record_oid(self, oid, digest):
+        if oid and digest is not None:
+            self.oids.pop(oid, None)
+            self.oids[oid] = digest
+
+    def save(self, full_rehash=False):
+        """Sostituisce la cache con i risultati dell'ultima scansione"""
+        self.entries = self._new_entries
+        self.scanned_ns = self._scan_started_ns
+        if full_rehash:
+            self.last_full_rehash = time.time()
+        # A differenza delle voci per percorso, la mappa degli oggetti git non
+        # si azzera a ogni scansione: dopo un checkout di un altro ramo e il
+        # ritorno, i contenuti del primo sono ancora noti
+        for oid in list(self.oids)[:max(0, len(self.oids) - GIT_OID_CACHE_SIZE)]:
+            del self.oids[oid]
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'algorithm': self.algorithm,
+                'scanned_ns': self.scanned_ns,
+                'last_full_rehash': self.last_full_rehash,
+                'entries': self.entries,
+                'git_oids': self.oids
+            }, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+def git_dir(worktree):
+    """Cartella .git di un working tree (anche se .git è un file "gitdir:"); None se assente"""
+    dot_git = Path(worktree) / '.git'
+    if dot_git.is_file():
+        try:
+            line = dot_git.read_text(encoding='utf-8').strip()
+        except OSError:
+            return None
+        if not line.startswith('gitdir:'):
+            return None
+        dot_git = (Path(worktree) / line[len('gitdir:'):].strip()).resolve()
+    return dot_git if dot_git.is_dir() else None
+
+
+class GitIndex:
+    """
+    Lettura diretta dell'index di git (.git/index, versioni 2, 3 e 4)
+
+    Per ogni file tracciato l'index conserva la stat dell'ultimo add o
+    checkout e l'id dell'oggetto. Se la stat del file coincide ancora, il
+    contenuto è quell'oggetto: con la mappa oid -> hash della stat cache il
+    file non va riletto, anche se la stat cache non lo conosce (checkout,
+    rebase, touch). Le voci in conflitto, intent-to-add o "racy" (mtime non
+    anteriore a quella dell'index) non vengono usate.
+    """
+
+    SIGNATURE = b'DIRC'
+    HEADER = struct.Struct('>4sII')
+    # ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size (tutti a 32 bit)
+    STAT = struct.Struct('>10I')
+    FLAG_EXTENDED = 0x4000
+    FLAG_INTENT_TO_ADD = 0x2000
+
+    def __init__(self, path, hash_size=20):
+        self.path = Path(path)
+        # percorso -> (mtime_s, mtime_ns, ctime_s, ctime_ns, inode, size, oid); oid None se non affidabile
+        self.entries = {}
+        with open(self.path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        self.signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+        self._parse(data, hash_size, (st.st_mtime_ns // 10**9, st.st_mtime_ns % 10**9))
+
+    @classmethod
+    def open(cls, worktree, previous=None):
+        """
+        Index del working tree, con la dimensione degli id (SHA-1 o SHA-256)
+        letta dalla config; ``previous`` viene riusato se l'index non è cambiato
+        """
+        gitdir = git_dir(worktree)
+        if gitdir is None or not (gitdir / 'index').exists():
+            raise FileNotFoundError(f"nessun index di git in {worktree}")
+        st = os.stat(gitdir / 'index')
+        if previous is not None and previous.signature == (st.st_size, st.st_mtime_ns, st.st_ino):
+            return previous
+        common = gitdir
+        if (gitdir / 'commondir').exists():
+            common = gitdir / (gitdir / 'commondir').read_text(encoding='utf-8').strip()
+        try:
+            config = (common / 'config').read_text(encoding='utf-8', errors='replace')
+        except OSError:
+            config = ''
+        sha256 = re.search(r'^\s*objectformat\s*=\s*sha256\s*$', config, re.MULTILINE | re.IGNORECASE)
+        return cls(gitdir / 'index', 32 if sha256 else 20)
+
+    def _parse(self, data, hash_size, index_mtime):
+        signature, version, count = self.HEADER.unpack_from(data)
+        if signature != self.SIGNATURE or version not in (2, 3, 4):
+            raise ValueError(f"Index di git non supportato (versione {version})")
+        checksum = data[-hash_size:]
+        digest = hashlib.sha256 if hash_size == 32 else hashlib.sha1
+        if any(checksum) and digest(data[:-hash_size]).digest() != checksum:
+            raise ValueError("Index di git danneggiato (checksum)")
+
+        pos = self.HEADER.size
+        fixed = self.STAT.size + hash_size + 2
+        previous = b''
+        for _ in range(count):
+            start = pos
+            ctime_s, ctime_ns, mtime_s, mtime_ns, _, inode, mode, _, _, size = self.STAT.unpack_from(data, pos)
+            pos += self.STAT.size
+            oid = data[pos:pos + hash_size].hex()
+            flags = int.from_bytes(data[pos + hash_size:pos + hash_size + 2], 'big')
+            pos = start + fixed
+            extended = 0
+            if version >= 3 and flags & self.FLAG_EXTENDED:
+                extended = int.from_bytes(data[pos:pos + 2], 'big')
+                pos += 2
+
+            if version == 4:
+                # Prefisso condiviso con il percorso precedente: varint dei byte da togliere
+                byte = data[pos]
+                pos += 1
+                strip = byte & 0x7f
+                while byte & 0x80:
+                    byte = data[pos]
+                    pos += 1
+                    strip = ((strip + 1) << 7) | (byte & 0x7f)
+                end = data.index(b'\0', pos)
+                name = previous[:len(previous) - strip] + data[pos:end]
+                pos = end + 1
+            else:
+                end = data.index(b'\0', pos)
+                name = data[pos:end]
+                pos = start + ((pos - start + len(name) + 8) & ~7)
+            previous = name
+
+            if not stat.S_ISREG(mode):
+                continue  # link simbolici, submodule, cartelle di un indice sparse
+            trusted = (not (flags >> 12) & 3 and not extended & self.FLAG_INTENT_TO_ADD
+                       and (mtime_s, mtime_ns) < index_mtime)
+            rel_path = os.fsdecode(name)
+            self.entries[rel_path] = (mtime_s, mtime_ns, ctime_s, ctime_ns, inode, size, oid if trusted else None)
+
+        # Con split index le voci sono divise tra due file: non gestito
+        while pos + 8 <= len(data) - hash_size:
+            name, length = data[pos:pos + 4], int.from_bytes(data[pos + 4:pos + 8], 'big')
+            if name == b'link':
+                raise ValueError("Index di git diviso (core.splitIndex) non supportato")
+            pos += 8 + length
+
+    def oid(self, rel_path, st):
+        """Id dell'oggetto git del file se la stat coincide con quella dell'index, altrimenti None"""
+        entry = self.entries.get(rel_path)
+        if entry is None or entry[6] is None:
+            return None
+        mtime_s, mtime_ns, ctime_s, ctime_ns, inode, size, oid = entry
+        # L'index salva tutto a 32 bit; i nanosecondi possono mancare (git senza USE_NSEC)
+        if size != st.st_size & 0xFFFFFFFF or (inode and inode != st.st_ino & 0xFFFFFFFF):
+            return None
+        for seconds, nanos, actual in ((mtime_s, mtime_ns, st.st_mtime_ns), (ctime_s, ctime_ns, st.st_ctime_ns)):
+            if seconds != (actual // 10**9) & 0xFFFFFFFF or (nanos and nanos != actual % 10**9):
+                return None
+        return oid
+
+
+# Campi dei file con una colonna propria nel manifest; gli altri (chunk, posizione
+# nell'archivio...) vanno nella colonna extra in JSON
+MANIFEST_COLUMNS = ('size', 'modified', 'mode', 'hash')
+MANIFEST_CACHE_KIB = 64 * 1024
+MANIFEST_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, modified REAL, mode INTEGER,
+                    hash TEXT, extra TEXT) WITHOUT ROWID;
+CREATE TABLE deleted (path TEXT PRIMARY KEY) WITHOUT ROWID;
+"""
+
+
+def manifest_row(rel_path, info):
+    extra = {k: v for k, v in info.items() if k not in MANIFEST_COLUMNS}
+    return (rel_path, info['size'], info.get('modified'), info.get('mode'), info.get('hash'),
+            json.dumps(extra, separators=(',', ':')) if extra else None)
+
+
+def row_info(row):
+    _, size, modified, mode, digest, extra = row
+    info = {'size': size, 'modified': modified}
+    if mode is not None:
+        info['mode'] = mode
+    info['hash'] = digest
+    if extra:
+        info.update(json.loads(extra))
+    return info
+
+
+def insert_manifest(conn, files=(), deleted=(), header=None):
+    """Inserisce righe (file, eliminati, intestazione) nelle tabelle di un manifest"""
+    conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                     (manifest_row(rel_path, info) for rel_path, info in files))
+    conn.executemany("INSERT OR IGNORE INTO deleted VALUES (?)", ((rel_path,) for rel_path in deleted))
+    if header:
+        conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                         ((key, json.dumps(value)) for key, value in header.items()))
+
+
+def manifest_header(metadata):
+    """Intestazione di un manifest: tutto tranne l'elenco dei file"""
+    return {k: v for k, v in metadata.items() if k not in ('files', 'deleted')}
+
+
+class Manifest:
+    """
+    Manifest di uno snapshot: una riga per file, ordinate per percorso
+
+    Un file si trova con una ricerca nell'indice (O(log n)) senza leggere
+    il resto del manifest. I manifest JSON (legacy e archivi .snar)
+    vengono caricati in una tabella in memoria, così si leggono allo
+    stesso modo.
+    """
+
+    def __init__(self, conn, path=None):
+        self.conn = conn
+        self.path = path
+        self.header = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+
+    @classmethod
+    def open(cls, path):
+        path = Path(path).absolute()
+        return cls(sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True, check_same_thread=False), path)
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        conn.executescript(MANIFEST_SCHEMA)
+        insert_manifest(conn, metadata['files'].items(), metadata.get('deleted', ()), manifest_header(metadata))
+        return cls(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, rel_path):
+        """Info di un file, o None se il manifest non lo contiene"""
+        row = self.conn.execute("SELECT * FROM files WHERE path = ?", (rel_path,)).fetchone()
+        return row_info(row) if row else None
+
+    def is_deleted(self, rel_path):
+        return self.conn.execute("SELECT 1 FROM deleted WHERE path = ?", (rel_path,)).fetchone() is not None
+
+    def _select(self, columns, table, prefix):
+        # Il contenuto di una cartella è l'intervallo di chiavi tra "cartella/" e "cartella0"
+        if prefix:
+            return self.conn.execute(f"SELECT {columns} FROM {table} WHERE path > ? AND path < ? ORDER BY path",
+                                     (prefix + '/', prefix + '0'))
+        return self.conn.execute(f"SELECT {columns} FROM {table} ORDER BY path")
+
+    def files(self, prefix=''):
+        """(percorso, info) in ordine di percorso, tutti o solo quelli sotto la cartella ``prefix``"""
+        for row in self._select('*', 'files', prefix):
+            yield row[0], row_info(row)
+
+    def hashes(self, prefix=''):
+        return dict(self._select('path, hash', 'files', prefix))
+
+    def deleted(self, prefix=''):
+        return [row[0] for row in self._select('path', 'deleted', prefix)]
+
+    def refs(self):
+        """Blob referenziati (hash dei file o dei loro chunk)"""
+        refs = set()
+        if self.header.get('storage') != 'objects':
+            return refs
+        for digest, extra in self.conn.execute("SELECT hash, extra FROM files"):
+            chunks = json.loads(extra).get('chunks') if extra else None
+            if chunks:
+                refs.update(chunk_digest for chunk_digest, _ in chunks)
+            elif digest:
+                refs.add(digest)
+        return refs
+
+
+class ManifestWriter:
+    """
+    Scrive il manifest di uno snapshot man mano che i file vengono salvati
+
+    Le righe vanno in un file temporaneo in un'unica transazione, senza
+    journal: se il backup si interrompe il file viene scartato. finish()
+    aggiunge intestazione ed eliminati e pubblica il manifest con un
+    rename atomico.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + '.tmp')
+        self.tmp_path.unlink(missing_ok=True)
+        self.conn = sqlite3.connect(self.tmp_path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        # Le righe arrivano nell'ordine di completamento, non di percorso: una cache ampia
+        # evita di riscrivere più volte le stesse pagine dell'indice
+        self.conn.execute(f"PRAGMA cache_size=-{MANIFEST_CACHE_KIB}")
+        self.conn.executescript(MANIFEST_SCHEMA)
+        self.conn.execute("BEGIN")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.conn.close()
+            self.tmp_path.unlink(missing_ok=True)
+
+    def add(self, rel_path, info):
+        self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", manifest_row(rel_path, info))
+
+    def finish(self, header, deleted=(), files=()):
+        insert_manifest(self.conn, files, deleted, header)
+        self.conn.execute("COMMIT")
+        self.conn.close()
+        with open(self.tmp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(self.tmp_path, self.path)
+
+
+class SnapshotJournal:
+    """
+    Journal dei file già salvati di uno snapshot in corso (journal.jsonl)
+
+    Una riga per file, scritta appena il suo contenuto è nello store; il
+    file viene sincronizzato su disco al più ogni JOURNAL_SYNC_SECONDS e
+    resta bloccato (flock) finché lo snapshot è in corso. Dopo
+    un'interruzione le voci dicono quali file non serve salvare di nuovo.
+    """
+
+    def __init__(self, path, entries=None):
+        self.path = Path(path)
+        self.entries = entries or {}
+        self.f = open(self.path, 'w', encoding='utf-8')
+        if HAS_FCNTL:
+            fcntl.flock(self.f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        for rel_path, info in self.entries.items():
+            self.f.write(json.dumps([rel_path, info], separators=(',', ':')) + '\n')
+        self.sync()
+
+    @staticmethod
+    def read(path):
+        """Voci di un journal esistente; l'ultima riga può essere troncata"""
+        entries = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rel_path, info = json.loads(line)
+                    except ValueError:
+                        break
+                    entries[rel_path] = info
+        except OSError:
+            pass
+        return entries
+
+    @staticmethod
+    def in_use(path):
+        """True se un altro processo sta ancora scrivendo questo journal"""
+        if not HAS_FCNTL:
+            return False
+        try:
+            with open(path, 'a', encoding='utf-8') as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def add(self, rel_path, info):
+        self.entries[rel_path] = info
+        self.f.write(json.dumps([rel_path, info], separators=(',', ':')) + '\n')
+        if time.monotonic() - self.synced >= JOURNAL_SYNC_SECONDS:
+            self.sync()
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.synced = time.monotonic()
+
+    def close(self):
+        if not self.f.closed:
+            self.sync()
+            self.f.close()
+
+    def resumable(self, rel_path, info, store):
+        """
+        Voce di un file già salvato con lo stesso contenuto, se i suoi blob
+        sono ancora nello store con la dimensione attesa
+        """
+        entry = self.entries.get(rel_path)
+        if entry is None or info['hash'] is None or entry['hash'] != info['hash'] or entry['size'] != info['size']:
+            return None
+        for digest, size in entry.get('chunks') or [[entry['hash'], entry['size']]]:
+            try:
+                if store.path_for(digest).stat().st_size != size:
+                    return None
+            except OSError:
+                return None
+        return entry
+
+
+class RepoLock:
+    """
+    Lock della cartella dei backup (flock su backups/.lock)
+
+    Snapshot, backup (anche quelli del watch), prune, compact e migrate
+    lo prendono esclusivo, replicate e verify condiviso: la GC non può
+    cancellare un blob che un backup in corso ha appena trovato nello
+    store e riusato, né uno che la replica sta copiando o verify sta
+    controllando, e due processi non riscrivono lo stato o i manifest
+    insieme. Verify passa all'esclusivo solo per quarantena e riparazione. Chi trova il lock occupato attende. È rientrante nello
+    stesso processo (un backup che diventa snapshot completo non si
+    blocca da solo); ``acquired`` è True solo per l'acquisizione più
+    esterna, dopo la quale lo stato va riletto.
+    """
+
+    def __init__(self, path, log=None):
+        self.path = Path(path)
+        self.log = log
+        self.depth = 0
+        self.f = None
+
+    def hold(self, exclusive=False):
+        self.exclusive = exclusive
+        return self
+
+    def __enter__(self):
+        self.depth += 1
+        if self.depth > 1:
+            return False
+        self.f = open(self.path, 'a', encoding='utf-8')
+        if HAS_FCNTL:
+            mode = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+            try:
+                fcntl.flock(self.f, mode | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if self.log:
+                    self.log("⏳ Cartella dei backup in uso da un altro processo (backup o prune), attendo...")
+                fcntl.flock(self.f, mode)
+        return True
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            self.f.close()
+            self.f = None
+
+
+class SnapshotView:
+    """
+    Stato completo di uno snapshot: la catena dei suoi manifest
+
+    Le ricerche per percorso scendono la catena dal manifest più recente e
+    si fermano al primo che contiene (o ha eliminato) il file, senza
+    ricostruire lo stato completo in memoria.
+    """
+
+    def __init__(self, manifests):
+        self.manifests = manifests  # dal più recente al più vecchio
+        self.header = manifests[0].header
+        self.depth = len(manifests) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        for manifest in self.manifests:
+            manifest.close()
+
+    def get(self, rel_path):
+        for manifest in self.manifests:
+            info = manifest.get(rel_path)
+            if info is not None:
+                return info
+            if manifest.is_deleted(rel_path):
+                return None
+        return None
+
+    def _resolve(self, rows, prefix):
+        if not self.depth:
+            return dict(rows(self.manifests[0], prefix))
+        resolved = {}
+        for manifest in reversed(self.manifests):
+            for rel_path in manifest.deleted(prefix):
+                resolved.pop(rel_path, None)
+            resolved.update(rows(manifest, prefix))
+        return resolved
+
+    def files(self, prefix=''):
+        """Stato risolto {percorso: info}, tutto o solo sotto la cartella ``prefix``"""
+        return self._resolve(Manifest.files, prefix)
+
+    def hashes(self, prefix=''):
+        """Come files(), ma solo {percorso: hash}"""
+        return self._resolve(Manifest.hashes, prefix)
+
+    def attach(self, conn, alias):
+        """
+        Rende lo stato risolto interrogabile in SQL da ``conn``: restituisce
+        il nome della tabella (path, size, hash, mode)
+
+        Un manifest completo su disco viene collegato direttamente; una
+        catena viene ricostruita in una tabella temporanea riapplicando i
+        manifest dal più vecchio, sempre dentro SQLite.
+        """
+        if not self.depth and self.manifests[0].path is not None:
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (str(self.manifests[0].path),))
+            return f"{alias}.files"
+
+        conn.execute(f"CREATE TEMP TABLE {alias} (path TEXT PRIMARY KEY, size INTEGER, hash TEXT, "
+                     f"mode INTEGER) WITHOUT ROWID")
+        for manifest in reversed(self.manifests):
+            if manifest.path is not None:
+                conn.execute("ATTACH DATABASE ? AS source", (str(manifest.path),))
+                conn.execute(f"DELETE FROM {alias} WHERE path IN (SELECT path FROM source.deleted)")
+                conn.execute(f"INSERT OR REPLACE INTO {alias} SELECT path, size, hash, mode FROM source.files")
+                conn.execute("DETACH DATABASE source")
+            else:
+                conn.executemany(f"DELETE FROM {alias} WHERE path = ?",
+                                 ((rel_path,) for rel_path in manifest.deleted()))
+                conn.executemany(f"INSERT OR REPLACE INTO {alias} VALUES (?, ?, ?, ?)",
+                                 manifest.conn.execute("SELECT path, size, hash, mode FROM files"))
+        return alias
+
+
+class BlobRefCounts:
+    """
+    Contatori di riferimenti dei blob, persistiti in backups/refcounts.json
+
+    Ogni manifest viene contato una sola volta e se ne registra l'impronta
+    (mtime, dimensione): se un manifest già contato cambia (compact,
+    migrate) i contatori vanno ricostruiti. I blob arrivati a zero restano
+    nel file finché non vengono cancellati, così un'interruzione non li
+    perde di vista.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.snapshots = {}
+        self.counts = {}
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.snapshots = data.get('snapshots', {})
+            self.counts = data.get('counts', {})
+        except (OSError, ValueError):
+            pass
+
+    def reset(self):
+        """Azzera i contatori (ricostruzione): i blob già noti restano candidati alla GC"""
+        self.snapshots = {}
+        self.counts = dict.fromkeys(self.counts, 0)
+
+    def add(self, name, fingerprint, refs):
+        self.snapshots[name] = fingerprint
+        for digest in refs:
+            self.counts[digest] = self.counts.get(digest, 0) + 1
+
+    def release(self, name, refs):
+        self.snapshots.pop(name, None)
+        for digest in refs:
+            self.counts[digest] = max(self.counts.get(digest, 0) - 1, 0)
+
+    def garbage(self):
+        """Blob senza più riferimenti"""
+        return [digest for digest, count in self.counts.items() if count <= 0]
+
+    def forget(self, digests):
+        for digest in digests:
+            self.counts.pop(digest, None)
+
+    def save(self):
+        tmp_path = self.path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'snapshots': self.snapshots, 'counts': self.counts}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+class FileHistory:
+    """
+    Indice delle versioni dei file tra gli snapshot, in backups/history.db
+
+    Per ogni percorso registra solo gli snapshot in cui il contenuto cambia
+    (o il file viene eliminato): una versione vale dallo snapshot in cui
+    compare fino alla versione successiva, quindi la cancellazione di uno
+    snapshot non richiede di aggiornare l'indice. Gli snapshot vanno
+    aggiunti in ordine; la tabella latest tiene l'hash attuale di ogni
+    percorso per confrontare il manifest successivo.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshots (name TEXT PRIMARY KEY, hash_algorithm TEXT) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS versions (path TEXT, snapshot TEXT, hash TEXT, size INTEGER,
+                                                 PRIMARY KEY (path, snapshot)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS latest (path TEXT PRIMARY KEY, hash TEXT) WITHOUT ROWID;
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.close()
+
+    def indexed(self):
+        """Snapshot già indicizzati: {nome: algoritmo di hash}"""
+        return dict(self.conn.execute("SELECT name, hash_algorithm FROM snapshots"))
+
+    def reset(self):
+        self.conn.executescript("""
+            BEGIN;
+            DELETE FROM snapshots;
+            DELETE FROM versions;
+            DELETE FROM latest;
+            COMMIT;
+        """)
+
+    def add(self, name, manifest):
+        """Registra le versioni introdotte da uno snapshot (più recente di quelli già indicizzati)"""
+        source = SnapshotView([manifest]).attach(self.conn, 'source')
+        try:
+            self.conn.execute("BEGIN")
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO versions SELECT s.path, ?, s.hash, s.size FROM {source} AS s "
+                f"LEFT JOIN latest AS l ON l.path = s.path WHERE l.hash IS NOT s.hash", (name,))
+            if manifest.header.get('parent'):
+                for rel_path in manifest.deleted():
+                    self.conn.execute("INSERT OR REPLACE INTO versions SELECT path, ?, NULL, NULL "
+                                      "FROM latest WHERE path = ?", (name, rel_path))
+                    self.conn.execute("DELETE FROM latest WHERE path = ?", (rel_path,))
+            else:
+                # Snapshot completo: i percorsi che non elenca sono stati eliminati
+                self.conn.execute(f"INSERT OR REPLACE INTO versions SELECT path, ?, NULL, NULL FROM latest "
+                                  f"WHERE path NOT IN (SELECT path FROM {source})", (name,))
+                self.conn.execute(f"DELETE FROM latest WHERE path NOT IN (SELECT path FROM {source})")
+            self.conn.execute(f"INSERT OR REPLACE INTO latest SELECT path, hash FROM {source}")
+            self.conn.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?)",
+                              (name, manifest.header.get('hash_algorithm', 'md5')))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            raise
+        finally:
+            if '.' in source:
+                self.conn.execute("DETACH DATABASE source")
+            else:
+                self.conn.execute(f"DROP TABLE {source}")
+
+    def versions(self, rel_path):
+        """[(snapshot, hash, dimensione)] in ordine di snapshot; hash None = eliminato"""
+        return self.conn.execute("SELECT snapshot, hash, size FROM versions WHERE path = ? ORDER BY snapshot",
+                                 (rel_path,)).fetchall()
+
+
+class ScatolaNera:
+    def __init__(self):
+        self.backup_dir = BACKUP_DIR
+        self.log_file = LOG_FILE
+        self.state_file = STATE_FILE
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        # Crea directory backups se non esiste
+        self.backup_dir.mkdir(exist_ok=True)
+        self.store = BlobStore(OBJECTS_DIR)
+        self.stat_cache = StatCache(STAT_CACHE_FILE, HASH_ALGORITHM)
+        self.workers = DEFAULT_WORKERS
+
+        # Modalità paranoica: ignora la stat cache e rielabora tutti gli hash
+        self.paranoid = False
+
+        # Stat dell'ultima scansione, per la copia zero-copy nello store
+        self.file_stats = {}
+
+        # Regole di esclusione compilate (create alla prima scansione)
+        self.matcher = None
+
+        # Compressione degli snapshot completi salvati come archivio (--archive)
+        self.archive_codec = None
+
+        # Cifrario degli archivi (--encrypt); None = come l'ultimo snapshot, False = in chiaro
+        self.encryption = None
+
+        # Stat e id degli oggetti dall'index di git per i file tracciati (--git)
+        self.use_git_index = USE_GIT_INDEX
+        self.git_index = None
+
+        # Lock della cartella dei backup (prune contro backup concorrenti)
+        self.repo_lock = RepoLock(REPO_LOCK_FILE, self.log)
+
+        # Carica stato precedente
+        self.state = self.load_state()
+        self.recover_snapshots()
+
+    def log(self, message):
+        """Scrivi nel log con timestamp"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        log_message = f"[{timestamp}] {message}\n"
+
+        print(log_message.strip())
+
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write(log_message)
+
+    def load_state(self):
+        """Carica lo stato precedente"""
+        if self.state_file.exists():
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {
+            'snapshots': [],
+            'last_backup': None,
+            'total_backups': 0
+        }
+
+    def reload_state(self):
+        """Rilegge lo stato, che un altro processo può aver cambiato prima del lock"""
+        self.state = self.load_state()
+        self.recover_snapshots()
+
+    def recover_snapshots(self):
+        """
+        Registra gli snapshot pubblicati ma assenti dallo stato
+
+        Succede se il processo si interrompe tra il rename della cartella
+        (o dell'archivio) e il salvataggio dello stato. Si considerano solo
+        quelli più recenti dell'ultimo registrato: i più vecchi sono
+        snapshot rimossi da prune e vengono lasciati alla sua pulizia.
+        """
+        newest = max((s['name'] for s in self.state['snapshots']), default='')
+        candidates = sorted(
+            name for name in (p.name.removesuffix(ARCHIVE_SUFFIX) for p in self.backup_dir.iterdir())
+            if name.startswith('snapshot_') and not name.endswith(STAGING_SUFFIX) and name > newest
+        )
+        for name in candidates:
+            try:
+                with self.open_manifest(name) as manifest:
+                    header = manifest.header
+            except (OSError, ValueError, sqlite3.Error):
+                continue
+            if 'datetime' not in header:
+                continue
+            self.log(f"🩹 Snapshot {name} completo ma non registrato: aggiunto allo stato")
+            self.record_snapshot(name, header)
+
+    def save_state(self):
+        """Salva lo stato corrente (in modo atomico)"""
+        tmp_file = self.state_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, indent=2, fp=f)
+        os.replace(tmp_file, self.state_file)
+
+    def set_background_mode(self, limit=0, nice=False, pause_when_busy=False, max_load=None):
+        """
+        Riduce l'impatto dell'esecuzione sull'agent e sul resto del sistema
+
+        ``limit`` limita a tanti MB/s le letture e le copie, ``nice`` abbassa
+        le priorità di CPU e di I/O, ``pause_when_busy`` ferma il lavoro
+        mentre l'agent ha job in corso (o il carico supera ``max_load``).
+        """
+        applied = [f"max {limit:g} MB/s"] if limit else []
+        if nice:
+            priority = lower_priority()
+            applied += priority
+            if not any(p.startswith('I/O') for p in priority):
+                self.log("⚠️  Priorità di I/O invariata: " +
+                         ("non supportata su questo sistema" if HAS_PSUTIL else "pip install psutil"))
+        busy_check = None
+        if pause_when_busy:
+            busy_check = lambda: agent_busy(max_load)
+            applied.append("pausa con l'agent occupato" + (f" o carico > {max_load:g}" if max_load else ""))
+        IO_THROTTLE.configure(int(limit * 1024 * 1024), busy_check, self.log)
+        if applied:
+            self.log(f"🐢 Esecuzione in sottofondo: {', '.join(applied)}")
+
+    def load_git_index(self):
+        """Index di git del progetto (riletto solo se cambiato); None se non disponibile"""
+        if not self.use_git_index:
+            return None
+        try:
+            self.git_index = GitIndex.open(PROJECT_ROOT, self.git_index)
+        except (OSError, ValueError, IndexError, struct.error) as e:
+            self.log(f"⚠️  Index di git non utilizzabile ({e}): hash dalla sola stat cache")
+            self.use_git_index = False
+            self.git_index = None
+        return self.git_index
+
+    def get_file_hash(self, filepath):
+        """Calcola hash BLAKE2b di un file"""
+        try:
+            return hash_file(filepath)
+        except Exception:
+            return None
+
+    def should_exclude(self, rel_path, is_dir=False):
+        """Verifica se un file/cartella (percorso relativo) deve essere escluso"""
+        if self.matcher is None:
+            self.matcher = self.build_matcher()
+        return self.matcher.excluded_path(rel_path, is_dir)
+
+    def build_matcher(self):
+        """Compila EXCLUDE_PATTERNS e tutti i .gitignore del progetto"""
+        matcher = ExcludeMatcher(EXCLUDE_PATTERNS)
+        for _ in self.walk_dirs(matcher):
+            pass  # la visita carica i .gitignore
+        return matcher
+
+    def walk_dirs(self, matcher, start=''):
+        """
+        Visita le cartelle non escluse con os.scandir
+
+        Le cartelle escluse vengono scartate prima di entrarci, quindi
+        .git, node_modules e backups/ non vengono mai percorse. Genera
+        (cartella_relativa, voci) e carica i .gitignore incontrati.
+        """
+        stack = [start]
+        while stack:
+            rel_dir = stack.pop()
+            abs_dir = PROJECT_ROOT / rel_dir if rel_dir else PROJECT_ROOT
+            try:
+                with os.scandir(abs_dir) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+
+            if USE_GITIGNORE and any(e.name == '.gitignore' for e in entries):
+                matcher.add_gitignore(rel_dir, abs_dir / '.gitignore')
+
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    if not matcher.excluded(rel_path, True):
+                        stack.append(rel_path)
+            yield rel_dir, entries
+
+    def walk_project(self, start='', matcher=None):
+        """Genera (percorso_relativo, DirEntry) per ogni file da salvare (sotto ``start``)"""
+        own_matcher = matcher is None
+        if own_matcher:
+            matcher = ExcludeMatcher(EXCLUDE_PATTERNS)
+        for rel_dir, entries in self.walk_dirs(matcher, start):
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False) or not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if not matcher.excluded(rel_path, False):
+                    yield rel_path, entry
+        if own_matcher:
+            self.matcher = matcher
+
+    def scan_project(self):
+        """Scansiona il progetto e raccogli info sui file"""
+        files_info = {}
+        full_rehash = self.paranoid or self.stat_cache.full_rehash_due()
+        if full_rehash:
+            self.log("🔍 Verifica completa: tutti gli hash vengono ricalcolati")
+        self.stat_cache.begin_scan()
+        to_hash = []
+        started = time.perf_counter()
+        git_index = self.load_git_index()
+        tracked = from_git = 0
+
+        for rel_path, entry in self.walk_project():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+
+            # Con l'index di git, un file tracciato la cui stat coincide con quella
+            # dell'index ha il contenuto del suo oggetto: se l'oggetto è già noto
+            # l'hash arriva dalla mappa oid -> hash anche senza voce nella stat cache
+            item = Path(entry.path)
+            oid = None
+            if git_index is not None and rel_path in git_index.entries:
+                tracked += 1
+                oid = git_index.oid(rel_path, st)
+            digest = None if full_rehash else self.stat_cache.lookup(rel_path, st)
+            if digest is None and not full_rehash:
+                digest = self.stat_cache.oid_digest(oid)
+                from_git += digest is not None
+            if digest is None:
+                to_hash.append((rel_path, item, st, oid))
+            else:
+                self.stat_cache.record(rel_path, st, digest)
+                self.stat_cache.record_oid(oid, digest)
+
+            files_info[rel_path] = {
+                'size': st.st_size,
+                'modified': st.st_mtime,
+                'mode': st.st_mode & 0o777,
+                'hash': digest
+            }
+            self.file_stats[rel_path] = st
+
+        # Hashing parallelo (hashlib rilascia il GIL sui blocchi grandi). La cache
+        # viene salvata periodicamente: se la scansione si interrompe, gli hash
+        # già calcolati non vanno ricalcolati
+        checkpoint = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            digests = executor.map(lambda entry: self.get_file_hash(entry[1]), to_hash)
+            for (rel_path, _, st, oid), digest in zip(to_hash, digests):
+                files_info[rel_path]['hash'] = digest
+                self.stat_cache.record(rel_path, st, digest)
+                self.stat_cache.record_oid(oid, digest)
+                if time.monotonic() - checkpoint > SCAN_CHECKPOINT_SECONDS:
+                    self.stat_cache.save()
+                    checkpoint = time.monotonic()
+
+        self.stat_cache.save(full_rehash=full_rehash)
+        hashed_bytes = sum(st.st_size for _, _, st, _ in to_hash)
+        elapsed = time.perf_counter() - started
+        if git_index is not None:
+            self.log(f"🌿 Index di git: {tracked} file tracciati, {len(files_info) - tracked} non tracciati; "
+                     f"{from_git} hash dagli oggetti git")
+        self.log(f"🔍 Hash calcolati: {len(to_hash)}/{len(files_info)} (gli altri dalla stat cache), "
+                 f"{format_rate(hashed_bytes, elapsed)}")
+        return files_info
+
+    def create_snapshot(self, description="Snapshot automatico", files_info=None):
+        """Crea uno snapshot completo del progetto"""
+        with self.repo_lock.hold(exclusive=True) as acquired:
+            if acquired:
+                self.reload_state()
+            self.log("=" * 60)
+            self.log(f"🔒 SCATOLA NERA - Creazione Snapshot")
+            self.log(f"📝 Descrizione: {description}")
+            self.log("=" * 60)
+
+            # Scansiona progetto
+            if files_info is None:
+                self.log("📊 Scansione progetto in corso...")
+                files_info = self.scan_project()
+            total_size = sum(f['size'] for f in files_info.values())
+
+            self.log(f"📁 File trovati: {len(files_info)}")
+            self.log(f"💾 Dimensione totale: {total_size / 1024 / 1024:.2f} MB")
+
+            if self.archive_mode():
+                return self.store_archive(description, files_info)
+
+            # I chunk dei file grandi invariati si riusano dall'ultimo snapshot
+            previous = None
+            if self.state['snapshots']:
+                try:
+                    previous = self.open_snapshot(self.state['snapshots'][-1]['name'])
+                except (OSError, ValueError, sqlite3.Error):
+                    previous = None
+                if previous is not None and previous.header.get('hash_algorithm', 'md5') != HASH_ALGORITHM:
+                    previous.close()
+                    previous = None
+
+            try:
+                return self.store_snapshot(description, files_info, previous=previous)
+            finally:
+                if previous is not None:
+                    previous.close()
+
+    def archive_mode(self):
+        """
+        True se il prossimo snapshot va salvato come archivio (--archive o --encrypt)
+
+        Dopo uno snapshot cifrato anche i successivi lo sono (senza
+        --encrypt=off): un backup pianificato non deve salvare in chiaro
+        quello che prima era cifrato.
+        """
+        if self.encryption is None and self.state['snapshots'] and self.state['snapshots'][-1].get('encryption'):
+            self.encryption = self.state['snapshots'][-1]['encryption']
+            self.log(f"🔐 L'ultimo snapshot è cifrato: cifro anche questo ({self.encryption})")
+        if self.encryption and not self.archive_codec:
+            self.archive_codec = ARCHIVE_COMPRESSION
+        return bool(self.archive_codec)
+
+    def snapshot_totals(self, files_info, deleted=(), previous=None):
+        """
+        Numero di file e dimensione dello stato completo: (file, byte)
+
+        Per un incrementale sono i totali del genitore (``previous``)
+        corretti per i soli file cambiati, con una ricerca per file.
+        """
+        if previous is None:
+            return len(files_info), sum(f['size'] for f in files_info.values())
+        files_count = previous.header['files_count']
+        total_size = previous.header['total_size']
+        for rel_path in deleted:
+            old = previous.get(rel_path)
+            if old is not None:
+                files_count -= 1
+                total_size -= old['size']
+        for rel_path, info in files_info.items():
+            old = previous.get(rel_path)
+            if old is None:
+                files_count += 1
+            else:
+                total_size -= old['size']
+            total_size += info['size']
+        return files_count, total_size
+
+    def store_snapshot(self, description, files_info, parent=None, deleted=None, previous=None):
+        """
+        Salva i contenuti nello store e scrive il manifest dello snapshot
+
+        Con ``parent`` lo snapshot è incrementale: ``files_info`` contiene solo
+        i file nuovi/modificati e ``deleted`` i file eliminati. ``previous``
+        (SnapshotView dell'ultimo snapshot) serve a riusare i chunk dei file
+        grandi già salvati e, per gli incrementali, a calcolare i totali con
+        una ricerca per file invece di ricostruire lo stato completo. Le
+        righe del manifest vengono scritte man mano che i file sono salvati.
+
+        Lo snapshot viene costruito in una cartella di lavoro con un journal
+        dei file salvati e compare con il nome definitivo (rename atomico)
+        solo quando è completo. Se un backup precedente è stato interrotto,
+        i file del suo journal con lo stesso contenuto non vengono salvati
+        di nuovo.
+        """
+        deleted = deleted or []
+
+        self.timestamp = self.next_timestamp()
+        snapshot_name = f"snapshot_{self.timestamp}"
+        snapshot_path = self.backup_dir / snapshot_name
+        staging_path, journal = self.open_staging(snapshot_name)
+
+        try:
+            # File già salvati da un backup interrotto (stesso contenuto, blob presenti)
+            resumed = {}
+            if journal.entries:
+                for rel_path, info in files_info.items():
+                    entry = journal.resumable(rel_path, info, self.store)
+                    if entry is not None:
+                        resumed[rel_path] = entry
+                self.log(f"♻️ Ripresa di un backup interrotto: {len(resumed)} file già salvati")
+
+            # Versioni precedenti dei soli file grandi (ricerche nell'indice, prima di usare i thread)
+            previous_big = {}
+            if previous is not None:
+                for rel_path, info in files_info.items():
+                    if info['size'] >= CHUNK_THRESHOLD and rel_path not in resumed:
+                        previous_big[rel_path] = previous.get(rel_path) or {}
+
+            # Salva i contenuti nello store (i file invariati sono già presenti)
+            self.log("💾 Backup file in corso...")
+            started = time.perf_counter()
+
+            def store_one(item):
+                rel_path, info = item
+                src = PROJECT_ROOT / rel_path
+                if rel_path in resumed:
+                    if 'chunks' in resumed[rel_path]:
+                        info['chunks'] = resumed[rel_path]['chunks']
+                    return info['hash'], 0
+                if info['size'] >= CHUNK_THRESHOLD:
+                    previous_info = previous_big.get(rel_path, {})
+                    if previous_info.get('hash') == info['hash'] and 'chunks' in previous_info \
+                            and all(self.store.has(d) for d, _ in previous_info['chunks']):
+                        info['chunks'] = previous_info['chunks']
+                        return info['hash'], 0
+                    digest, info['chunks'], new_bytes = self.store.put_chunked(src, previous_info.get('chunks'))
+                    return digest, new_bytes
+
+                if info['hash'] is not None and self.store.has(info['hash']):
+                    return info['hash'], 0
+                digest = self.store.put_file(src, info['hash'], self.file_stats.get(rel_path))
+                return digest, info['size']
+
+            stored_count = 0
+            new_blobs = 0
+            copied_bytes = 0
+            items = list(files_info.items())
+            with ManifestWriter(staging_path / MANIFEST_FILE) as manifest:
+                executor = ThreadPoolExecutor(max_workers=self.workers)
+                try:
+                    futures = [executor.submit(store_one, item) for item in items]
+                    for (rel_path, info), future in zip(items, futures):
+                        try:
+                            info['hash'], new_bytes = future.result()
+                        except Exception as e:
+                            self.log(f"⚠️ Errore copia {rel_path}: {e}")
+                            del files_info[rel_path]
+                            continue
+                        manifest.add(rel_path, info)
+                        journal.add(rel_path, info)
+                        stored_count += 1
+                        if new_bytes:
+                            new_blobs += 1
+                            copied_bytes += new_bytes
+                finally:
+                    # Su interruzione (Ctrl+C) i file in coda non vengono più salvati
+                    executor.shutdown(wait=True, cancel_futures=True)
+
+                elapsed = time.perf_counter() - started
+                self.log(f"✅ File salvati: {stored_count} ({new_blobs} contenuti nuovi, "
+                         f"{stored_count - new_blobs} già presenti), {format_rate(copied_bytes, elapsed)}")
+
+                files_count, total_size = self.snapshot_totals(files_info, deleted, previous if parent else None)
+
+                # Intestazione del manifest
+                metadata = {
+                    'format': SNAPSHOT_FORMAT,
+                    'storage': 'objects',
+                    'hash_algorithm': HASH_ALGORITHM,
+                    'type': 'incremental' if parent else 'full',
+                    'timestamp': self.timestamp,
+                    'datetime': datetime.now().isoformat(),
+                    'description': description,
+                    'files_count': files_count,
+                    'total_size': total_size
+                }
+                if parent:
+                    metadata['parent'] = parent
+                    metadata['changed_count'] = len(files_info)
+                manifest.finish(metadata, deleted)
+        finally:
+            journal.close()
+
+        # Pubblicazione: la cartella prende il nome definitivo, il journal non serve più
+        os.rename(staging_path, snapshot_path)
+        (snapshot_path / JOURNAL_FILE).unlink()
+        self.record_snapshot(snapshot_name, metadata)
+
+        self.log("=" * 60)
+        self.log(f"✅ SNAPSHOT COMPLETATO: {snapshot_name}")
+        self.log(f"📍 Percorso: {snapshot_path}")
+        self.log("=" * 60)
+
+        return snapshot_path
+
+    def open_staging(self, snapshot_name):
+        """
+        Cartella di lavoro e journal di un nuovo snapshot
+
+        Le cartelle di lavoro lasciate da backup interrotti (e non più in
+        uso da un altro processo) vengono riprese: i loro journal si
+        uniscono e l'ultima cartella viene rinominata per il nuovo snapshot.
+        """
+        staging_path = self.backup_dir / f"{snapshot_name}{STAGING_SUFFIX}"
+        entries = {}
+        abandoned = []
+        for path in sorted(self.backup_dir.glob(f"snapshot_*{STAGING_SUFFIX}")):
+            if not path.is_dir() or SnapshotJournal.in_use(path / JOURNAL_FILE):
+                continue
+            entries.update(SnapshotJournal.read(path / JOURNAL_FILE))
+            abandoned.append(path)
+
+        if abandoned:
+            for path in abandoned[:-1]:
+                shutil.rmtree(path)
+            os.rename(abandoned[-1], staging_path)
+            (staging_path / (MANIFEST_FILE + '.tmp')).unlink(missing_ok=True)
+            (staging_path / MANIFEST_FILE).unlink(missing_ok=True)
+        else:
+            staging_path.mkdir()
+        return staging_path, SnapshotJournal(staging_path / JOURNAL_FILE, entries)
+
+    def store_archive(self, description, files_info, parent=None, deleted=None, previous=None):
+        """
+        Salva uno snapshot come unico archivio compresso
+
+        I file passano dal disco all'archivio in streaming; l'hash viene
+        calcolato durante la compressione, quindi corrisponde sempre al
+        contenuto archiviato. Il blob store non viene usato. Con ``parent``
+        l'archivio è incrementale come in store_snapshot: contiene solo i
+        file cambiati, gli altri si leggono dagli archivi dei genitori.
+
+        L'indice di un archivio in chiaro viene salvato anche in
+        archive-index/ (solo in locale, come stat cache e indice delle
+        versioni): il backup successivo lo interroga senza leggere
+        l'archivio. Per un archivio cifrato non c'è copia locale, che
+        esporrebbe percorsi e hash dei file: la catena si confronta
+        decifrando gli indici degli archivi.
+        """
+        deleted = deleted or []
+        if parent and self.encryption:
+            # Il genitore potrebbe essere stato letto da una copia locale lasciata dalle versioni
+            # precedenti: la passphrase va verificata, perché tutta la catena si deve poter
+            # decifrare con la stessa
+            ArchiveReader(self.archive_path(parent))
+        self.timestamp = self.next_timestamp()
+        snapshot_name = f"snapshot_{self.timestamp}"
+        archive_path = self.archive_path(snapshot_name)
+
+        encryption = f", cifrato {self.encryption}" if self.encryption else ''
+        self.log(f"📦 Scrittura archivio ({self.archive_codec}{encryption}) in corso...")
+        started = time.perf_counter()
+        read_bytes = 0
+        with ArchiveWriter(archive_path, self.archive_codec, self.encryption) as archive:
+            for rel_path, info in sorted(files_info.items()):
+                info.pop('chunks', None)
+                try:
+                    info['hash'], info['offset'], info['length'], info['size'], info['codec'] = \
+                        archive.add([PROJECT_ROOT / rel_path])
+                except OSError as e:
+                    self.log(f"⚠️ Errore copia {rel_path}: {e}")
+                    del files_info[rel_path]
+                    continue
+                info['archive'] = snapshot_name
+                read_bytes += info['size']
+
+            files_count, total_size = self.snapshot_totals(files_info, deleted, previous if parent else None)
+            metadata = {
+                'format': SNAPSHOT_FORMAT,
+                'storage': 'archive',
+                'compression': self.archive_codec,
+                'hash_algorithm': HASH_ALGORITHM,
+                'type': 'incremental' if parent else 'full',
+                'timestamp': self.timestamp,
+                'datetime': datetime.now().isoformat(),
+                'description': description,
+                'files_count': files_count,
+                'total_size': total_size,
+                'files': files_info
+            }
+            if parent:
+                metadata['parent'] = parent
+                metadata['deleted'] = deleted
+                metadata['changed_count'] = len(files_info)
+            if self.encryption:
+                metadata['encryption'] = self.encryption
+            if not self.encryption:
+                ARCHIVE_INDEX_DIR.mkdir(exist_ok=True)
+                with ManifestWriter(self.archive_index_path(snapshot_name)) as index:
+                    index.finish(manifest_header(metadata), deleted, files_info.items())
+            archive.finish(metadata)
+
+        elapsed = time.perf_counter() - started
+        archive_size = archive_path.stat().st_size
+        self.log(f"✅ File archiviati: {len(files_info)}, {format_rate(read_bytes, elapsed)}")
+        if parent:
+            self.log(f"🔗 Incrementale di: {parent}")
+        self.log(f"📦 Archivio: {archive_size / 1024 / 1024:.2f} MB "
+                 f"({archive_size / read_bytes * 100 if read_bytes else 100:.0f}% dell'originale)")
+        self.record_snapshot(snapshot_name, metadata)
+
+        self.log("=" * 60)
+        self.log(f"✅ SNAPSHOT COMPLETATO: {snapshot_name}")
+        self.log(f"📍 Percorso: {archive_path}")
+        self.log("=" * 60)
+
+        return archive_path
+
+    def record_snapshot(self, snapshot_name, metadata):
+        """Aggiunge lo snapshot allo stato"""
+        entry = {
+            'name': snapshot_name,
+            'timestamp': metadata['timestamp'],
+            'datetime': metadata['datetime'],
+            'description': metadata['description'],
+            'files_count': metadata['files_count'],
+            'size': metadata['total_size'],
+            'type': metadata['type']
+        }
+        if metadata.get('parent'):
+            entry['parent'] = metadata['parent']
+        entry['storage'] = metadata['storage']
+        entry['hash_algorithm'] = metadata['hash_algorithm']
+        if metadata.get('encryption'):
+            entry['encryption'] = metadata['encryption']
+        self.state['snapshots'].append(entry)
+        self.state['last_backup'] = metadata['datetime']
+        self.state['total_backups'] += 1
+
+        self.save_state()
+
+        try:
+            self.sync_history()
+        except sqlite3.Error as e:
+            self.log(f"⚠️ Indice delle versioni non aggiornato: {e}")
+
+    def archive_path(self, snapshot_name):
+        """Archivio di uno snapshot (o un file .snar indicato direttamente)"""
+        if snapshot_name.endswith(ARCHIVE_SUFFIX):
+            return Path(snapshot_name)
+        return self.backup_dir / f"{snapshot_name}{ARCHIVE_SUFFIX}"
+
+    def archive_index_path(self, snapshot_name):
+        """Copia locale dell'indice di un archivio in chiaro"""
+        return ARCHIVE_INDEX_DIR / f"{snapshot_name}.db"
+
+    def open_archives(self, snapshot_name):
+        """Lettori per i membri di uno snapshot archiviato (anche incrementale)"""
+        return ArchiveChain(self.archive_path, snapshot_name)
+
+    def open_manifest(self, snapshot_name):
+        """Manifest di un solo snapshot (manifest.db, archivio .snar o metadata.json legacy)"""
+        archive_path = self.archive_path(snapshot_name)
+        if archive_path.exists():
+            # Senza copia locale dell'indice (archivi cifrati o precedenti, replica) si
+            # legge quello dell'archivio, che se cifrato richiede la passphrase
+            if not snapshot_name.endswith(ARCHIVE_SUFFIX) and self.archive_index_path(snapshot_name).exists():
+                return Manifest.open(self.archive_index_path(snapshot_name))
+            metadata = ArchiveReader(archive_path).metadata
+            for info in metadata['files'].values():
+                info.setdefault('archive', snapshot_name)
+            return Manifest.from_metadata(metadata)
+        snapshot_path = self.backup_dir / snapshot_name
+        if (snapshot_path / MANIFEST_FILE).exists():
+            return Manifest.open(snapshot_path / MANIFEST_FILE)
+        with open(snapshot_path / LEGACY_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return Manifest.from_metadata(json.load(f))
+
+    def open_snapshot(self, snapshot_name):
+        """Stato completo di uno snapshot (SnapshotView sulla catena dei genitori)"""
+        manifests = [self.open_manifest(snapshot_name)]
+        names = {snapshot_name}
+        try:
+            while manifests[-1].header.get('parent'):
+                parent = manifests[-1].header['parent']
+                if parent in names:
+                    raise ValueError(f"Catena di snapshot ciclica: {parent}")
+                names.add(parent)
+                manifests.append(self.open_manifest(parent))
+        except BaseException:
+            for manifest in manifests:
+                manifest.close()
+            raise
+        return SnapshotView(manifests)
+
+    def write_metadata(self, snapshot_path, metadata):
+        """Scrive il manifest (manifest.db) in modo atomico, al posto di un eventuale metadata.json"""
+        with ManifestWriter(snapshot_path / MANIFEST_FILE) as manifest:
+            manifest.finish(manifest_header(metadata), metadata.get('deleted', ()), metadata['files'].items())
+        (snapshot_path / LEGACY_MANIFEST_FILE).unlink(missing_ok=True)
+
+    def resolve_snapshot(self, snapshot_name):
+        """
+        Ricostruisce lo stato completo di uno snapshot seguendo la catena dei genitori
+
+        Restituisce (intestazione, files, lunghezza_catena); le modifiche più
+        recenti prevalgono. Serve solo quando occorrono tutti i file (restore,
+        export): per cercare singoli percorsi si usa open_snapshot().
+        """
+        with self.open_snapshot(snapshot_name) as view:
+            return dict(view.header), view.files(), view.depth
+
+    def compact_snapshot(self, snapshot_name):
+        """Trasforma uno snapshot incrementale in uno completo (sintetico)"""
+        with self.repo_lock.hold(exclusive=True) as acquired:
+            if acquired:
+                self.reload_state()
+            metadata, files, depth = self.resolve_snapshot(snapshot_name)
+            if depth == 0:
+                self.log(f"✅ {snapshot_name} è già uno snapshot completo")
+                return False
+            if metadata.get('storage') == 'archive':
+                # I contenuti restano negli archivi dei genitori: la catena si chiude con il
+                # prossimo archivio completo (ogni MAX_CHAIN_LENGTH backup) o con export
+                self.log(f"❌ {snapshot_name} è un archivio incrementale: per uno completo usa export")
+                return False
+
+            metadata['files'] = files
+            metadata['type'] = 'full'
+            metadata['synthetic'] = True
+            metadata['files_count'] = len(files)
+            metadata['total_size'] = sum(f['size'] for f in files.values())
+            for key in ('parent', 'deleted', 'changed_count'):
+                metadata.pop(key, None)
+            self.write_metadata(self.backup_dir / snapshot_name, metadata)
+
+            for entry in self.state['snapshots']:
+                if entry['name'] == snapshot_name:
+                    entry['type'] = 'full'
+                    entry.pop('parent', None)
+            self.save_state()
+
+            self.log(f"✅ Compattato {snapshot_name}: catena di {depth} incrementali unita "
+                     f"in {len(files)} file")
+            return True
+
+    def list_snapshots(self):
+        """Elenca tutti gli snapshot disponibili"""
+        self.log("=" * 60)
+        self.log("📦 SNAPSHOT DISPONIBILI")
+        self.log("=" * 60)
+
+        if not self.state['snapshots']:
+            self.log("⚠️ Nessuno snapshot trovato")
+            return
+
+        for i, snapshot in enumerate(self.state['snapshots'], 1):
+            self.log(f"\n{i}. {snapshot['name']}")
+            self.log(f"   📅 Data: {snapshot['datetime']}")
+            self.log(f"   📝 Descrizione: {snapshot['description']}")
+            self.log(f"   📁 File: {snapshot['files_count']}")
+            self.log(f"   💾 Dimensione: {snapshot['size'] / 1024 / 1024:.2f} MB")
+            if snapshot.get('parent'):
+                self.log(f"   🔗 Incrementale di: {snapshot['parent']}")
+            if snapshot.get('storage') == 'archive':
+                self.log(f"   📦 Archivio: {snapshot['name']}{ARCHIVE_SUFFIX}")
+            if snapshot.get('encryption'):
+                self.log(f"   🔐 Cifrato: {snapshot['encryption']}")
+
+        self.log("\n" + "=" * 60)
+
+    def restore_snapshot(self, snapshot_name, patterns=None, dry_run=False):
+        """
+        Ripristina uno snapshot, o solo i percorsi che corrispondono a ``patterns``
+
+        Vengono copiati solo i file mancanti o con contenuto diverso: l'hash
+        attuale arriva dalla stat cache quando possibile, altrimenti viene
+        ricalcolato (solo se la dimensione coincide). Confronto e copia
+        usano il pool di thread. Con ``dry_run`` elenca le modifiche senza
+        toccare nulla.
+        """
+        snapshot_path = self.backup_dir / snapshot_name
+
+        if not snapshot_path.exists() and not self.archive_path(snapshot_name).exists():
+            self.log(f"❌ Snapshot non trovato: {snapshot_name}")
+            return False
+
+        self.log("=" * 60)
+        self.log(f"🔄 RIPRISTINO SNAPSHOT: {snapshot_name}")
+        self.log("=" * 60)
+
+        # Carica metadata (risolvendo la catena degli incrementali)
+        metadata, files, _ = self.resolve_snapshot(snapshot_name)
+
+        if patterns:
+            files = self.filter_files(files, patterns)
+            if not files:
+                self.log(f"❌ Nessun file dello snapshot corrisponde a: {' '.join(patterns)}")
+                return False
+
+        self.log(f"📅 Data snapshot: {metadata['datetime']}")
+        self.log(f"📁 File selezionati: {len(files)}")
+
+        # Confronto con i file attuali
+        comparable = metadata.get('hash_algorithm', 'md5') == HASH_ALGORITHM
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            actions = list(executor.map(
+                lambda item: self.restore_action(item[0], item[1], comparable), files.items()))
+        plan = [(path, files[path], action) for path, action in zip(files, actions) if action != 'unchanged']
+
+        counts = {action: actions.count(action) for action in ('new', 'modified', 'mode', 'unchanged')}
+        self.log(f"🔍 Da ripristinare: {counts['new']} mancanti, {counts['modified']} modificati, "
+                 f"{counts['mode']} solo permessi, {counts['unchanged']} già identici")
+
+        if dry_run:
+            symbols = {'new': '+', 'modified': '~', 'mode': '⚙'}
+            for path, _, action in sorted(plan, key=lambda entry: entry[0]):
+                self.log(f"   {symbols[action]} {path}")
+            self.log("🔍 Dry-run: nessun file modificato")
+            return True
+
+        if not plan:
+            self.log("✅ I file sono già identici allo snapshot")
+            return True
+
+        self.log("⚠️ ATTENZIONE: Questo sovrascriverà i file correnti!")
+
+        # Conferma (in modalità interattiva)
+        if sys.stdin.isatty():
+            response = input("\n⚠️ Vuoi procedere? (si/no): ")
+            if response.lower() not in ['si', 'yes', 'y', 's']:
+                self.log("❌ Ripristino annullato")
+                return False
+
+        # Ripristina file
+        self.log("🔄 Ripristino in corso...")
+        archive = None
+        if metadata.get('storage') == 'archive':
+            archive = self.open_archives(snapshot_name)
+
+        def restore_one(entry):
+            rel_path, info, action = entry
+            dst = PROJECT_ROOT / rel_path
+            if action == 'mode':
+                os.chmod(dst, info['mode'])
+                return
+            sources = [] if archive else self.snapshot_file_sources(snapshot_path, metadata, rel_path, info)
+            if not all(src.exists() for src in sources):
+                raise FileNotFoundError("contenuto mancante nello store")
+            # Crea directory se necessario
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            self.restore_file(sources, dst, info, archive)
+
+        restored_count = 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(restore_one, entry) for entry in plan]
+            for (rel_path, info, _), future in zip(plan, futures):
+                try:
+                    future.result()
+                    restored_count += 1
+                except Exception as e:
+                    self.log(f"⚠️ Errore ripristino {rel_path}: {e}")
+
+        restored_bytes = sum(info['size'] for _, info, action in plan if action != 'mode')
+        self.log(f"✅ File ripristinati: {restored_count}/{len(plan)} "
+                 f"({counts['unchanged']} già identici), "
+                 f"{format_rate(restored_bytes, time.perf_counter() - started)}")
+        self.log("=" * 60)
+        self.log("✅ RIPRISTINO COMPLETATO")
+        self.log("=" * 60)
+
+        return True
+
+    def filter_files(self, files, patterns):
+        """Solo i file che corrispondono a percorsi o glob (sintassi .gitignore, una cartella include il contenuto)"""
+        selector = ExcludeMatcher(patterns)
+        return {path: info for path, info in files.items() if selector.excluded_path(path)}
+
+    def restore_action(self, rel_path, info, comparable):
+        """Cosa serve per riportare un file allo stato dello snapshot"""
+        dst = PROJECT_ROOT / rel_path
+        try:
+            st = os.stat(dst)
+        except FileNotFoundError:
+            return 'new'
+        except OSError:
+            return 'modified'
+        if not stat.S_ISREG(st.st_mode) or st.st_size != info['size'] or not comparable:
+            return 'modified'
+
+        digest = self.stat_cache.lookup(rel_path, st) or self.get_file_hash(dst)
+        if digest != info['hash']:
+            return 'modified'
+        if 'mode' in info and st.st_mode & 0o777 != info['mode']:
+            return 'mode'
+        return 'unchanged'
+
+    def diff_snapshots(self, name_a, name_b, patterns=None, content=False):
+        """
+        Confronta due snapshot usando solo i manifest (percorso, hash, dimensione)
+
+        Nessun contenuto viene letto e i manifest non vengono caricati in
+        memoria: il confronto è una join SQL sulle tabelle ordinate per
+        percorso, quindi resta veloce anche con centinaia di migliaia di
+        file. Con ``content`` viene mostrato il diff testuale dei soli file
+        modificati che corrispondono a ``patterns``.
+        """
+        try:
+            view_a = self.open_snapshot(name_a)
+        except OSError as e:
+            self.log(f"❌ Snapshot non trovato: {e.filename or e}")
+            return None
+        try:
+            view_b = self.open_snapshot(name_b)
+        except OSError as e:
+            view_a.close()
+            self.log(f"❌ Snapshot non trovato: {e.filename or e}")
+            return None
+
+        with view_a, view_b:
+            return self.diff_views(name_a, view_a, name_b, view_b, patterns, content)
+
+    def diff_views(self, name_a, view_a, name_b, view_b, patterns, content):
+        metadata_a, metadata_b = view_a.header, view_b.header
+
+        # Con algoritmi di hash diversi si possono confrontare solo le dimensioni
+        comparable = metadata_a.get('hash_algorithm', 'md5') == metadata_b.get('hash_algorithm', 'md5')
+        if not comparable:
+            self.log("⚠️ Snapshot con algoritmi di hash diversi: confronto solo per dimensione")
+
+        conn = sqlite3.connect(':memory:', isolation_level=None)
+        try:
+            table_a = view_a.attach(conn, 'a')
+            table_b = view_b.attach(conn, 'b')
+            selected = 'selected(path)' if patterns else '1'
+            if patterns:
+                selector = ExcludeMatcher(patterns)
+                conn.create_function('selected', 1, selector.excluded_path, deterministic=True)
+
+            added = conn.execute(
+                f"SELECT path, size FROM {table_b} WHERE {selected} "
+                f"AND path NOT IN (SELECT path FROM {table_a}) ORDER BY path").fetchall()
+            removed = conn.execute(
+                f"SELECT path, size FROM {table_a} WHERE {selected} "
+                f"AND path NOT IN (SELECT path FROM {table_b}) ORDER BY path").fetchall()
+            changed = conn.execute(
+                f"SELECT path, x.size, y.size, x.hash IS NOT y.hash, x.mode, y.mode "
+                f"FROM {table_a} AS x JOIN {table_b} AS y USING (path) WHERE {selected} "
+                f"AND (x.size != y.size OR x.hash IS NOT y.hash OR x.mode IS NOT y.mode) ORDER BY path").fetchall()
+        finally:
+            conn.close()
+
+        modified = []
+        mode_only = []
+        for path, size_a, size_b, hash_differs, mode_a, mode_b in changed:
+            if size_a != size_b or (comparable and hash_differs):
+                modified.append((path, size_a, size_b))
+            elif mode_a != mode_b:
+                mode_only.append((path, mode_a, mode_b))
+
+        for path, size in added:
+            print(f"+ {path} ({format_size(size)})")
+        for path, size in removed:
+            print(f"- {path} ({format_size(size)})")
+        for path, size_a, size_b in modified:
+            print(f"~ {path} ({format_size(size_a)} → {format_size(size_b)}, "
+                  f"{'+' if size_b >= size_a else '-'}{format_size(abs(size_b - size_a))})")
+        for path, mode_a, mode_b in mode_only:
+            print(f"⚙ {path} ({mode_a or 0:o} → {mode_b or 0:o})")
+
+        added_bytes = sum(size for _, size in added)
+        removed_bytes = sum(size for _, size in removed)
+        delta = sum(size_b - size_a for _, size_a, size_b in modified)
+        self.log(f"📊 {name_a} → {name_b}: {len(added)} aggiunti (+{format_size(added_bytes)}), "
+                 f"{len(removed)} rimossi (-{format_size(removed_bytes)}), {len(modified)} modificati "
+                 f"({'+' if delta >= 0 else '-'}{format_size(abs(delta))}), {len(mode_only)} solo permessi")
+
+        if content:
+            if not patterns:
+                self.log("⚠️ Con --content indica i percorsi da confrontare (es. diff a b app/index.html --content)")
+            else:
+                for path, _, _ in modified:
+                    self.print_content_diff(name_a, metadata_a, name_b, metadata_b,
+                                            path, view_a.get(path), view_b.get(path))
+
+        return {
+            'added': [path for path, _ in added],
+            'removed': [path for path, _ in removed],
+            'modified': [path for path, _, _ in modified],
+            'mode': [path for path, _, _ in mode_only]
+        }
+
+    def print_content_diff(self, name_a, metadata_a, name_b, metadata_b, rel_path, info_a, info_b):
+        """Diff testuale (unified) di un file tra due snapshot"""
+        if max(info_a['size'], info_b['size']) > DIFF_MAX_SIZE:
+            print(f"\n~ {rel_path}: file troppo grande per il diff testuale")
+            return
+        data_a = self.read_snapshot_file(name_a, metadata_a, rel_path, info_a)
+        data_b = self.read_snapshot_file(name_b, metadata_b, rel_path, info_b)
+        if b'\0' in data_a[:8192] or b'\0' in data_b[:8192]:
+            print(f"\n~ {rel_path}: file binario")
+            return
+        print()
+        for line in difflib.unified_diff(
+                data_a.decode('utf-8', errors='replace').splitlines(),
+                data_b.decode('utf-8', errors='replace').splitlines(),
+                fromfile=f"{name_a}/{rel_path}", tofile=f"{name_b}/{rel_path}", lineterm=''):
+            print(line)
+
+    def read_snapshot_file(self, snapshot_name, metadata, rel_path, info):
+        """Contenuto di un file di uno snapshot, in memoria (solo per file piccoli)"""
+        if metadata.get('storage') == 'archive':
+            parts = []
+            self.open_archives(snapshot_name).read_member(info, parts.append)
+            return b''.join(parts)
+        data = bytearray()
+        for src in self.snapshot_file_sources(self.backup_dir / snapshot_name, metadata, rel_path, info):
+            with open(src, 'rb') as f:
+                data += f.read()
+        return bytes(data)
+
+    def snapshot_file_sources(self, snapshot_path, metadata, rel_path, info):
+        """Percorsi da cui leggere un file dello snapshot (blob, chunk in ordine o copia legacy)"""
+        if 'chunks' in info:
+            return [self.store.path_for(digest) for digest, _ in info['chunks']]
+        if metadata.get('storage') == 'objects':
+            return [self.store.path_for(info['hash'])]
+        return [snapshot_path / rel_path]
+
+    def restore_file(self, sources, dst, info, archive=None):
+        """
+        Copia un file nel progetto ripristinando permessi e data di modifica
+
+        Restituisce 'reflink' se il file condivide i blocchi della sorgente,
+        'copy' altrimenti.
+        """
+        method = 'copy'
+        if archive is not None:
+            archive.extract(info, dst)
+        elif len(sources) == 1:
+            method = copy_file_fast(sources[0], dst)
+        else:
+            # File a chunk: ricomposto in streaming, un chunk alla volta
+            with open(dst, 'wb') as fdst:
+                for src in sources:
+                    with open(src, 'rb') as fsrc:
+                        for chunk in iter(lambda: fsrc.read(READ_BUFFER_SIZE), b''):
+                            IO_THROTTLE.consume(len(chunk))
+                            fdst.write(chunk)
+        if 'mode' in info:
+            os.chmod(dst, info['mode'])
+        os.utime(dst, (info['modified'], info['modified']))
+        return method
+
+    def export_snapshot(self, snapshot_name, destination=None):
+        """
+        Esporta lo stato completo di uno snapshot in un archivio .snar
+
+        Utile per copiare un backup su un altro disco o macchina: un solo
+        file, compresso (e cifrato con --encrypt), che ``restore``/``extract``
+        accettano direttamente.
+        """
+        metadata, files, depth = self.resolve_snapshot(snapshot_name)
+        archives = None
+        if metadata.get('storage') == 'archive':
+            if not depth:
+                self.log(f"✅ {snapshot_name} è già un archivio: {self.archive_path(snapshot_name)}")
+                return self.archive_path(snapshot_name)
+            # Archivio incrementale: i membri vengono estratti dagli archivi della catena
+            archives = self.open_archives(snapshot_name)
+        if destination is None:
+            destination = self.backup_dir / 'exports' / f"{snapshot_name}{ARCHIVE_SUFFIX}"
+        destination = Path(destination)
+        codec = self.archive_codec or ARCHIVE_COMPRESSION
+        snapshot_path = self.backup_dir / snapshot_name
+
+        encryption = self.encryption or None
+        self.log(f"📦 Esportazione {snapshot_name} ({codec}{f', cifrato {encryption}' if encryption else ''}) in corso...")
+        started = time.perf_counter()
+        exported = {}
+        self.store.tmp_dir.mkdir(parents=True, exist_ok=True)
+        with ArchiveWriter(destination, codec, encryption) as archive, \
+                tempfile.TemporaryDirectory(dir=self.store.tmp_dir) as tmp_dir:
+            for rel_path, info in sorted(files.items()):
+                try:
+                    if archives is not None:
+                        sources = [Path(tmp_dir) / 'member']
+                        archives.extract(info, sources[0])
+                    else:
+                        sources = self.snapshot_file_sources(snapshot_path, metadata, rel_path, info)
+                    digest, offset, length, size, member_codec = archive.add(sources)
+                except (OSError, ValueError) as e:
+                    self.log(f"⚠️ Contenuto mancante per {rel_path}: {e}")
+                    continue
+                entry = {k: v for k, v in info.items() if k not in ('chunks', 'archive')}
+                entry.update(hash=digest, offset=offset, length=length, size=size, codec=member_codec)
+                exported[rel_path] = entry
+
+            export_metadata = {k: v for k, v in metadata.items()
+                               if k not in ('parent', 'deleted', 'changed_count', 'synthetic')}
+            export_metadata.update(
+                storage='archive',
+                compression=codec,
+                hash_algorithm=HASH_ALGORITHM,
+                type='full',
+                files_count=len(exported),
+                total_size=sum(f['size'] for f in exported.values()),
+                files=exported
+            )
+            if encryption:
+                export_metadata['encryption'] = encryption
+            archive.finish(export_metadata)
+
+        elapsed = time.perf_counter() - started
+        self.log(f"✅ Esportati {len(exported)} file, {format_rate(export_metadata['total_size'], elapsed)}")
+        self.log(f"📍 Archivio: {destination} ({destination.stat().st_size / 1024 / 1024:.2f} MB)")
+        return destination
+
+    def extract_file(self, snapshot_name, rel_path, destination=None):
+        """Estrae un solo file da uno snapshot (o da un archivio .snar)"""
+        with self.open_snapshot(snapshot_name) as view:
+            metadata, info = view.header, view.get(rel_path)
+        if info is None:
+            self.log(f"❌ {rel_path} non è presente in {snapshot_name}")
+            return False
+
+        dst = Path(destination) if destination else PROJECT_ROOT / rel_path
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if metadata.get('storage') == 'archive':
+            self.restore_file([], dst, info, self.open_archives(snapshot_name))
+        else:
+            sources = self.snapshot_file_sources(self.backup_dir / snapshot_name, metadata, rel_path, info)
+            self.restore_file(sources, dst, info)
+
+        self.log(f"✅ Estratto {rel_path} → {dst}")
+        return True
+
+    def materialized_base(self, snapshot_name):
+        """
+        Albero già materializzato più vicino a ``snapshot_name`` (nome, percorso)
 
-        # Crea directory backups se non esiste
-        self.backup_dir.mkdir(exist_ok=True)
+        Si preferisce il più recente tra quelli precedenti, altrimenti il
+        primo successivo; solo snapshot ancora presenti nello stato.
+        """
+        if not MATERIALIZE_DIR.is_dir():
+            return None
+        known = {s['name'] for s in self.state['snapshots']}
+        trees = sorted(p.name for p in MATERIALIZE_DIR.iterdir()
+                       if p.name in known and p.name != snapshot_name and p.is_dir())
+        if not trees:
+            return None
+        position = bisect.bisect_left(trees, snapshot_name)
+        name = trees[position - 1] if position else trees[0]
+        return name, MATERIALIZE_DIR / name
 
-        # Carica stato precedente
-        self.state = self.load_state()
+    def materialize_snapshot(self, snapshot_name, destination=None):
+        """
+        Crea un albero di file navigabile con lo stato completo di uno snapshot
 
-    def log(self, message):
-        """Scrivi nel log con timestamp"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_message = f"[{timestamp}] {message}\n"
+        Ogni file viene, nell'ordine: clonato con un reflink (btrfs/XFS,
+        nessun byte copiato), collegato con un hardlink allo stesso file
+        dell'albero materializzato più vicino se è invariato, copiato. Con
+        reflink o hardlink uno snapshot completo costa quasi zero in tempo
+        e spazio. I file sono in sola lettura: gli hardlink condividono il
+        contenuto con gli altri alberi.
+        """
+        destination = Path(destination) if destination else MATERIALIZE_DIR / snapshot_name
+        if destination.exists():
+            self.log(f"❌ La destinazione esiste già: {destination}")
+            return None
+        try:
+            view = self.open_snapshot(snapshot_name)
+        except OSError as e:
+            self.log(f"❌ Snapshot non trovato: {e.filename or e}")
+            return None
 
-        print(log_message.strip())
+        base = self.materialized_base(snapshot_name)
+        base_view = None
+        if base is not None:
+            try:
+                base_view = self.open_snapshot(base[0])
+            except (OSError, ValueError, sqlite3.Error):
+                base = None
 
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(log_message)
+        self.log(f"🪞 Materializzazione {snapshot_name} → {destination}")
+        if base is not None:
+            self.log(f"🔗 File invariati collegati a: {base[1]}")
 
-    def load_state(self):
-        """Carica lo stato precedente"""
-        if self.state_file.exists():
-            with open(self.state_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {
-            'snapshots': [],
-            'last_backup': None,
-            'total_backups': 0
-        }
+        # Albero costruito a parte e rinominato solo quando è completo
+        staging = destination.with_name(destination.name + STAGING_SUFFIX)
+        if staging.exists():
+            shutil.rmtree(staging)
+        staging.mkdir(parents=True)
 
-    def save_state(self):
-        """Salva lo stato corrente"""
-        with open(self.state_file, 'w', encoding='utf-8') as f:
-            json.dump(self.state, indent=2, fp=f)
+        with view:
+            metadata = view.header
+            snapshot_path = self.backup_dir / snapshot_name
+            archive = self.open_archives(snapshot_name) if metadata.get('storage') == 'archive' else None
+            comparable = base_view is not None and \
+                base_view.header.get('hash_algorithm', 'md5') == metadata.get('hash_algorithm', 'md5')
 
-    def get_file_hash(self, filepath):
-        """Calcola hash MD5 di un file"""
-        md5 = hashlib.md5()
-        try:
-            with open(filepath, 'rb') as f:
-                for chunk in iter(lambda: f.read(4096), b''):
-                    md5.update(chunk)
-            return md5.hexdigest()
-        except Exception:
+            # Ricerche nei manifest prima di usare i thread
+            plan = []
+            for rel_path, info in sorted(view.files().items()):
+                linked = None
+                if comparable:
+                    old = base_view.get(rel_path)
+                    if old is not None and all(old.get(k) == info.get(k) for k in ('hash', 'size', 'mode', 'modified')):
+                        linked = base[1] / rel_path
+                plan.append((rel_path, info, linked))
+            if base_view is not None:
+                base_view.close()
+
+        def materialize_one(entry):
+            rel_path, info, linked = entry
+            dst = staging / rel_path
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            method = None
+            if linked is not None:
+                try:
+                    if reflink_file(linked, dst):
+                        # Il clone ha un inode suo: permessi e date vanno riapplicati
+                        method = 'reflink'
+                        os.utime(dst, (info['modified'], info['modified']))
+                    else:
+                        os.link(linked, dst)
+                        return 'hardlink'
+                except OSError:
+                    method = None
+            if method is None:
+                sources = [] if archive else self.snapshot_file_sources(snapshot_path, metadata, rel_path, info)
+                method = self.restore_file(sources, dst, info, archive)
+            os.chmod(dst, info.get('mode', 0o644) & ~0o222)
+            return method
+
+        counts = {'reflink': 0, 'hardlink': 0, 'copy': 0}
+        failed = 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(materialize_one, entry) for entry in plan]
+            for (rel_path, _, _), future in zip(plan, futures):
+                try:
+                    counts[future.result()] += 1
+                except Exception as e:
+                    failed += 1
+                    self.log(f"⚠️ Errore materializzazione {rel_path}: {e}")
+
+        # Un albero incompleto non viene pubblicato
+        if failed:
+            shutil.rmtree(staging, ignore_errors=True)
+            self.log(f"❌ Materializzazione non riuscita: {failed}/{len(plan)} file con errori, "
+                     f"{destination} non creato")
             return None
 
-    def should_exclude(self, path):
-        """Verifica se un file/cartella deve essere escluso"""
-        path_str = str(path)
-        for pattern in EXCLUDE_PATTERNS:
-            if pattern.startswith('*'):
-                if path_str.endswith(pattern[1:]):
-                    return True
-            elif pattern in path_str:
-                return True
-        return False
+        os.rename(staging, destination)
+        copied = sum(info['size'] for _, info, _ in plan)
+        self.log(f"✅ File materializzati: {len(plan) - failed}/{len(plan)} "
+                 f"({counts['reflink']} reflink, {counts['hardlink']} hardlink, {counts['copy']} copie), "
+                 f"{format_rate(copied, time.perf_counter() - started)}")
+        self.log(f"📍 Albero: {destination}")
+        return destination
 
-    def scan_project(self):
-        """Scansiona il progetto e raccogli info sui file"""
-        files_info = {}
+    def replicate(self, destination, delete=False):
+        """
+        Replica gli snapshot in un'altra cartella (altro disco, volume montato)
 
-        for item in PROJECT_ROOT.rglob('*'):
-            if item.is_file() and not self.should_exclude(item):
-                rel_path = item.relative_to(PROJECT_ROOT)
-                files_info[str(rel_path)] = {
-                    'size': item.stat().st_size,
-                    'modified': item.stat().st_mtime,
-                    'hash': self.get_file_hash(item)
-                }
+        Vengono trasferiti solo i blob, i manifest e gli archivi che mancano
+        alla destinazione o sono cambiati. Un lock impedisce due repliche
+        contemporanee verso la stessa destinazione, quindi il comando si può
+        pianificare. Con ``delete`` la destinazione diventa una copia esatta;
+        altrimenti conserva anche gli snapshot già rimossi da prune.
+        """
+        root = Path(destination).resolve()
+        if root == self.backup_dir.resolve():
+            self.log("❌ La destinazione coincide con la cartella dei backup")
+            return False
+        root.mkdir(parents=True, exist_ok=True)
 
-        return files_info
+        with open(root / REPLICA_LOCK_FILE, 'a', encoding='utf-8') as lock:
+            if HAS_FCNTL:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.log(f"⏳ Un'altra replica verso {root} è in corso")
+                    return False
+            # Prune non cancella blob e snapshot mentre vengono copiati
+            with self.repo_lock.hold() as acquired:
+                if acquired:
+                    self.reload_state()
+                return self.replicate_to(root, delete)
 
-    def create_snapshot(self, description="Snapshot automatico"):
-        """Crea uno snapshot completo del progetto"""
+    def replicate_to(self, root, delete):
+        """
+        Esegue la replica (con il lock della destinazione già preso)
+
+        L'ordine mantiene la replica sempre coerente: prima i blob (con
+        l'hash verificato durante la copia, così un blob danneggiato qui
+        non viene propagato), poi un sync su disco, poi manifest e archivi
+        dei soli snapshot con tutti i blob presenti, infine lo stato. I blob
+        in copia sono elencati in un journal: dopo un'interruzione quelli
+        già arrivati vengono ricontrollati con l'hash invece di essere dati
+        per buoni.
+        """
         self.log("=" * 60)
-        self.log(f"🔒 SCATOLA NERA - Creazione Snapshot")
-        self.log(f"📝 Descrizione: {description}")
+        self.log(f"🛰️ REPLICA: {root}")
         self.log("=" * 60)
+        started = time.perf_counter()
+        target = BlobStore(root / OBJECTS_DIR.name)
 
-        # Crea cartella snapshot
-        snapshot_name = f"snapshot_{self.timestamp}"
-        snapshot_path = self.backup_dir / snapshot_name
-        snapshot_path.mkdir(exist_ok=True)
+        # Blob necessari a ogni snapshot (gli archivi non ne usano e restano chiusi)
+        snapshots = list(self.state['snapshots'])
+        needed = {}
+        for snapshot in snapshots:
+            name = snapshot['name']
+            if snapshot.get('storage') == 'archive':
+                needed[name] = set()
+                continue
+            try:
+                needed[name] = self.snapshot_refs(name)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                self.log(f"⚠️ {name} non leggibile, non replicato: {e}")
+        all_blobs = set().union(*needed.values())
 
-        # Scansiona progetto
-        self.log("📊 Scansione progetto in corso...")
-        files_info = self.scan_project()
-        total_size = sum(f['size'] for f in files_info.values())
+        # Blob già nella destinazione; le copie lasciate a metà vengono scartate
+        present = set()
+        if target.root.is_dir():
+            for prefix in os.scandir(target.root):
+                if prefix.is_dir() and prefix.name != 'tmp':
+                    present.update(prefix.name + entry.name for entry in os.scandir(prefix.path))
+        if target.tmp_dir.is_dir():
+            shutil.rmtree(target.tmp_dir)
 
-        self.log(f"📁 File trovati: {len(files_info)}")
-        self.log(f"💾 Dimensione totale: {total_size / 1024 / 1024:.2f} MB")
+        journal_path = root / REPLICA_JOURNAL_FILE
+        if journal_path.exists():
+            pending = [d for d in journal_path.read_text(encoding='utf-8').split() if d in present]
 
-        # Copia tutti i file
-        self.log("💾 Backup file in corso...")
-        copied_count = 0
+            def intact(digest):
+                try:
+                    return hash_file(target.path_for(digest)) == digest
+                except OSError:
+                    return False
 
-        for rel_path, info in files_info.items():
-            src = PROJECT_ROOT / rel_path
-            dst = snapshot_path / rel_path
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(intact, pending))
+            damaged = [digest for digest, ok in zip(pending, results) if not ok]
+            for digest in damaged:
+                target.path_for(digest).unlink(missing_ok=True)
+                present.discard(digest)
+            self.log(f"♻️ Ripresa di una replica interrotta: {len(pending)} blob ricontrollati, "
+                     f"{len(damaged)} da ricopiare")
 
-            # Crea directory se necessario
-            dst.parent.mkdir(parents=True, exist_ok=True)
+        # Journal dei blob da copiare, su disco prima di iniziare
+        missing = sorted(all_blobs - present)
+        with open(journal_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(missing))
+            f.flush()
+            os.fsync(f.fileno())
+
+        failed = set()
+        copied_bytes = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.store.copy_to, digest, target) for digest in missing]
+            for digest, future in zip(missing, futures):
+                try:
+                    copied_bytes += future.result()
+                except (OSError, ValueError) as e:
+                    failed.add(digest)
+                    self.log(f"⚠️ Blob {digest[:16]}… non replicato: {e}")
+        self.log(f"📤 Blob copiati: {len(missing) - len(failed)} ({copied_bytes / 1024 / 1024:.2f} MB), "
+                 f"già presenti: {len(all_blobs) - len(missing)}")
+        if hasattr(os, 'sync'):
+            os.sync()
 
-            # Copia file
+        # Manifest e archivi, solo se tutti i blob dello snapshot sono arrivati
+        published = []
+        copied_files = 0
+        for snapshot in snapshots:
+            name = snapshot['name']
+            if name not in needed:
+                continue
+            if needed[name] & failed:
+                self.log(f"⚠️ {name} non replicato: blob mancanti")
+                continue
+            source = self.archive_path(name) if snapshot.get('storage') == 'archive' else self.backup_dir / name
             try:
-                shutil.copy2(src, dst)
-                copied_count += 1
-            except Exception as e:
-                self.log(f"⚠️ Errore copia {rel_path}: {e}")
-
-        self.log(f"✅ File copiati: {copied_count}/{len(files_info)}")
-
-        # Salva metadata
-        metadata = {
-            'timestamp': self.timestamp,
-            'datetime': datetime.now().isoformat(),
-            'description': description,
-            'files_count': len(files_info),
-            'total_size': total_size,
-            'files': files_info
-        }
+                copied, size = self.replicate_path(source, root / source.name)
+            except OSError as e:
+                self.log(f"⚠️ {name} non replicato: {e}")
+                continue
+            copied_files += copied
+            copied_bytes += size
+            published.append(snapshot)
+        if hasattr(os, 'sync'):
+            os.sync()
 
-        metadata_file = snapshot_path / 'metadata.json'
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, indent=2, fp=f)
+        # Stato della replica: gli snapshot replicati, più (senza --delete) quelli che
+        # la destinazione ha già e qui non ci sono più o non sono stati replicati
+        state_path = root / STATE_FILE.name
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                previous = json.load(f)['snapshots']
+        except (OSError, ValueError, KeyError):
+            previous = []
+        names = {s['name'] for s in published}
+        local = {s['name'] for s in snapshots}
+        kept = [s for s in previous if s['name'] not in names and (not delete or s['name'] in local)
+                and ((root / s['name']).exists() or (root / f"{s['name']}{ARCHIVE_SUFFIX}").exists())]
+        state = dict(self.state, snapshots=sorted(published + kept, key=lambda s: s['name']))
+        tmp_path = state_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, state_path)
 
-        # Aggiorna stato
-        self.state['snapshots'].append({
-            'name': snapshot_name,
-            'timestamp': self.timestamp,
-            'datetime': metadata['datetime'],
-            'description': description,
-            'files_count': len(files_info),
-            'size': total_size
-        })
-        self.state['last_backup'] = metadata['datetime']
-        self.state['total_backups'] += 1
+        # Con --delete: via snapshot e blob che nessuno snapshot della replica usa più
+        removed = 0
+        if delete:
+            keep = {s['name'] for s in state['snapshots']}
+            for path in root.iterdir():
+                name = path.name.removesuffix(ARCHIVE_SUFFIX)
+                if name.startswith('snapshot_') and name not in keep:
+                    if path.is_dir():
+                        shutil.rmtree(path)
+                    else:
+                        path.unlink()
+                    removed += 1
+            if all(s['name'] in names for s in state['snapshots']):
+                for digest in present - all_blobs:
+                    target.path_for(digest).unlink(missing_ok=True)
+                    removed += 1
+        journal_path.unlink()
 
-        self.save_state()
+        elapsed = time.perf_counter() - started
+        self.log(f"📄 Manifest e archivi copiati: {copied_files}")
+        if delete:
+            self.log(f"🗑️ Elementi rimossi dalla replica: {removed}")
+        self.log(f"✅ Replica completata: {len(published)}/{len(snapshots)} snapshot, "
+                 f"{format_rate(copied_bytes, elapsed)}")
+        return not failed and len(published) == len(snapshots)
 
-        self.log("=" * 60)
-        self.log(f"✅ SNAPSHOT COMPLETATO: {snapshot_name}")
-        self.log(f"📍 Percorso: {snapshot_path}")
-        self.log("=" * 60)
+    def replicate_path(self, source, destination):
+        """
+        Copia un file o una cartella se mancano o sono cambiati (dimensione, mtime)
 
-        return snapshot_path
+        Restituisce (file copiati, byte copiati). Nelle cartelle i file che
+        la sorgente non ha più vengono rimossi.
+        """
+        if source.is_dir():
+            destination.mkdir(exist_ok=True)
+            copied = size = 0
+            names = set()
+            for entry in os.scandir(source):
+                names.add(entry.name)
+                entry_copied, entry_size = self.replicate_path(Path(entry.path), destination / entry.name)
+                copied += entry_copied
+                size += entry_size
+            for entry in os.scandir(destination):
+                if entry.name not in names:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+            return copied, size
 
-    def list_snapshots(self):
-        """Elenca tutti gli snapshot disponibili"""
-        self.log("=" * 60)
-        self.log("📦 SNAPSHOT DISPONIBILI")
-        self.log("=" * 60)
+        st = source.stat()
+        try:
+            current = destination.stat()
+            if (current.st_size, current.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                return 0, 0
+        except FileNotFoundError:
+            pass
+        tmp_path = destination.with_name(destination.name + '.tmp')
+        copy_file_fast(source, tmp_path)
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, destination)
+        return 1, st.st_size
 
-        if not self.state['snapshots']:
-            self.log("⚠️ Nessuno snapshot trovato")
-            return
+    def sync_history(self):
+        """
+        Aggiunge all'indice delle versioni gli snapshot non ancora indicizzati
 
-        for i, snapshot in enumerate(self.state['snapshots'], 1):
-            self.log(f"\n{i}. {snapshot['name']}")
-            self.log(f"   📅 Data: {snapshot['datetime']}")
-            self.log(f"   📝 Descrizione: {snapshot['description']}")
-            self.log(f"   📁 File: {snapshot['files_count']}")
-            self.log(f"   💾 Dimensione: {snapshot['size'] / 1024 / 1024:.2f} MB")
+        Di norma legge solo il manifest dello snapshot appena creato. Se uno
+        snapshot indicizzato ha cambiato algoritmo di hash (migrate) o ne
+        compare uno più vecchio dell'ultimo indicizzato, l'indice viene
+        ricostruito da zero.
+        """
+        snapshots = sorted(self.state['snapshots'], key=lambda s: s['name'])
 
-        self.log("\n" + "=" * 60)
+        # Gli stati creati dalle versioni precedenti non registrano l'algoritmo di hash
+        backfilled = False
+        for snapshot in snapshots:
+            if 'hash_algorithm' not in snapshot:
+                try:
+                    with self.open_manifest(snapshot['name']) as manifest:
+                        snapshot['hash_algorithm'] = manifest.header.get('hash_algorithm', 'md5')
+                    backfilled = True
+                except (OSError, ValueError, sqlite3.Error):
+                    pass
+        if backfilled:
+            self.save_state()
 
-    def restore_snapshot(self, snapshot_name):
-        """Ripristina un snapshot"""
-        snapshot_path = self.backup_dir / snapshot_name
+        with FileHistory(HISTORY_FILE) as history:
+            indexed = history.indexed()
+            algorithms = {s['name']: s.get('hash_algorithm') for s in snapshots}
+            pending = [s['name'] for s in snapshots if s['name'] not in indexed]
+            if any(name in algorithms and algorithms[name] != algorithm for name, algorithm in indexed.items()) \
+                    or (pending and indexed and pending[0] < max(indexed)):
+                self.log("📜 Ricostruzione dell'indice delle versioni")
+                history.reset()
+                pending = [s['name'] for s in snapshots]
 
-        if not snapshot_path.exists():
-            self.log(f"❌ Snapshot non trovato: {snapshot_name}")
-            return False
+            for name in pending:
+                try:
+                    with self.open_manifest(name) as manifest:
+                        history.add(name, manifest)
+                except (OSError, ValueError) as e:
+                    # Gli snapshot vanno indicizzati in ordine: si riprova al prossimo aggiornamento
+                    self.log(f"⚠️ Indice delle versioni fermo a prima di {name}: {e}")
+                    break
+
+    def file_versions(self, rel_path):
+        """
+        Versioni di un file ancora presenti negli snapshot, dalla più recente
+
+        Restituisce [{'hash', 'size', 'snapshots'}] (hash None = file
+        eliminato): ogni versione vale dallo snapshot in cui compare fino
+        alla successiva, quindi basta una ricerca nell'indice.
+        """
+        self.sync_history()
+        names = sorted(s['name'] for s in self.state['snapshots'])
+        with FileHistory(HISTORY_FILE) as history:
+            rows = history.versions(rel_path)
+
+        versions = []
+        for i, (start, digest, size) in enumerate(rows):
+            lo = bisect.bisect_left(names, start)
+            hi = bisect.bisect_left(names, rows[i + 1][0]) if i + 1 < len(rows) else len(names)
+            if lo < hi:
+                versions.append({'hash': digest, 'size': size, 'snapshots': names[lo:hi]})
+        versions.reverse()
+        return versions
 
+    def show_history(self, rel_path):
+        """Elenca le versioni di un file negli snapshot (numerate per restore --version)"""
         self.log("=" * 60)
-        self.log(f"🔄 RIPRISTINO SNAPSHOT: {snapshot_name}")
+        self.log(f"📜 STORIA: {rel_path}")
         self.log("=" * 60)
-        self.log("⚠️ ATTENZIONE: Questo sovrascriverà i file correnti!")
 
-        # Carica metadata
-        metadata_file = snapshot_path / 'metadata.json'
-        with open(metadata_file, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
+        versions = self.file_versions(rel_path)
+        if not versions:
+            self.log(f"❌ {rel_path} non è presente in nessuno snapshot")
+            return False
 
-        self.log(f"📅 Data snapshot: {metadata['datetime']}")
-        self.log(f"📁 File da ripristinare: {metadata['files_count']}")
+        number = 0
+        for version in versions:
+            first, last = version['snapshots'][0], version['snapshots'][-1]
+            span = first if first == last else f"{first} → {last}"
+            if version['hash'] is None:
+                self.log(f"   🗑️ eliminato: {span}")
+                continue
+            number += 1
+            self.log(f"   #{number} {version['hash'][:12]} {format_size(version['size'])}: {span} "
+                     f"({len(version['snapshots'])} snapshot)")
 
-        # Conferma (in modalità interattiva)
-        if sys.stdin.isatty():
-            response = input("\n⚠️ Vuoi procedere? (si/no): ")
-            if response.lower() not in ['si', 'yes', 'y', 's']:
-                self.log("❌ Ripristino annullato")
+        self.log(f"📜 Versioni: {number} (ripristino: restore {rel_path} --version=N)")
+        return True
+
+    def restore_version(self, rel_path, version, dry_run=False):
+        """Ripristina una versione di un file (numero di ``history`` o prefisso dell'hash)"""
+        versions = [v for v in self.file_versions(rel_path) if v['hash'] is not None]
+        if version.isdigit() and 1 <= int(version) <= len(versions):
+            chosen = versions[int(version) - 1]
+        else:
+            matches = [v for v in versions if v['hash'].startswith(version)]
+            if len({v['hash'] for v in matches}) != 1:
+                self.log(f"❌ Versione {version} di {rel_path} non trovata o ambigua (vedi: history {rel_path})")
                 return False
+            chosen = matches[0]
 
-        # Ripristina file
-        self.log("🔄 Ripristino in corso...")
-        restored_count = 0
+        snapshot_name = chosen['snapshots'][-1]
+        self.log(f"📜 {rel_path}: versione {chosen['hash'][:12]} dallo snapshot {snapshot_name}")
+        # Percorso esatto: ancorato alla radice, con i caratteri dei glob protetti
+        pattern = '/' + re.sub(r'([*?\[\\])', r'\\\1', rel_path)
+        return self.restore_snapshot(snapshot_name, [pattern], dry_run=dry_run)
 
-        for rel_path in metadata['files'].keys():
-            src = snapshot_path / rel_path
-            dst = PROJECT_ROOT / rel_path
+    def migrate_snapshots(self):
+        """
+        Converte gli snapshot legacy (copie complete) nel blob store
 
-            if src.exists():
-                # Crea directory se necessario
-                dst.parent.mkdir(parents=True, exist_ok=True)
+        I manifest JSON degli snapshot già nel blob store (formato 2) vengono
+        riscritti nel formato indicizzato; lo stato viene aggiornato con
+        archiviazione e algoritmo di hash di ogni snapshot. Le copie in
+        chiaro degli indici di archivi cifrati, salvate dalle versioni
+        precedenti, vengono cancellate.
+        """
+        with self.repo_lock.hold(exclusive=True) as acquired:
+            if acquired:
+                self.reload_state()
+            migrated = 0
+            converted = 0
+            for snapshot in self.state['snapshots']:
+                index_path = self.archive_index_path(snapshot['name'])
+                if snapshot.get('encryption') and index_path.exists():
+                    index_path.unlink()
+                    self.log(f"🔐 Rimossa la copia in chiaro dell'indice di {snapshot['name']}")
+                snapshot_path = self.backup_dir / snapshot['name']
+                metadata_file = snapshot_path / LEGACY_MANIFEST_FILE
+                if not metadata_file.exists():
+                    continue
+
+                with open(metadata_file, 'r', encoding='utf-8') as f:
+                    metadata = json.load(f)
+                if metadata.get('storage') == 'objects':
+                    metadata['format'] = SNAPSHOT_FORMAT
+                    self.write_metadata(snapshot_path, metadata)
+                    snapshot['storage'] = 'objects'
+                    snapshot['hash_algorithm'] = metadata.get('hash_algorithm', 'md5')
+                    converted += 1
+                    continue
+
+                self.log(f"📦 Migrazione {snapshot['name']}...")
+                for rel_path, info in list(metadata['files'].items()):
+                    src = snapshot_path / rel_path
+                    if not src.exists():
+                        self.log(f"⚠️ File mancante nello snapshot: {rel_path}")
+                        del metadata['files'][rel_path]
+                        continue
+                    info['hash'] = self.store.put_file(src)
+
+                metadata['format'] = SNAPSHOT_FORMAT
+                metadata['storage'] = 'objects'
+                metadata['hash_algorithm'] = HASH_ALGORITHM
+                metadata['files_count'] = len(metadata['files'])
+                self.write_metadata(snapshot_path, metadata)
+                snapshot['storage'] = 'objects'
+                snapshot['hash_algorithm'] = HASH_ALGORITHM
+
+                # Rimuovi le copie complete, ora sostituite dai blob
+                for item in snapshot_path.iterdir():
+                    if item.name == MANIFEST_FILE:
+                        continue
+                    if item.is_dir():
+                        shutil.rmtree(item)
+                    else:
+                        item.unlink()
+                migrated += 1
+
+            if migrated or converted:
+                self.save_state()
+            self.log(f"✅ Snapshot migrati: {migrated}, manifest convertiti nel formato indicizzato: {converted}")
+            return migrated
+
+    def retention_keep(self, keep_last, keep_daily, keep_weekly):
+        """Nomi degli snapshot da conservare secondo la politica di retention"""
+        snapshots = sorted(self.state['snapshots'], key=lambda s: s['datetime'], reverse=True)
+        keep = {s['name'] for s in snapshots[:max(1, keep_last)]}
+
+        today = datetime.now().date()
+        days = set()
+        weeks = set()
+        for snapshot in snapshots:
+            day = datetime.fromisoformat(snapshot['datetime']).date()
+            age = (today - day).days
+            if age < keep_daily and day not in days:
+                days.add(day)
+                keep.add(snapshot['name'])
+            week = day.isocalendar()[:2]
+            if age < keep_weekly * 7 and week not in weeks:
+                weeks.add(week)
+                keep.add(snapshot['name'])
+        return keep
+
+    def snapshot_manifests(self):
+        """Manifest presenti su disco: {nome: impronta [mtime_ns, dimensione]}"""
+        manifests = {}
+        with os.scandir(self.backup_dir) as it:
+            for entry in it:
+                if not entry.name.startswith('snapshot_') or entry.name.endswith(STAGING_SUFFIX) \
+                        or not entry.is_dir():
+                    continue
+                for manifest_file in (MANIFEST_FILE, LEGACY_MANIFEST_FILE):
+                    try:
+                        st = os.stat(os.path.join(entry.path, manifest_file))
+                    except OSError:
+                        continue
+                    manifests[entry.name] = [st.st_mtime_ns, st.st_size]
+                    break
+        return manifests
+
+    def snapshot_refs(self, snapshot_name):
+        """Blob referenziati dal manifest di uno snapshot"""
+        with self.open_manifest(snapshot_name) as manifest:
+            return manifest.refs()
+
+    def sync_refcounts(self, save=True):
+        """
+        Allinea i contatori ai manifest su disco
+
+        Di norma conta solo i manifest nuovi (quelli scritti dai backup
+        dall'ultima GC); se un manifest contato è cambiato o sparito senza
+        essere rilasciato, ricostruisce tutto da zero. Con ``save`` False
+        (verify, con il lock condiviso) refcounts.json non viene riscritto.
+        """
+        refs = BlobRefCounts(REFCOUNT_FILE)
+        manifests = self.snapshot_manifests()
+        if any(manifests.get(name) != fingerprint for name, fingerprint in refs.snapshots.items()):
+            self.log("🧮 Manifest modificati dall'ultima GC: ricostruzione dei contatori")
+            refs.reset()
+        for name, fingerprint in manifests.items():
+            if name not in refs.snapshots:
+                refs.add(name, fingerprint, self.snapshot_refs(name))
+        if save:
+            refs.save()
+        return refs
+
+    def delete_snapshot_files(self, snapshot_name, refs):
+        """Rilascia i blob di uno snapshot e ne cancella manifest o archivio"""
+        snapshot_path = self.backup_dir / snapshot_name
+        if snapshot_name in refs.snapshots:
+            # Prima i contatori: se ci si interrompe qui il manifest resta orfano e verrà
+            # cancellato alla prossima GC senza essere rilasciato due volte
+            refs.release(snapshot_name, self.snapshot_refs(snapshot_name))
+            refs.save()
+        if snapshot_path.exists():
+            shutil.rmtree(snapshot_path)
+        self.archive_path(snapshot_name).unlink(missing_ok=True)
+        self.archive_index_path(snapshot_name).unlink(missing_ok=True)
+
+    def prune_snapshots(self, keep_last=RETENTION_KEEP_LAST, keep_daily=RETENTION_KEEP_DAILY,
+                        keep_weekly=RETENTION_KEEP_WEEKLY, dry_run=False, full=False):
+        """
+        Applica la retention e recupera lo spazio dei blob non più referenziati
+
+        Gli snapshot conservati che dipendono da un genitore in scadenza
+        vengono prima compattati (solo manifest). Ogni passo lascia lo stato
+        coerente: un'interruzione si recupera rieseguendo prune.
+        """
+        with self.repo_lock.hold(exclusive=True) as acquired:
+            if acquired:
+                self.reload_state()
+            self.log("=" * 60)
+            self.log(f"🧹 PRUNE: ultimi {keep_last}, giornalieri {keep_daily}, settimanali {keep_weekly}")
+            self.log("=" * 60)
+
+            keep = self.retention_keep(keep_last, keep_daily, keep_weekly)
+            # Un archivio incrementale legge i file invariati dagli archivi dei genitori:
+            # la sua catena (al massimo MAX_CHAIN_LENGTH archivi) resta finché serve
+            parents = {s['name']: s.get('parent') for s in self.state['snapshots'] if s.get('storage') == 'archive'}
+            for name in list(keep):
+                while parents.get(name):
+                    name = parents[name]
+                    keep.add(name)
+            expired = [s['name'] for s in self.state['snapshots'] if s['name'] not in keep]
+            known = {s['name'] for s in self.state['snapshots']}
+            orphans = sorted(
+                name for name in (p.name.removesuffix(ARCHIVE_SUFFIX) for p in self.backup_dir.iterdir())
+                if name.startswith('snapshot_') and not name.endswith('.tmp') and name not in known
+            )
+            to_compact = [s['name'] for s in self.state['snapshots']
+                          if s['name'] in keep and s.get('parent') and s['parent'] not in keep]
 
+            self.log(f"📦 Conservati: {len(keep)}, in scadenza: {len(expired)}, orfani: {len(orphans)}")
+            for name in expired + orphans:
+                self.log(f"   🗑️ {name}")
+            for name in to_compact:
+                self.log(f"   🔗 {name} (genitore in scadenza, verrà compattato)")
+            if dry_run:
+                self.log("🔍 Dry-run: nessuno snapshot rimosso")
+                return expired + orphans
+
+            refs = self.sync_refcounts()
+
+            # 1. Gli snapshot conservati non devono più dipendere da quelli in scadenza
+            for name in to_compact:
+                released = self.snapshot_refs(name)
+                self.compact_snapshot(name)
+                refs.release(name, released)
+                refs.add(name, self.snapshot_manifests()[name], self.snapshot_refs(name))
+                refs.save()
+
+            # 2. Lo stato smette di elencarli (da qui in poi sono orfani)
+            if expired:
+                self.state['snapshots'] = [s for s in self.state['snapshots'] if s['name'] in keep]
+                self.save_state()
+
+            # 3. Rilascio dei blob e cancellazione dei manifest
+            for name in expired + orphans:
+                self.delete_snapshot_files(name, refs)
+
+            # 4. Cancellazione dei blob senza riferimenti
+            garbage = refs.garbage()
+            if full:
+                garbage += self.unreferenced_blobs(refs)
+            freed = 0
+            for digest in garbage:
+                path = self.store.path_for(digest)
                 try:
-                    shutil.copy2(src, dst)
-                    restored_count += 1
-                except Exception as e:
-                    self.log(f"⚠️ Errore ripristino {rel_path}: {e}")
+                    freed += path.stat().st_size
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            refs.forget(garbage)
+            refs.save()
+
+            self.log(f"✅ Snapshot rimossi: {len(expired) + len(orphans)}, blob cancellati: {len(garbage)}, "
+                     f"spazio recuperato: {freed / 1024 / 1024:.2f} MB")
+            return expired + orphans
+
+    def unreferenced_blobs(self, refs):
+        """
+        Blob nello store che nessun manifest conta (es. da un backup interrotto)
+
+        I file più recenti di ORPHAN_GRACE_SECONDS vengono lasciati stare,
+        perché potrebbero appartenere a un backup in corso.
+        """
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        orphans = []
+        for prefix in os.scandir(self.store.root):
+            if not prefix.is_dir():
+                continue
+            if prefix.name == 'tmp':
+                for entry in os.scandir(prefix.path):
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                continue
+            for entry in os.scandir(prefix.path):
+                digest = prefix.name + entry.name
+                if refs.counts.get(digest, 0) <= 0 and entry.stat().st_mtime < cutoff:
+                    orphans.append(digest)
+        return orphans
+
+    def scrub_items(self, snapshot_name=None):
+        """
+        Contenuti da verificare, ordinati per chiave: [(chiave, tipo, dati)]
+
+        Senza ``snapshot_name`` sono tutti i blob referenziati (dai contatori
+        della GC), i membri degli archivi e le copie degli snapshot legacy;
+        con un nome, solo i contenuti di quello snapshot.
+        """
+        items = {}
+
+        def add_snapshot(name, metadata, files):
+            storage = metadata.get('storage')
+            algorithm = metadata.get('hash_algorithm', 'md5')
+            # Un solo reader per archivio: l'indice si legge una volta, non per ogni membro
+            archives = self.open_archives(name) if storage == 'archive' else None
+            for rel_path, info in files:
+                if storage == 'archive':
+                    items[f"archive:{info.get('archive', name)}:{rel_path}"] = ('archive', (archives, info))
+                elif 'chunks' in info:
+                    for digest, _ in info['chunks']:
+                        items[f"blob:{digest}"] = ('blob', digest)
+                elif storage == 'objects':
+                    items[f"blob:{info['hash']}"] = ('blob', info['hash'])
+                else:
+                    items[f"legacy:{name}:{rel_path}"] = ('legacy', (name, rel_path, info, algorithm))
+
+        if snapshot_name:
+            metadata, files, _ = self.resolve_snapshot(snapshot_name)
+            add_snapshot(snapshot_name, metadata, files.items())
+        else:
+            refs = self.sync_refcounts(save=False)
+            for digest, count in refs.counts.items():
+                if count > 0:
+                    items[f"blob:{digest}"] = ('blob', digest)
+            for snapshot in self.state['snapshots']:
+                name = snapshot['name']
+                if snapshot.get('storage') == 'archive' or self.has_legacy_copies(name):
+                    with self.open_manifest(name) as manifest:
+                        add_snapshot(name, manifest.header, manifest.files())
+
+        return [(key, *items[key]) for key in sorted(items)]
 
-        self.log(f"✅ File ripristinati: {restored_count}/{metadata['files_count']}")
+    def has_legacy_copies(self, snapshot_name):
+        """True se la cartella dello snapshot contiene copie dei file (formato legacy)"""
+        try:
+            with os.scandir(self.backup_dir / snapshot_name) as it:
+                manifest_files = {MANIFEST_FILE, MANIFEST_FILE + '.tmp', LEGACY_MANIFEST_FILE, JOURNAL_FILE}
+                return any(entry.name not in manifest_files for entry in it)
+        except OSError:
+            return False
+
+    def check_item(self, item):
+        """Verifica un contenuto: ('ok' | 'missing' | 'corrupt', byte letti)"""
+        _, kind, data = item
+        try:
+            if kind == 'blob':
+                path = self.store.path_for(data)
+                ok = hash_file(path) == data
+                size = path.stat().st_size
+            elif kind == 'archive':
+                reader, info = data
+                ok = reader.read_member(info)
+                size = info['size']
+            else:
+                name, rel_path, info, algorithm = data
+                ok = hash_file(self.backup_dir / name / rel_path, algorithm) == info['hash']
+                size = info['size']
+        except FileNotFoundError:
+            return 'missing', 0
+        except (OSError, ValueError, zlib.error):
+            return 'corrupt', 0
+        return ('ok' if ok else 'corrupt'), size
+
+    def verify_snapshots(self, snapshot_name=None, fraction=1.0):
+        """
+        Verifica l'integrità dei contenuti salvati ricalcolandone gli hash
+
+        Senza nome verifica l'intero archivio a rate: ogni esecuzione
+        controlla ``fraction`` dei contenuti a partire dal cursore salvato
+        in scrub-state.json, così uno store grande si verifica tutto in
+        più giri senza picchi di I/O. I blob corrotti vengono spostati in
+        backups/quarantine/, così il backup successivo li riscrive se il
+        file è ancora nel progetto.
+
+        La verifica tiene il lock della cartella dei backup condiviso
+        (prune e backup non cambiano lo store mentre si legge); quarantena
+        e riparazione lo prendono esclusivo e ricontrollano prima ogni blob.
+        """
         self.log("=" * 60)
-        self.log("✅ RIPRISTINO COMPLETATO")
+        self.log(f"🔬 VERIFICA INTEGRITÀ: {snapshot_name or 'tutti gli snapshot'}")
         self.log("=" * 60)
 
+        with self.repo_lock.hold() as acquired:
+            if acquired:
+                self.reload_state()
+            if snapshot_name and snapshot_name not in {s['name'] for s in self.state['snapshots']} \
+                    and not self.archive_path(snapshot_name).exists():
+                self.log(f"❌ Snapshot non trovato: {snapshot_name}")
+                return False
+
+            items = self.scrub_items(snapshot_name)
+            if not items:
+                self.log("⚠️ Nessun contenuto da verificare")
+                return True
+
+            scrub = {'cursor': '', 'passes': 0, 'last_pass': None}
+            if not snapshot_name:
+                try:
+                    with open(SCRUB_STATE_FILE, 'r', encoding='utf-8') as f:
+                        scrub.update(json.load(f))
+                except (OSError, ValueError):
+                    pass
+
+            # Selezione: dal cursore in avanti, ripartendo dall'inizio a fine giro
+            keys = [item[0] for item in items]
+            start = bisect.bisect_right(keys, scrub['cursor']) % len(items) if scrub['cursor'] else 0
+            count = len(items)
+            if not snapshot_name and fraction < 1:
+                count = max(1, math.ceil(len(items) * fraction))
+            selected = [items[(start + i) % len(items)] for i in range(count)]
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(self.check_item, selected))
+            elapsed = time.perf_counter() - started
+
+            problems = [(item, status) for item, (status, _) in zip(selected, results) if status != 'ok']
+            checked_bytes = sum(size for _, size in results)
+
+        repaired = 0
+        if any(item[1] == 'blob' for item, _ in problems):
+            problems, repaired = self.handle_blob_problems(problems)
+        for (key, kind, data), status in problems:
+            if kind != 'blob':
+                label = '❌ Corrotto' if status == 'corrupt' else '❌ Mancante'
+                self.log(f"{label}: {key.split(':', 1)[1]}")
+
+        corrupt = sum(1 for _, status in problems if status == 'corrupt')
+        missing = len(problems) - corrupt
+        self.log(f"🔬 Verificati {len(selected)}/{len(items)} contenuti, {format_rate(checked_bytes, elapsed)}")
+
+        if not snapshot_name:
+            if start + count >= len(items):
+                scrub['passes'] += 1
+                scrub['last_pass'] = datetime.now().isoformat()
+            scrub['cursor'] = '' if selected[-1][0] == keys[-1] else selected[-1][0]
+            tmp_file = SCRUB_STATE_FILE.with_suffix(f'.json.{os.getpid()}.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(scrub, f, indent=2)
+            os.replace(tmp_file, SCRUB_STATE_FILE)
+            position = bisect.bisect_right(keys, scrub['cursor']) if scrub['cursor'] else 0
+            self.log(f"🔁 Giro corrente: {position / len(items) * 100:.0f}% "
+                     f"(giri completi: {scrub['passes']}, ultimo: {scrub['last_pass'] or 'mai'})")
+
+        if problems:
+            self.log(f"❌ Problemi trovati: {corrupt} corrotti, {missing} mancanti, {repaired} riparati")
+            return False
+        self.log("✅ Nessun problema trovato")
         return True
 
-    def create_incremental_backup(self):
-        """Crea backup incrementale (solo file modificati)"""
-        self.log("🔄 Backup incrementale in corso...")
+    def handle_blob_problems(self, problems):
+        """
+        Quarantena e riparazione dei blob corrotti o mancanti, con il lock esclusivo
 
-        if not self.state['snapshots']:
-            self.log("⚠️ Nessuno snapshot precedente, creo snapshot completo")
-            return self.create_snapshot("Primo snapshot")
+        Tra la verifica e il lock esclusivo un prune può aver cancellato un
+        blob non più usato, o un backup averlo riscritto: ogni blob viene
+        ricontrollato e segnalato solo se è ancora danneggiato e in uso.
+        Restituisce (problemi confermati, blob riparati).
+        """
+        with self.repo_lock.hold(exclusive=True) as acquired:
+            if acquired:
+                self.reload_state()
+            blobs = {item[2] for item, _ in problems if item[1] == 'blob'}
+            owners = self.blob_owners(blobs)
+            confirmed = []
+            repaired = 0
+            for item, status in problems:
+                _, kind, data = item
+                if kind != 'blob':
+                    confirmed.append((item, status))
+                    continue
+                status = self.check_item(item)[0]
+                used_by = owners.get(data, [])
+                if status == 'ok' or (status == 'missing' and not used_by):
+                    continue
+                confirmed.append((item, status))
+                label = '❌ Corrotto' if status == 'corrupt' else '❌ Mancante'
+                where = ', '.join(f"{name}:{path}" for name, path, _ in used_by[:3])
+                more = f" (+{len(used_by) - 3})" if len(used_by) > 3 else ''
+                self.log(f"{label}: blob {data[:16]}… usato da {where or 'nessuno snapshot'}{more}")
+                if status == 'corrupt':
+                    QUARANTINE_DIR.mkdir(parents=True, exist_ok=True)
+                    os.replace(self.store.path_for(data), QUARANTINE_DIR / data)
+                if self.repair_blob(data, used_by):
+                    repaired += 1
+                    self.log(f"🩹 Blob {data[:16]}… ricostruito dal file attuale del progetto")
+        return confirmed, repaired
+
+    def repair_blob(self, digest, used_by):
+        """Riscrive un blob danneggiato se un file del progetto ha ancora quel contenuto"""
+        for _, rel_path, info in used_by:
+            src = PROJECT_ROOT / rel_path
+            if self.get_file_hash(src) != info['hash']:
+                continue
+            try:
+                if 'chunks' in info:
+                    # Il chunking è deterministico: rielaborare il file riproduce gli stessi chunk
+                    self.store.put_chunked(src)
+                else:
+                    self.store.put_file(src)
+            except OSError:
+                continue
+            if self.store.has(digest):
+                return True
+        return False
+
+    def blob_owners(self, digests):
+        """Per ogni blob, gli (snapshot, percorso, info) che lo usano"""
+        owners = {}
+        if not digests:
+            return owners
+        for name in self.snapshot_manifests():
+            with self.open_manifest(name) as manifest:
+                for rel_path, info in manifest.files():
+                    refs = [d for d, _ in info['chunks']] if 'chunks' in info else [info.get('hash')]
+                    for digest in refs:
+                        if digest in digests:
+                            owners.setdefault(digest, []).append((name, rel_path, info))
+        return owners
+
+    def create_incremental_backup(self, dirty=None):
+        """
+        Crea backup incrementale (solo file modificati)
+
+        Con ``dirty`` = (file, cartelle) vengono esaminati solo quei percorsi
+        (modalità watch) invece di scansionare tutto il progetto: l'ultimo
+        snapshot viene consultato con ricerche nell'indice dei manifest,
+        senza ricostruirne lo stato completo.
+        """
+        with self.repo_lock.hold(exclusive=True) as acquired:
+            if acquired:
+                self.reload_state()
+            self.log("🔄 Backup incrementale in corso...")
+
+            if not self.state['snapshots']:
+                self.log("⚠️ Nessuno snapshot precedente, creo snapshot completo")
+                return self.create_snapshot("Primo snapshot")
+
+            last_snapshot = self.state['snapshots'][-1]
+            if last_snapshot.get('storage') == 'archive' and not self.archive_mode():
+                # Il blob store non ha i contenuti dell'archivio: non serve leggerne l'indice
+                # (né la passphrase, con --encrypt=off)
+                self.log("⚠️ Ultimo snapshot in un archivio, creo snapshot completo nel blob store")
+                return self.create_snapshot("Backup completo dopo un archivio")
 
-        # Carica ultimo snapshot
-        last_snapshot = self.state['snapshots'][-1]
-        last_snapshot_path = self.backup_dir / last_snapshot['name']
-        last_metadata_file = last_snapshot_path / 'metadata.json'
+            with self.open_snapshot(last_snapshot['name']) as last:
+                return self.backup_changes(last_snapshot['name'], last, dirty)
 
-        with open(last_metadata_file, 'r', encoding='utf-8') as f:
-            last_metadata = json.load(f)
+    def backup_changes(self, last_name, last, dirty):
+        """Salva le differenze rispetto all'ultimo snapshot (``last``, una SnapshotView)"""
+        # Un .gitignore modificato cambia le esclusioni di tutto il progetto
+        if dirty is not None and any(p.rsplit('/', 1)[-1] == '.gitignore' for p in dirty[0]):
+            dirty = None
 
-        # Scansiona progetto corrente
-        current_files = self.scan_project()
+        if dirty is None:
+            # Scansiona progetto corrente
+            current_files = self.scan_project()
+            last_hashes = last.hashes()
+            deleted_files = [path for path in last_hashes if path not in current_files]
+        else:
+            # Solo i percorsi modificati, confrontati con l'ultimo snapshot
+            current_files, removed = self.collect_dirty(dirty[0], dirty[1], last)
+            last_hashes = {}
+            for path in current_files:
+                info = last.get(path)
+                if info is not None:
+                    last_hashes[path] = info['hash']
+            deleted_files = sorted(removed)
 
         # Trova file nuovi/modificati
         changed_files = {}
         for path, info in current_files.items():
-            if path not in last_metadata['files']:
+            if path not in last_hashes:
                 changed_files[path] = 'new'
-            elif info['hash'] != last_metadata['files'][path]['hash']:
+            elif info['hash'] != last_hashes[path]:
                 changed_files[path] = 'modified'
 
-        # Trova file eliminati
-        deleted_files = []
-        for path in last_metadata['files']:
-            if path not in current_files:
-                deleted_files.append(path)
-
         if not changed_files and not deleted_files:
             self.log("✅ Nessuna modifica rilevata")
             return None
@@ -299,49 +3991,500 @@ class ScatolaNera:
         self.log(f"📝 File modificati: {len([f for f in changed_files.values() if f == 'modified'])}")
         self.log(f"📝 File eliminati: {len(deleted_files)}")
 
-        # Crea snapshot con descrizione dettagliata
         description = f"Backup incrementale: {len(changed_files)} modifiche, {len(deleted_files)} eliminazioni"
-        return self.create_snapshot(description)
+
+        # Con --archive/--encrypt l'incrementale è un archivio con i soli file cambiati,
+        # se l'ultimo snapshot è un archivio cifrato allo stesso modo
+        archive = self.archive_mode()
+        storage = 'archive' if archive else 'objects'
+        full_reason = None
+        if archive and last.header.get('storage') == 'archive' \
+                and last.header.get('encryption') != (self.encryption or None):
+            full_reason = "🔐 Cifratura diversa dall'ultimo archivio, creo archivio completo"
+        elif last.header.get('storage') != storage:
+            # Un genitore legacy o archiviato non è nel blob store (e viceversa)
+            full_reason = ("📦 Ultimo snapshot nel blob store, creo archivio completo" if archive else
+                           "⚠️ Ultimo snapshot fuori dal blob store (legacy), creo snapshot completo")
+        elif last.header.get('hash_algorithm', 'md5') != HASH_ALGORITHM:
+            # Hash non confrontabili con quelli del genitore
+            full_reason = (f"⚠️ Ultimo snapshot con hash {last.header.get('hash_algorithm', 'md5')}, "
+                           f"creo snapshot completo ({HASH_ALGORITHM})")
+        elif last.depth + 1 >= MAX_CHAIN_LENGTH:
+            # Catena troppo lunga: snapshot completo sintetico (i blob esistono già);
+            # un archivio completo invece rilegge e riscrive tutto il progetto
+            full_reason = (f"🔗 Catena di {last.depth + 1} archivi incrementali, creo archivio completo" if archive
+                           else f"🔗 Catena di {last.depth + 1} incrementali, compatto in snapshot completo")
+
+        if full_reason:
+            self.log(full_reason)
+            if dirty is not None:
+                # Stato attuale = ultimo snapshot + percorsi modificati
+                changes = current_files
+                current_files = last.files()
+                for path in deleted_files:
+                    current_files.pop(path, None)
+                current_files.update(changes)
+            return self.create_snapshot(description, files_info=current_files)
+
+        store = self.store_archive if archive else self.store_snapshot
+        return store(
+            description,
+            {path: current_files[path] for path in changed_files},
+            parent=last_name,
+            deleted=deleted_files,
+            previous=last
+        )
+
+    def collect_dirty(self, paths, dirs, last):
+        """
+        Stato attuale dei soli percorsi modificati: ({percorso: info}, rimossi)
+
+        ``dirs`` sono cartelle create, spostate o rimosse: se esistono
+        vengono percorse, e i file salvati sotto di esse nell'ultimo snapshot
+        (``last``, letti con una ricerca per intervallo nell'indice) vengono
+        ricontrollati, così una cartella spostata altrove risulta eliminata.
+        """
+        if self.matcher is None:
+            self.matcher = self.build_matcher()
+        candidates = set(paths)
+        for rel_dir in dirs:
+            candidates.update(last.hashes(rel_dir))
+            if (PROJECT_ROOT / rel_dir).is_dir() and not self.should_exclude(rel_dir, True):
+                candidates.update(path for path, _ in self.walk_project(rel_dir, self.matcher))
+
+        changes = {}
+        removed = set()
+        to_hash = []
+        git_index = self.load_git_index()
+        self.stat_cache.begin_update()
+        for rel_path in sorted(candidates):
+            try:
+                st = os.stat(PROJECT_ROOT / rel_path)
+            except OSError:
+                st = None
+            if st is None or not stat.S_ISREG(st.st_mode) or self.should_exclude(rel_path):
+                self.stat_cache.update(rel_path, None, None)
+                if last.get(rel_path) is not None:
+                    removed.add(rel_path)
+                continue
+            # Dopo un checkout i file riscritti hanno spesso un oggetto git già noto
+            oid = git_index.oid(rel_path, st) if git_index else None
+            known = self.stat_cache.lookup(rel_path, st) or self.stat_cache.oid_digest(oid)
+            to_hash.append((rel_path, st, oid, known))
+
+        # Come in scan_project gli hash calcolati finiscono nella stat cache: la prossima
+        # scansione completa (e il prossimo evento sullo stesso file) non li ricalcola
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            digests = executor.map(lambda entry: entry[3] or self.get_file_hash(PROJECT_ROOT / entry[0]), to_hash)
+            for (rel_path, st, oid, _), digest in zip(to_hash, digests):
+                self.stat_cache.update(rel_path, st, digest)
+                self.stat_cache.record_oid(oid, digest)
+                if digest is None:
+                    continue
+                changes[rel_path] = {
+                    'size': st.st_size,
+                    'modified': st.st_mtime,
+                    'mode': st.st_mode & 0o777,
+                    'hash': digest
+                }
+                self.file_stats[rel_path] = st
+        self.stat_cache.save()
+
+        self.log(f"👀 Percorsi modificati esaminati: {len(candidates)}")
+        return changes, removed
+
+    def next_timestamp(self):
+        """Timestamp per un nuovo snapshot che non coincida con uno esistente (nomi al secondo)"""
+        while True:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            name = f"snapshot_{timestamp}"
+            if not any(path.exists() for path in (self.backup_dir / name, self.archive_path(name),
+                                                   self.backup_dir / f"{name}{STAGING_SUFFIX}")):
+                return timestamp
+            time.sleep(0.1)
+
+    def poll_changes(self, previous, dirty):
+        """Controllo a polling (senza watchdog): confronta le stat e segna i file cambiati"""
+        current = {}
+        for rel_path, entry in self.walk_project():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            current[rel_path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+            if previous is not None and previous.get(rel_path) != current[rel_path]:
+                dirty.add(rel_path)
+        if previous is not None:
+            for rel_path in previous.keys() - current.keys():
+                dirty.add(rel_path)
+        return current
+
+    def watch(self, debounce=WATCH_DEBOUNCE_SECONDS, max_delay=WATCH_MAX_DELAY_SECONDS,
+              poll_interval=WATCH_POLL_INTERVAL, retention=None):
+        """
+        Backup continuo: uno snapshot incrementale per ogni gruppo di modifiche
+
+        Gli eventi del filesystem (watchdog: inotify, FSEvents, ...) o il
+        polling riempiono l'insieme dei percorsi modificati; quando non
+        arrivano eventi per ``debounce`` secondi (o al più dopo
+        ``max_delay``) viene salvato un incrementale con solo quei percorsi.
+        Con watchdog, ogni WATCH_FULL_SCAN_INTERVAL un backup con scansione
+        completa recupera eventuali eventi persi.
+        """
+        self.log("=" * 60)
+        self.log("👀 SCATOLA NERA - Watch")
+        self.log("=" * 60)
+
+        dirty = DirtyPaths(PROJECT_ROOT, ignore=self.should_exclude)
+
+        # Allineamento iniziale: salva le modifiche fatte mentre il watch non era attivo
+        self.run_watch_backup(None, retention)
+
+        observer = None
+        if HAS_WATCHDOG:
+            observer = Observer()
+            observer.schedule(dirty, str(PROJECT_ROOT), recursive=True)
+            observer.start()
+            self.log(f"👀 Notifiche del filesystem attive, attesa di quiete: {debounce}s (Ctrl+C per uscire)")
+        else:
+            self.log(f"👀 watchdog non installato: controllo ogni {poll_interval}s (pip install watchdog)")
+            stats = self.poll_changes(None, dirty)
+
+        last_poll = last_full = time.monotonic()
+        try:
+            while True:
+                time.sleep(0.5)
+                now = time.monotonic()
+                if observer is None and now - last_poll >= poll_interval:
+                    stats = self.poll_changes(stats, dirty)
+                    last_poll = now
+
+                if observer is not None and now - last_full >= WATCH_FULL_SCAN_INTERVAL:
+                    dirty.take()
+                    self.run_watch_backup(None, retention)
+                    last_full = time.monotonic()
+                elif dirty.ready(debounce, max_delay):
+                    if not self.run_watch_backup(dirty.take(), retention):
+                        # Al prossimo giro una scansione completa recupera i percorsi persi
+                        last_full = 0
+        except KeyboardInterrupt:
+            pending = dirty.take()
+            if pending[0] or pending[1]:
+                self.run_watch_backup(pending, retention)
+            self.log("👋 Watch terminato")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def run_watch_backup(self, dirty, retention=None):
+        """Un backup del watch; gli errori vengono registrati senza fermare il watch"""
+        try:
+            self.create_incremental_backup(dirty)
+            if retention is not None:
+                self.prune_snapshots(**retention)
+        except Exception as e:
+            self.log(f"⚠️ Backup non riuscito: {e}")
+            return False
+        return True
+
+
+class DirtyPaths:
+    """
+    Percorsi modificati dall'ultimo backup (thread-safe)
+
+    Implementa ``dispatch`` come un handler di watchdog, quindi può essere
+    registrato direttamente su un Observer. I percorsi esclusi (compresi
+    backups/ e il log, che la scatola nera stessa modifica) vengono scartati
+    subito.
+    """
+
+    # Eventi che non indicano una modifica
+    IGNORED_EVENTS = ('opened', 'closed_no_write')
+
+    def __init__(self, root, ignore=None):
+        self.root = str(root)
+        self.ignore = ignore
+        self.lock = threading.Lock()
+        self.files = set()
+        self.dirs = set()
+        self.first_event = None
+        self.last_event = None
+
+    def add(self, rel_path, is_dir=False):
+        if self.ignore is not None and self.ignore(rel_path, is_dir):
+            return
+        with self.lock:
+            (self.dirs if is_dir else self.files).add(rel_path)
+            self.last_event = time.monotonic()
+            if self.first_event is None:
+                self.first_event = self.last_event
+
+    def dispatch(self, event):
+        if event.event_type in self.IGNORED_EVENTS:
+            return
+        # "modified" su una cartella segnala solo che è cambiato un suo file, già notificato
+        if event.is_directory and event.event_type == 'modified':
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            if not path:
+                continue
+            rel_path = os.path.relpath(os.fsdecode(path), self.root)
+            if rel_path == '.' or rel_path.startswith('..'):
+                continue
+            self.add(rel_path.replace(os.sep, '/'), event.is_directory)
+
+    def ready(self, debounce, max_delay):
+        """True quando è ora di salvare: quiete da ``debounce`` s o attesa oltre ``max_delay``"""
+        with self.lock:
+            if self.first_event is None:
+                return False
+            now = time.monotonic()
+            return now - self.last_event >= debounce or now - self.first_event >= max_delay
+
+    def take(self):
+        """Restituisce (file, cartelle) e svuota l'insieme"""
+        with self.lock:
+            pending = (self.files, self.dirs)
+            self.files, self.dirs = set(), set()
+            self.first_event = self.last_event = None
+            return pending
+
+
+def format_rate(num_bytes, seconds):
+    """Throughput leggibile: MB elaborati e MB/s"""
+    mb = num_bytes / 1024 / 1024
+    return f"{mb:.2f} MB a {mb / seconds if seconds > 0 else 0:.1f} MB/s"
+
+
+def format_size(num_bytes):
+    """Dimensione leggibile (B, KB, MB, GB)"""
+    for unit in ('B', 'KB', 'MB'):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == 'B' else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.2f} GB"
+
+
+def split_args(argv):
+    """Separa argomenti posizionali e opzioni --nome / --nome=valore"""
+    positional = []
+    options = {}
+    for arg in argv:
+        if arg.startswith('--'):
+            name, _, value = arg[2:].partition('=')
+            options[name] = value if value else True
+        else:
+            positional.append(arg)
+    return positional, options
+
 
 def main():
     """Funzione principale"""
     scatola = ScatolaNera()
+    args, options = split_args(sys.argv[1:])
+    scatola.paranoid = bool(options.get('paranoid'))
+    if options.get('git'):
+        scatola.use_git_index = True
+    if options.get('workers'):
+        scatola.workers = max(1, int(options['workers']))
+    if options.get('archive'):
+        scatola.archive_codec = ARCHIVE_COMPRESSION if options['archive'] is True else options['archive']
+        if scatola.archive_codec not in ARCHIVE_CODECS:
+            print(f"❌ Compressione non supportata: {scatola.archive_codec} (disponibili: {', '.join(ARCHIVE_CODECS)})")
+            sys.exit(1)
+        if scatola.archive_codec == 'zstd' and not HAS_ZSTD:
+            print("❌ Compressione zstd non disponibile: pip install zstandard")
+            sys.exit(1)
+    if options.get('encrypt'):
+        if options['encrypt'] == 'off':
+            scatola.encryption = False
+        else:
+            scatola.encryption = ENCRYPTION_CIPHERS[0] if options['encrypt'] is True else options['encrypt']
+            if scatola.encryption not in ENCRYPTION_CIPHERS:
+                print(f"❌ Cifrario non supportato: {scatola.encryption} (disponibili: {', '.join(ENCRYPTION_CIPHERS)})")
+                sys.exit(1)
+            if not HAS_CRYPTOGRAPHY:
+                print("❌ Cifratura non disponibile: pip install cryptography")
+                sys.exit(1)
+            try:
+                archive_passphrase(confirm=True)
+            except ArchiveAuthError as e:
+                print(f"❌ {e}")
+                sys.exit(1)
+
+    limit = options.get('limit', 0)
+    try:
+        limit = float(limit) if limit is not True else -1
+    except ValueError:
+        limit = -1
+    if not 0 <= limit < float('inf'):
+        print("❌ Indica il limite in MB/s: --limit=20")
+        sys.exit(1)
+    pause = options.get('pause-when-busy')
+    max_load = None
+    if pause not in (None, True):
+        try:
+            max_load = float(pause)
+        except ValueError:
+            max_load = -1
+        if not 0 < max_load < float('inf'):
+            print("❌ Indica la soglia di carico: --pause-when-busy=4 (o solo --pause-when-busy)")
+            sys.exit(1)
+    if limit or options.get('nice') or pause:
+        scatola.set_background_mode(limit, nice=bool(options.get('nice')), pause_when_busy=bool(pause),
+                                    max_load=max_load)
 
-    if len(sys.argv) < 2:
+    if not args:
         print("\n🔒 SCATOLA NERA - Sistema di Backup Ordo ab Chao\n")
         print("Uso:")
         print("  python3 scatola-nera.py snapshot [descrizione]  - Crea snapshot completo")
         print("  python3 scatola-nera.py backup                  - Crea backup incrementale")
         print("  python3 scatola-nera.py list                    - Elenca snapshot")
-        print("  python3 scatola-nera.py restore <nome>          - Ripristina snapshot")
+        print("  python3 scatola-nera.py restore <nome> [filtri] - Ripristina snapshot (o solo percorsi/glob)")
+        print("  python3 scatola-nera.py migrate                 - Converte snapshot e manifest legacy nel formato attuale")
+        print("  python3 scatola-nera.py compact <nome>          - Unisce una catena di incrementali")
+        print("  python3 scatola-nera.py export <nome> [file]    - Esporta uno snapshot in un archivio .snar")
+        print("  python3 scatola-nera.py extract <nome> <file>   - Estrae un solo file da snapshot o archivio")
+        print("  python3 scatola-nera.py prune                   - Rimuove gli snapshot scaduti e i blob inutilizzati")
+        print("  python3 scatola-nera.py verify [nome]           - Verifica gli hash dei contenuti salvati")
+        print("  python3 scatola-nera.py watch                   - Backup continuo a ogni gruppo di modifiche")
+        print("  python3 scatola-nera.py diff <a> <b> [filtri]   - Confronta due snapshot (solo manifest)")
+        print("  python3 scatola-nera.py history <file>          - Versioni di un file negli snapshot")
+        print("  python3 scatola-nera.py materialize <nome> [dir] - Albero navigabile dello snapshot (reflink/hardlink)")
+        print("  python3 scatola-nera.py replicate <cartella>    - Copia gli snapshot su un altro disco (solo le differenze)")
+        print("\nOpzioni:")
+        print("  --paranoid   Ignora la stat cache e ricalcola tutti gli hash")
+        print("  --git        Per i file tracciati usa stat e id degli oggetti dell'index di git")
+        print("  --workers=N  Thread per hashing e copia (default: numero di CPU)")
+        print("  --archive[=gzip|zstd]  Salva lo snapshot completo come unico archivio compresso")
+        print(f"  --encrypt[=aes-gcm|chacha20|off]  Archivio cifrato (passphrase da {PASSPHRASE_ENV} o richiesta)")
+        print("  --dry-run    Con restore/prune: mostra cosa cambierebbe senza modificare nulla")
+        print("  --version=N  Con restore <file>: ripristina la versione N mostrata da history")
+        print(f"  --keep-last=N --keep-daily=D --keep-weekly=W  Retention per prune "
+              f"(default: {RETENTION_KEEP_LAST}, {RETENTION_KEEP_DAILY}, {RETENTION_KEEP_WEEKLY})")
+        print("  --prune      Dopo snapshot/backup/watch applica la retention")
+        print("  --full       Con prune: rimuove anche i blob che nessuno snapshot conta")
+        print("  --fraction=F Con verify: controlla solo questa frazione (0-1) e riprende dal cursore")
+        print(f"  --debounce=S Con watch: secondi di quiete prima del backup (default: {WATCH_DEBOUNCE_SECONDS})")
+        print("  --content    Con diff: mostra il diff testuale dei file modificati indicati")
+        print("  --delete     Con replicate: rimuove dalla replica anche gli snapshot rimossi qui")
+        print("  --limit=MB   Limita letture e copie a tanti MB/s (backup in sottofondo)")
+        print(f"  --nice       Priorità di CPU (nice +{NICE_INCREMENT}) e di I/O (idle, con psutil) più basse")
+        print("  --pause-when-busy[=CARICO]  Si ferma mentre l'agent ha job in corso (o il carico supera CARICO)")
         print("\nEsempi:")
         print("  python3 scatola-nera.py snapshot \"PWA completata\"")
         print("  python3 scatola-nera.py backup")
-        print("  python3 scatola-nera.py restore snapshot_20250117_143022\n")
+        print("  python3 scatola-nera.py restore snapshot_20250117_143022")
+        print("  python3 scatola-nera.py restore snapshot_20250117_143022 app/ '*.json' --dry-run\n")
         sys.exit(0)
 
-    command = sys.argv[1].lower()
+    command = args[0].lower()
+
+    retention = {
+        'keep_last': int(options.get('keep-last', RETENTION_KEEP_LAST)),
+        'keep_daily': int(options.get('keep-daily', RETENTION_KEEP_DAILY)),
+        'keep_weekly': int(options.get('keep-weekly', RETENTION_KEEP_WEEKLY))
+    }
 
     if command == 'snapshot':
-        description = ' '.join(sys.argv[2:]) if len(sys.argv) > 2 else "Snapshot manuale"
+        description = ' '.join(args[1:]) if len(args) > 1 else "Snapshot manuale"
         scatola.create_snapshot(description)
+        if options.get('prune'):
+            scatola.prune_snapshots(**retention)
 
     elif command == 'backup':
         scatola.create_incremental_backup()
+        if options.get('prune'):
+            scatola.prune_snapshots(**retention)
+
+    elif command == 'watch':
+        scatola.watch(debounce=float(options.get('debounce', WATCH_DEBOUNCE_SECONDS)),
+                      retention=retention if options.get('prune') else None)
+
+    elif command == 'diff':
+        if len(args) < 3:
+            print("❌ Specifica i due snapshot da confrontare")
+            sys.exit(1)
+        if scatola.diff_snapshots(args[1], args[2], args[3:], content=bool(options.get('content'))) is None:
+            sys.exit(1)
+
+    elif command == 'verify':
+        ok = scatola.verify_snapshots(args[1] if len(args) > 1 else None,
+                                      fraction=float(options.get('fraction', 1.0)))
+        if not ok:
+            sys.exit(1)
+
+    elif command == 'prune':
+        scatola.prune_snapshots(**retention, dry_run=bool(options.get('dry-run')),
+                                full=bool(options.get('full')))
 
     elif command == 'list':
         scatola.list_snapshots()
 
     elif command == 'restore':
-        if len(sys.argv) < 3:
+        if len(args) < 2:
             print("❌ Specifica il nome dello snapshot da ripristinare")
             sys.exit(1)
-        snapshot_name = sys.argv[2]
-        scatola.restore_snapshot(snapshot_name)
+        if options.get('version'):
+            if options['version'] is True:
+                print("❌ Indica la versione: restore <file> --version=N")
+                sys.exit(1)
+            scatola.restore_version(args[1].removeprefix('./'), options['version'],
+                                    dry_run=bool(options.get('dry-run')))
+        else:
+            snapshot_name = args[1]
+            scatola.restore_snapshot(snapshot_name, args[2:], dry_run=bool(options.get('dry-run')))
+
+    elif command == 'history':
+        if len(args) < 2:
+            print("❌ Specifica il percorso del file")
+            sys.exit(1)
+        if not scatola.show_history(args[1].removeprefix('./')):
+            sys.exit(1)
+
+    elif command == 'migrate':
+        scatola.migrate_snapshots()
+
+    elif command == 'compact':
+        if len(args) < 2:
+            print("❌ Specifica il nome dello snapshot da compattare")
+            sys.exit(1)
+        scatola.compact_snapshot(args[1])
+
+    elif command == 'export':
+        if len(args) < 2:
+            print("❌ Specifica il nome dello snapshot da esportare")
+            sys.exit(1)
+        scatola.export_snapshot(args[1], args[2] if len(args) > 2 else None)
+
+    elif command == 'replicate':
+        if len(args) < 2:
+            print("❌ Specifica la cartella di destinazione")
+            sys.exit(1)
+        if not scatola.replicate(args[1], delete=bool(options.get('delete'))):
+            sys.exit(1)
+
+    elif command == 'materialize':
+        if len(args) < 2:
+            print("❌ Specifica il nome dello snapshot da materializzare")
+            sys.exit(1)
+        if scatola.materialize_snapshot(args[1], args[2] if len(args) > 2 else None) is None:
+            sys.exit(1)
+
+    elif command == 'extract':
+        if len(args) < 3:
+            print("❌ Specifica snapshot (o archivio .snar) e percorso del file")
+            sys.exit(1)
+        scatola.extract_file(args[1], args[2], args[3] if len(args) > 3 else None)
 
     else:
         print(f"❌ Comando sconosciuto: {command}")
         sys.exit(1)
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    except ArchiveAuthError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
@@ -0,0 +1,44 @@
+"""
+Fixture comuni per i test della scatola nera
+
+scatola-nera.py ha un trattino nel nome e ricava cartella del progetto e
+dei backup dalla propria posizione: ogni test ne carica una copia dentro
+tmp_path, così progetto, backup, stato e log restano isolati.
+"""
+
+import importlib.util
+import shutil
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / "scatola-nera.py"
+
+
+@pytest.fixture
+def sn(tmp_path, monkeypatch):
+    """Modulo scatola-nera caricato da una copia in tmp_path (progetto vuoto)"""
+    script = tmp_path / SCRIPT.name
+    shutil.copy(SCRIPT, script)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SCATOLA_NERA_PASSPHRASE", "passphrase di prova")
+    spec = importlib.util.spec_from_file_location("scatola_nera", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def scatola(sn):
+    """ScatolaNera sul progetto in tmp_path, con i messaggi raccolti in ``messages``"""
+    instance = sn.ScatolaNera()
+    instance.workers = 2
+    instance.messages = []
+    log = instance.log
+
+    def collect(message):
+        instance.messages.append(message)
+        log(message)
+
+    instance.log = collect
+    return instance
@@ -0,0 +1,28 @@
+"""Funzioni di supporto dei test: file del progetto e contenuti degli snapshot"""
+
+
+def write(root, files):
+    for rel_path, data in files.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def snapshot_contents(scatola, name):
+    """{percorso: contenuto} dello stato completo di uno snapshot"""
+    with scatola.open_snapshot(name) as view:
+        metadata = view.header
+        return {rel_path: scatola.read_snapshot_file(name, metadata, rel_path, info)
+                for rel_path, info in view.files().items()}
+
+
+def stored_blobs(scatola):
+    root = scatola.store.root
+    return {prefix.name + blob.name for prefix in root.iterdir() if prefix.name != "tmp" and prefix.is_dir()
+            for blob in prefix.iterdir()}
+
+
+def fast_timestamps(scatola, monkeypatch):
+    """Nomi degli snapshot crescenti senza attendere il secondo successivo"""
+    counter = iter(range(1, 10**6))
+    monkeypatch.setattr(scatola, "next_timestamp", lambda: f"20260101_{next(counter):06d}")
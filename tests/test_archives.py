@@ -0,0 +1,123 @@
+"""Snapshot archiviati in un unico file compresso (ArchiveWriter, ArchiveReader, export)"""
+
+import os
+import zlib
+
+import pytest
+
+from helpers import snapshot_contents, stored_blobs, write
+
+FILES = {
+    "app/index.html": b"<html>" + b"ciao " * 2000 + b"</html>\n",
+    "app/style.css": b"body { color: black; }\n" * 300,
+    "docs/vuoto.txt": b"",
+}
+
+
+def archived_snapshot(scatola, tmp_path, files=FILES, codec="gzip"):
+    scatola.archive_codec = codec
+    write(tmp_path, files)
+    scatola.create_snapshot("archivio")
+    return scatola.state["snapshots"][-1]["name"]
+
+
+def test_archive_round_trip(sn, scatola, tmp_path):
+    name = archived_snapshot(scatola, tmp_path)
+
+    assert scatola.archive_path(name).is_file()
+    assert not (sn.BACKUP_DIR / name).exists()
+    assert not scatola.store.root.exists() or not stored_blobs(scatola)
+    contents = snapshot_contents(scatola, name)
+    for rel_path, data in FILES.items():
+        assert contents[rel_path] == data
+
+
+def test_members_are_compressed(sn, scatola, tmp_path):
+    name = archived_snapshot(scatola, tmp_path)
+
+    reader = sn.ArchiveReader(scatola.archive_path(name))
+    info = reader.metadata["files"]["app/style.css"]
+    assert info["codec"] == "gzip"
+    assert info["length"] < info["size"] / 10
+
+
+def test_incompressible_member_stored(sn, scatola, tmp_path):
+    name = archived_snapshot(scatola, tmp_path, {"foto.jpg": os.urandom(300_000)})
+
+    reader = sn.ArchiveReader(scatola.archive_path(name))
+    info = reader.metadata["files"]["foto.jpg"]
+    assert info["codec"] == "store"
+    assert snapshot_contents(scatola, name)["foto.jpg"] == (tmp_path / "foto.jpg").read_bytes()
+
+
+def test_member_read_without_touching_others(sn, scatola, tmp_path):
+    # Accesso diretto: un membro danneggiato non impedisce di leggere gli altri
+    name = archived_snapshot(scatola, tmp_path)
+    path = scatola.archive_path(name)
+    reader = sn.ArchiveReader(path)
+    damaged = reader.metadata["files"]["app/index.html"]
+    data = bytearray(path.read_bytes())
+    data[damaged["offset"] + damaged["length"] // 2] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    reader = sn.ArchiveReader(path)
+    parts = []
+    assert reader.read_member(reader.metadata["files"]["app/style.css"], parts.append)
+    assert b"".join(parts) == FILES["app/style.css"]
+    with pytest.raises((ValueError, zlib.error)):
+        reader.extract(damaged, tmp_path / "estratto.html")
+
+
+def test_incomplete_archive_rejected(sn, scatola, tmp_path):
+    name = archived_snapshot(scatola, tmp_path)
+    path = scatola.archive_path(name)
+    path.write_bytes(path.read_bytes()[:-10])
+
+    with pytest.raises(ValueError, match="non valido"):
+        sn.ArchiveReader(path)
+
+
+def test_writer_publishes_only_when_finished(sn, tmp_path):
+    path = tmp_path / "parziale.snar"
+    (tmp_path / "a.txt").write_bytes(b"a")
+    with pytest.raises(RuntimeError):
+        with sn.ArchiveWriter(path) as archive:
+            archive.add([tmp_path / "a.txt"])
+            raise RuntimeError("interrotto")
+
+    assert not path.exists()
+    assert not path.with_name(path.name + ".tmp").exists()
+
+
+def test_extract_single_file(sn, scatola, tmp_path):
+    name = archived_snapshot(scatola, tmp_path)
+    destination = tmp_path / "fuori" / "style.css"
+
+    assert scatola.extract_file(name, "app/style.css", destination)
+    assert destination.read_bytes() == FILES["app/style.css"]
+
+
+def test_export_blob_snapshot(sn, scatola, tmp_path):
+    write(tmp_path, FILES)
+    scatola.create_snapshot("nel blob store")
+    name = scatola.state["snapshots"][-1]["name"]
+
+    destination = scatola.export_snapshot(name, tmp_path / "export.snar")
+
+    # L'archivio esportato è autonomo e si legge direttamente
+    contents = snapshot_contents(scatola, str(destination))
+    for rel_path, data in FILES.items():
+        assert contents[rel_path] == data
+
+
+def test_unknown_codec_rejected(sn, tmp_path):
+    with pytest.raises(ValueError, match="non supportata"):
+        sn.ArchiveWriter(tmp_path / "x.snar", codec="lzma")
+
+
+def test_zstd_archive(sn, scatola, tmp_path):
+    if not sn.HAS_ZSTD:
+        pytest.skip("zstandard non installato")
+    name = archived_snapshot(scatola, tmp_path, codec="zstd")
+
+    assert snapshot_contents(scatola, name)["app/index.html"] == FILES["app/index.html"]
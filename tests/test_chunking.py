@@ -0,0 +1,158 @@
+"""Chunking content-defined dei file grandi (find_chunk_boundary, BlobStore.put_chunked)"""
+
+import hashlib
+import random
+import time
+
+
+def split(sn, data):
+    """Chunk di ``data`` tagliati come fa put_chunked (buffer pieno fino a CHUNK_MAX_SIZE)"""
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        cut = sn.find_chunk_boundary(bytearray(data[pos:pos + sn.CHUNK_MAX_SIZE]))
+        chunks.append(data[pos:pos + cut])
+        pos += cut
+    return chunks
+
+
+def digests(chunks):
+    return [hashlib.sha256(chunk).hexdigest() for chunk in chunks]
+
+
+def sample(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def test_chunk_sizes_within_limits(sn):
+    data = sample(24 * 1024 * 1024)
+    chunks = split(sn, data)
+
+    assert b"".join(chunks) == data
+    assert len(chunks) > 1
+    for chunk in chunks[:-1]:
+        assert sn.CHUNK_MIN_SIZE <= len(chunk) <= sn.CHUNK_MAX_SIZE
+    # Almeno un taglio dipende dal contenuto (non tutti al massimo)
+    assert any(len(chunk) < sn.CHUNK_MAX_SIZE for chunk in chunks[:-1])
+
+
+def test_short_tail_is_one_chunk(sn):
+    data = sample(sn.CHUNK_MIN_SIZE - 1)
+
+    assert sn.find_chunk_boundary(bytearray(data)) == len(data)
+
+
+def test_boundaries_realign_after_insert(sn):
+    data = sample(24 * 1024 * 1024)
+    edited = data[:1000] + b"riga inserita all'inizio\n" + data[1000:]
+
+    before = digests(split(sn, data))
+    after = digests(split(sn, edited))
+
+    # Cambia solo il chunk con l'inserimento: gli altri si ritrovano identici
+    assert before[1:] == after[1:]
+    assert before[0] != after[0]
+
+
+def test_boundaries_realign_after_delete(sn):
+    data = sample(24 * 1024 * 1024, seed=1)
+    middle = len(data) // 2
+    edited = data[:middle] + data[middle + 4096:]
+
+    before = digests(split(sn, data))
+    after = set(digests(split(sn, edited)))
+
+    assert len([d for d in before if d not in after]) <= 2
+
+
+def reference_boundary(sn, buffer):
+    """Taglio valutando ogni candidato, senza salti né limite di valutazioni"""
+    size = len(buffer)
+    if size <= sn.CHUNK_MIN_SIZE:
+        return size
+    limit = min(size, sn.CHUNK_MAX_SIZE)
+    marked = bytes(buffer[:limit]).translate(sn.CHUNK_MARKER_TABLE)
+    run = len(sn.CHUNK_MARKER_RUN)
+    pos = marked.find(sn.CHUNK_MARKER_RUN, sn.CHUNK_MIN_SIZE - run)
+    while pos != -1:
+        end = pos + run
+        digest = hashlib.blake2b(buffer[end - sn.CHUNK_WINDOW:end], digest_size=8).digest()
+        if not int.from_bytes(digest, "big") & sn.CHUNK_CUT_MASK:
+            return end
+        pos = marked.find(sn.CHUNK_MARKER_RUN, pos + 1)
+    return limit
+
+
+def test_byte_runs_do_not_move_boundaries(sn):
+    # Saltare le sequenze di byte uguali non cambia i tagli: sequenze tra dati casuali
+    rng = random.Random(3)
+    parts = []
+    while sum(map(len, parts)) < 3 * sn.CHUNK_MAX_SIZE:
+        parts.append(rng.randbytes(rng.randrange(1, 300_000)))
+        parts.append(bytes([rng.choice(b"\0 \n")]) * rng.randrange(1, 100_000))
+    data = b"".join(parts)
+
+    pos = 0
+    while pos < len(data):
+        buffer = bytearray(data[pos:pos + sn.CHUNK_MAX_SIZE])
+        cut = sn.find_chunk_boundary(buffer)
+        assert cut == reference_boundary(sn, buffer)
+        pos += cut
+
+
+def test_cut_right_after_byte_run(sn, monkeypatch):
+    # Metà dei candidati taglia (non le finestre di soli zeri o spazi): il taglio cade
+    # spesso nei primi byte dopo la sequenza, dove un salto sbagliato lo sposterebbe
+    monkeypatch.setattr(sn, "CHUNK_CUT_MASK", 1)
+    rng = random.Random(5)
+    for _ in range(100):
+        buffer = bytearray(rng.randbytes(sn.CHUNK_MIN_SIZE - 1000)
+                           + bytes([rng.choice(b"\0 ")]) * 5000
+                           + rng.randbytes(100_000))
+        assert sn.find_chunk_boundary(buffer) == reference_boundary(sn, buffer)
+
+
+def test_zero_filled_input_chunks_quickly(sn):
+    data = bytes(64 * 1024 * 1024)
+
+    started = time.perf_counter()
+    chunks = split(sn, data)
+    elapsed = time.perf_counter() - started
+
+    assert b"".join(chunks) == data
+    assert all(len(chunk) <= sn.CHUNK_MAX_SIZE for chunk in chunks)
+    assert len(chunks) <= len(data) // sn.CHUNK_MIN_SIZE + 1
+    # Chunk identici: un file di zeri occupa un solo blob
+    assert len(set(digests(chunks[:-1]))) == 1
+    assert elapsed < 5
+
+
+def test_low_entropy_input_chunks_quickly(sn):
+    # Tutti byte marcatori ma finestre diverse: il limite di valutazioni per chunk
+    data = (b" \n\0" * (11 * 1024 * 1024))[:32 * 1024 * 1024]
+
+    started = time.perf_counter()
+    chunks = split(sn, data)
+    elapsed = time.perf_counter() - started
+
+    assert b"".join(chunks) == data
+    assert all(len(chunk) <= sn.CHUNK_MAX_SIZE for chunk in chunks)
+    assert len(chunks) <= len(data) // sn.CHUNK_MIN_SIZE + 1
+    assert elapsed < 5
+
+
+def test_put_chunked_reuses_unchanged_chunks(sn, tmp_path):
+    store = sn.BlobStore(tmp_path / "objects")
+    src = tmp_path / "grande.bin"
+    data = sample(12 * 1024 * 1024, seed=2)
+    src.write_bytes(data)
+    digest, chunks, _ = store.put_chunked(src)
+
+    src.write_bytes(data + b"righe aggiunte in coda\n")
+    new_digest, new_chunks, new_bytes = store.put_chunked(src, chunks)
+
+    assert new_digest != digest
+    assert new_chunks[:-1] == chunks[:-1]
+    assert new_bytes < sn.CHUNK_MAX_SIZE + 1024
+    restored = b"".join(store.path_for(d).read_bytes() for d, _ in new_chunks)
+    assert restored == src.read_bytes()
@@ -0,0 +1,119 @@
+"""Confronto tra snapshot dai soli manifest (diff_snapshots)"""
+
+import os
+import shutil
+
+from helpers import write
+
+
+def two_snapshots(scatola, tmp_path):
+    write(tmp_path, {
+        "app/index.html": b"<h1>v1</h1>\n",
+        "app/style.css": b"a {}\n",
+        "run.sh": b"#!/bin/sh\n",
+        "vecchio.txt": b"da togliere\n",
+    })
+    scatola.create_snapshot("prima")
+    first = scatola.state["snapshots"][-1]["name"]
+    write(tmp_path, {"app/index.html": b"<h1>v2</h1>\n", "app/nuovo.js": b"let x = 1\n"})
+    (tmp_path / "vecchio.txt").unlink()
+    os.chmod(tmp_path / "run.sh", 0o700)
+    scatola.create_snapshot("dopo")
+    return first, scatola.state["snapshots"][-1]["name"]
+
+
+def test_changes_classified(sn, scatola, tmp_path, capsys):
+    first, second = two_snapshots(scatola, tmp_path)
+
+    result = scatola.diff_snapshots(first, second)
+
+    # Stessa dimensione, hash diverso: modificato
+    assert result == {
+        "added": ["app/nuovo.js"],
+        "removed": ["vecchio.txt"],
+        "modified": ["app/index.html"],
+        "mode": ["run.sh"],
+    }
+    out = capsys.readouterr().out
+    assert "+ app/nuovo.js" in out
+    assert "- vecchio.txt" in out
+    assert "~ app/index.html" in out
+    assert "⚙ run.sh" in out and "→ 700" in out
+
+
+def test_incremental_against_full(sn, scatola, tmp_path):
+    # Il secondo snapshot si legge seguendo la catena del genitore
+    first, second = two_snapshots(scatola, tmp_path)
+    write(tmp_path, {"app/style.css": b"a { color: red }\n"})
+    scatola.create_incremental_backup()
+    third = scatola.state["snapshots"][-1]["name"]
+
+    result = scatola.diff_snapshots(first, third)
+
+    assert result["modified"] == ["app/index.html", "app/style.css"]
+    assert result["added"] == ["app/nuovo.js"]
+    assert result["removed"] == ["vecchio.txt"]
+
+
+def test_reads_only_manifests(sn, scatola, tmp_path):
+    first, second = two_snapshots(scatola, tmp_path)
+    shutil.rmtree(scatola.store.root)
+
+    assert scatola.diff_snapshots(first, second)["modified"] == ["app/index.html"]
+
+
+def test_reverse_order(sn, scatola, tmp_path):
+    first, second = two_snapshots(scatola, tmp_path)
+
+    result = scatola.diff_snapshots(second, first)
+
+    assert result["added"] == ["vecchio.txt"]
+    assert result["removed"] == ["app/nuovo.js"]
+
+
+def test_patterns_limit_comparison(sn, scatola, tmp_path):
+    first, second = two_snapshots(scatola, tmp_path)
+
+    result = scatola.diff_snapshots(first, second, ["app/*.html", "vecchio.txt"])
+
+    assert result == {"added": [], "removed": ["vecchio.txt"], "modified": ["app/index.html"], "mode": []}
+
+
+def test_content_diff(sn, scatola, tmp_path, capsys):
+    first, second = two_snapshots(scatola, tmp_path)
+
+    scatola.diff_snapshots(first, second, ["app/index.html"], content=True)
+
+    out = capsys.readouterr().out
+    assert f"--- {first}/app/index.html" in out
+    assert "-<h1>v1</h1>" in out
+    assert "+<h1>v2</h1>" in out
+
+
+def test_content_diff_skips_binary(sn, scatola, tmp_path, capsys):
+    write(tmp_path, {"logo.png": b"\x89PNG\0\0v1"})
+    scatola.create_snapshot("prima")
+    first = scatola.state["snapshots"][-1]["name"]
+    write(tmp_path, {"logo.png": b"\x89PNG\0\0v2"})
+    scatola.create_incremental_backup()
+
+    scatola.diff_snapshots(first, scatola.state["snapshots"][-1]["name"], ["logo.png"], content=True)
+
+    assert "logo.png: file binario" in capsys.readouterr().out
+
+
+def test_identical_snapshots(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a\n"})
+    scatola.create_snapshot("uno")
+    scatola.create_snapshot("due")
+    first, second = (s["name"] for s in scatola.state["snapshots"])
+
+    assert scatola.diff_snapshots(first, second) == {"added": [], "removed": [], "modified": [], "mode": []}
+
+
+def test_unknown_snapshot(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a\n"})
+    scatola.create_snapshot("uno")
+
+    assert scatola.diff_snapshots(scatola.state["snapshots"][-1]["name"], "snapshot_19700101_000000") is None
+    assert any("Snapshot non trovato" in m for m in scatola.messages)
@@ -0,0 +1,59 @@
+"""Snapshot in archivi cifrati (--encrypt): catene incrementali e indici locali"""
+
+import pytest
+
+from helpers import snapshot_contents, write
+
+pytest.importorskip("cryptography")
+
+SECRET_PATH = "config/credenziali-segrete.js"
+
+
+def encrypted_chain(scatola, tmp_path):
+    scatola.encryption = "aes-gcm"
+    write(tmp_path, {SECRET_PATH: b"token = 'abc'\n", "a.txt": b"a v1\n"})
+    scatola.create_snapshot("cifrato")
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    scatola.create_incremental_backup()
+    return [s["name"] for s in scatola.state["snapshots"]]
+
+
+def test_incremental_archive_chain_restores(sn, scatola, tmp_path):
+    names = encrypted_chain(scatola, tmp_path)
+
+    assert scatola.state["snapshots"][-1]["type"] == "incremental"
+    contents = snapshot_contents(scatola, names[-1])
+    assert contents[SECRET_PATH] == b"token = 'abc'\n"
+    assert contents["a.txt"] == b"a v2\n"
+
+
+def test_no_plaintext_index_for_encrypted_archives(sn, scatola, tmp_path):
+    names = encrypted_chain(scatola, tmp_path)
+
+    for name in names:
+        assert not scatola.archive_index_path(name).exists()
+        assert SECRET_PATH.encode() not in scatola.archive_path(name).read_bytes()
+
+
+def test_plain_archives_keep_local_index(sn, scatola, tmp_path):
+    scatola.archive_codec = "gzip"
+    scatola.encryption = False
+    write(tmp_path, {"a.txt": b"a\n"})
+    scatola.create_snapshot("in chiaro")
+
+    assert scatola.archive_index_path(scatola.state["snapshots"][-1]["name"]).exists()
+
+
+def test_migrate_removes_leftover_plaintext_index(sn, scatola, tmp_path):
+    names = encrypted_chain(scatola, tmp_path)
+    # Copia in chiaro come la salvavano le versioni precedenti
+    sn.ARCHIVE_INDEX_DIR.mkdir(exist_ok=True)
+    with scatola.open_manifest(names[0]) as manifest:
+        header, files = dict(manifest.header), dict(manifest.files())
+    with sn.ManifestWriter(scatola.archive_index_path(names[0])) as index:
+        index.finish(header, (), files.items())
+
+    scatola.migrate_snapshots()
+
+    assert not scatola.archive_index_path(names[0]).exists()
+    assert snapshot_contents(scatola, names[-1])["a.txt"] == b"a v2\n"
@@ -0,0 +1,89 @@
+"""Cifratura a frame degli archivi (FrameCipher, FrameWriter, read_frames)"""
+
+import io
+import os
+
+import pytest
+
+pytest.importorskip("cryptography")
+
+
+def encrypt(sn, cipher, data, offset=0, writes=None):
+    """Flusso cifrato di ``data``, scritto a blocchi di ``writes`` byte"""
+    out = io.BytesIO()
+    writer = sn.FrameWriter(out, cipher, offset)
+    step = writes or max(len(data), 1)
+    for start in range(0, len(data), step):
+        writer.write(data[start:start + step])
+    writer.close()
+    return out.getvalue()
+
+
+def decrypt(sn, cipher, stream, offset=0):
+    return b"".join(sn.read_frames(io.BytesIO(stream), cipher, offset, len(stream)))
+
+
+@pytest.fixture(params=["aes-gcm", "chacha20"])
+def cipher(sn, request):
+    return sn.FrameCipher(sn.FrameCipher.new_header(request.param))
+
+
+@pytest.mark.parametrize("size", [0, 1, 1024 * 1024, 1024 * 1024 + 1, 3 * 1024 * 1024 - 7])
+def test_round_trip(sn, cipher, size):
+    data = os.urandom(size)
+    stream = encrypt(sn, cipher, data, offset=4096)
+
+    assert decrypt(sn, cipher, stream, offset=4096) == data
+
+
+def test_write_pattern_does_not_change_frames(sn, cipher):
+    # Frame uguali sia con scritture piccole sia con un blocco unico
+    data = os.urandom(2 * sn.ENCRYPTION_FRAME_SIZE + 123)
+
+    assert encrypt(sn, cipher, data, writes=65536) == encrypt(sn, cipher, data)
+
+
+def test_tampered_byte_detected(sn, cipher):
+    stream = bytearray(encrypt(sn, cipher, os.urandom(2 * sn.ENCRYPTION_FRAME_SIZE)))
+    stream[sn.ENCRYPTION_FRAME_SIZE + 100] ^= 0x01
+
+    with pytest.raises(sn.ArchiveAuthError):
+        decrypt(sn, cipher, bytes(stream))
+
+
+def test_truncated_stream_detected(sn, cipher):
+    # Senza l'ultimo frame il penultimo non è marcato come finale
+    frame = sn.ENCRYPTION_FRAME_SIZE + sn.FRAME_TAG_SIZE
+    stream = encrypt(sn, cipher, os.urandom(3 * sn.ENCRYPTION_FRAME_SIZE))
+
+    with pytest.raises(sn.ArchiveAuthError):
+        decrypt(sn, cipher, stream[:2 * frame])
+
+
+def test_reordered_frames_detected(sn, cipher):
+    frame = sn.ENCRYPTION_FRAME_SIZE + sn.FRAME_TAG_SIZE
+    stream = encrypt(sn, cipher, os.urandom(3 * sn.ENCRYPTION_FRAME_SIZE))
+    swapped = stream[frame:2 * frame] + stream[:frame] + stream[2 * frame:]
+
+    with pytest.raises(sn.ArchiveAuthError):
+        decrypt(sn, cipher, swapped)
+
+
+def test_stream_bound_to_offset(sn, cipher):
+    # Un membro copiato in un'altra posizione dell'archivio non si decifra
+    stream = encrypt(sn, cipher, b"contenuto", offset=0)
+
+    with pytest.raises(sn.ArchiveAuthError):
+        decrypt(sn, cipher, stream, offset=512)
+
+
+def test_wrong_passphrase_rejected(sn, monkeypatch):
+    header = sn.FrameCipher.new_header("aes-gcm")
+    stream = encrypt(sn, sn.FrameCipher(header), b"segreto")
+
+    monkeypatch.setattr(sn, "_passphrase", None)
+    monkeypatch.setattr(sn, "_derived_keys", {})
+    monkeypatch.setenv("SCATOLA_NERA_PASSPHRASE", "passphrase sbagliata")
+
+    with pytest.raises(sn.ArchiveAuthError):
+        decrypt(sn, sn.FrameCipher(header), stream)
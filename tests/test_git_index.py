@@ -0,0 +1,107 @@
+"""Lettura dell'index di git (GitIndex): versioni 2, 3, 4 e regola "racy" """
+
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git non installato")
+
+FILES = {
+    "README.md": b"progetto\n",
+    "src/alpha.py": b"print('alpha')\n",
+    "src/alphabet.py": b"print('alphabet')\n",
+    "src/beta.py": b"print('beta')\n",
+}
+
+
+def git(repo, *args):
+    return subprocess.run(["git", "-C", str(repo), *args], check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """Repository con alcuni file aggiunti all'index, più vecchi dell'index stesso"""
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q")
+    past = time.time() - 60
+    for rel_path, data in FILES.items():
+        path = repo / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        os.utime(path, (past, past))
+    git(repo, "add", *FILES)
+    return repo
+
+
+def expected_oids(repo):
+    return {rel_path: git(repo, "hash-object", rel_path) for rel_path in FILES}
+
+
+@pytest.mark.parametrize("version", [2, 3, 4])
+def test_index_versions(sn, repo, version):
+    git(repo, "update-index", "--index-version", str(version))
+    if version == 3:
+        # Un flag esteso su una voce in mezzo: le voci successive devono restare allineate
+        git(repo, "update-index", "--skip-worktree", "src/alpha.py")
+
+    header = (repo / ".git" / "index").read_bytes()[:sn.GitIndex.HEADER.size]
+    assert sn.GitIndex.HEADER.unpack(header)[1] == version
+
+    index = sn.GitIndex.open(repo)
+
+    assert set(index.entries) == set(FILES)
+    for rel_path, oid in expected_oids(repo).items():
+        assert index.oid(rel_path, os.stat(repo / rel_path)) == oid
+
+
+def test_intent_to_add_not_trusted(sn, repo):
+    (repo / "nuovo.txt").write_bytes(b"non ancora aggiunto\n")
+    git(repo, "add", "-N", "nuovo.txt")
+
+    index = sn.GitIndex.open(repo)
+
+    assert index.oid("nuovo.txt", os.stat(repo / "nuovo.txt")) is None
+    assert index.oid("README.md", os.stat(repo / "README.md")) == git(repo, "hash-object", "README.md")
+
+
+def test_changed_stat_not_trusted(sn, repo):
+    path = repo / "src" / "beta.py"
+    path.write_bytes(b"print('beta modificato')\n")
+
+    index = sn.GitIndex.open(repo)
+
+    assert index.oid("src/beta.py", os.stat(path)) is None
+
+
+def test_racy_entry_not_trusted(sn, repo):
+    # Index con la stessa mtime del file: una modifica nello stesso istante non si vedrebbe
+    index_path = repo / ".git" / "index"
+    file_mtime = os.stat(repo / "README.md").st_mtime_ns
+    os.utime(index_path, ns=(file_mtime, file_mtime))
+
+    index = sn.GitIndex.open(repo)
+
+    assert index.oid("README.md", os.stat(repo / "README.md")) is None
+
+
+def test_reopen_reuses_unchanged_index(sn, repo):
+    index = sn.GitIndex.open(repo)
+    assert sn.GitIndex.open(repo, previous=index) is index
+
+    git(repo, "update-index", "--index-version", "4")
+    assert sn.GitIndex.open(repo, previous=index) is not index
+
+
+def test_corrupted_index_rejected(sn, repo):
+    index_path = repo / ".git" / "index"
+    data = bytearray(index_path.read_bytes())
+    data[40] ^= 0xFF
+    index_path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError):
+        sn.GitIndex.open(repo)
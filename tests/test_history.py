@@ -0,0 +1,116 @@
+"""Indice delle versioni dei file tra gli snapshot (FileHistory, history, restore --version)"""
+
+import pytest
+
+from helpers import fast_timestamps, write
+
+
+@pytest.fixture(autouse=True)
+def quick(scatola, monkeypatch):
+    fast_timestamps(scatola, monkeypatch)
+
+
+def timeline(sn, scatola, tmp_path):
+    """config.js: v1, invariato, v2, eliminato, di nuovo v1. Restituisce i nomi degli snapshot"""
+    write(tmp_path, {"config.js": b"v1\n", "altro.txt": b"x\n"})
+    scatola.create_snapshot("v1")
+    write(tmp_path, {"altro.txt": b"y\n"})
+    scatola.create_incremental_backup()
+    write(tmp_path, {"config.js": b"v2 piu lungo\n"})
+    scatola.create_incremental_backup()
+    (tmp_path / "config.js").unlink()
+    scatola.create_incremental_backup()
+    write(tmp_path, {"config.js": b"v1\n"})
+    scatola.create_snapshot("di nuovo v1")
+    return [s["name"] for s in scatola.state["snapshots"]]
+
+
+def test_versions_newest_first(sn, scatola, tmp_path):
+    names = timeline(sn, scatola, tmp_path)
+    v1 = sn.hash_file(tmp_path / "config.js")
+    write(tmp_path, {"tmp.js": b"v2 piu lungo\n"})
+    v2 = sn.hash_file(tmp_path / "tmp.js")
+
+    versions = scatola.file_versions("config.js")
+
+    assert [(v["hash"], v["snapshots"]) for v in versions] == [
+        (v1, names[4:5]),
+        (None, names[3:4]),
+        (v2, names[2:3]),
+        (v1, names[0:2]),
+    ]
+    assert versions[2]["size"] == len(b"v2 piu lungo\n")
+
+
+def test_unknown_path_has_no_versions(sn, scatola, tmp_path):
+    timeline(sn, scatola, tmp_path)
+
+    assert scatola.file_versions("mai/esistito.txt") == []
+    assert not scatola.show_history("mai/esistito.txt")
+
+
+def test_pruned_snapshots_leave_the_history(sn, scatola, tmp_path):
+    names = timeline(sn, scatola, tmp_path)
+    scatola.prune_snapshots(keep_last=2, keep_daily=0, keep_weekly=0)
+
+    versions = scatola.file_versions("config.js")
+
+    # Le versioni valide solo negli snapshot rimossi spariscono, senza riscrivere l'indice
+    assert [v["snapshots"] for v in versions] == [names[4:5], names[3:4]]
+
+
+def test_index_rebuilt_when_missing(sn, scatola, tmp_path):
+    timeline(sn, scatola, tmp_path)
+    before = scatola.file_versions("config.js")
+    sn.HISTORY_FILE.unlink()
+
+    assert scatola.file_versions("config.js") == before
+
+
+def test_show_history_numbers_versions(sn, scatola, tmp_path):
+    timeline(sn, scatola, tmp_path)
+
+    assert scatola.show_history("config.js")
+
+    lines = [m for m in scatola.messages if m.startswith("   ")]
+    assert lines[0].startswith("   #1 ")
+    assert lines[1].startswith("   🗑️ eliminato")
+    assert lines[2].startswith("   #2 ")
+    assert lines[3].startswith("   #3 ") and "(2 snapshot)" in lines[3]
+
+
+def test_restore_version_by_number(sn, scatola, tmp_path):
+    timeline(sn, scatola, tmp_path)
+
+    assert scatola.restore_version("config.js", "2")
+
+    assert (tmp_path / "config.js").read_bytes() == b"v2 piu lungo\n"
+    assert (tmp_path / "altro.txt").read_bytes() == b"y\n"
+
+
+def test_restore_version_by_hash_prefix(sn, scatola, tmp_path):
+    timeline(sn, scatola, tmp_path)
+    v1 = sn.hash_file(tmp_path / "config.js")
+    write(tmp_path, {"config.js": b"modificato\n"})
+
+    assert scatola.restore_version("config.js", v1[:10])
+
+    assert (tmp_path / "config.js").read_bytes() == b"v1\n"
+
+
+def test_restore_unknown_version(sn, scatola, tmp_path):
+    timeline(sn, scatola, tmp_path)
+
+    assert not scatola.restore_version("config.js", "9")
+    assert not scatola.restore_version("config.js", "zzzz")
+
+
+def test_glob_characters_in_path_restored_exactly(sn, scatola, tmp_path):
+    write(tmp_path, {"[a].txt": b"parentesi\n", "a.txt": b"altro\n"})
+    scatola.create_snapshot("glob")
+    write(tmp_path, {"[a].txt": b"rotto\n", "a.txt": b"rotto\n"})
+
+    assert scatola.restore_version("[a].txt", "1")
+
+    assert (tmp_path / "[a].txt").read_bytes() == b"parentesi\n"
+    assert (tmp_path / "a.txt").read_bytes() == b"rotto\n"
@@ -0,0 +1,83 @@
+"""Ripresa di uno snapshot interrotto dal journal della cartella di lavoro"""
+
+import pytest
+
+from helpers import snapshot_contents, write
+
+
+def test_interrupted_store_resumes_from_journal(sn, scatola, tmp_path):
+    files = {f"file{i}.txt": f"contenuto {i}\n".encode() for i in range(6)}
+    write(tmp_path, files)
+    scatola.workers = 1
+
+    put_file = scatola.store.put_file
+    calls = []
+
+    def interrupted(src, *args, **kwargs):
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        calls.append(src)
+        return put_file(src, *args, **kwargs)
+
+    scatola.store.put_file = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        scatola.create_snapshot("interrotto")
+
+    # Nessuno snapshot pubblicato, resta la cartella di lavoro con il journal
+    assert scatola.state["snapshots"] == []
+    staging = list((tmp_path / "backups").glob(f"snapshot_*{sn.STAGING_SUFFIX}"))
+    assert len(staging) == 1
+    assert len(sn.SnapshotJournal.read(staging[0] / sn.JOURNAL_FILE)) == 3
+
+    resumed = sn.ScatolaNera()
+    resumed.workers = 1
+    messages = []
+    resumed.log = messages.append
+    saved = []
+    resumed_put = resumed.store.put_file
+
+    def counting(src, *args, **kwargs):
+        saved.append(src)
+        return resumed_put(src, *args, **kwargs)
+
+    resumed.store.put_file = counting
+    resumed.create_snapshot("ripreso")
+
+    assert any("3 file già salvati" in message for message in messages)
+    assert not set(saved) & set(calls)
+    name = resumed.state["snapshots"][-1]["name"]
+    contents = snapshot_contents(resumed, name)
+    for rel_path, data in files.items():
+        assert contents[rel_path] == data
+    assert not list((tmp_path / "backups").glob(f"snapshot_*{sn.STAGING_SUFFIX}"))
+    assert resumed.verify_snapshots()
+
+
+def test_resume_skips_journal_entries_with_missing_blobs(sn, scatola, tmp_path):
+    write(tmp_path, {f"file{i}.txt": f"contenuto {i}\n".encode() for i in range(4)})
+    scatola.workers = 1
+    put_file = scatola.store.put_file
+    stored = []
+
+    def interrupted(src, *args, **kwargs):
+        if len(stored) == 2:
+            raise KeyboardInterrupt
+        digest = put_file(src, *args, **kwargs)
+        stored.append(digest)
+        return digest
+
+    scatola.store.put_file = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        scatola.create_snapshot("interrotto")
+
+    # Un blob del journal sparisce: quel file va salvato di nuovo
+    scatola.store.path_for(stored[0]).unlink()
+
+    resumed = sn.ScatolaNera()
+    messages = []
+    resumed.log = messages.append
+    resumed.create_snapshot("ripreso")
+
+    assert any("1 file già salvati" in message for message in messages)
+    assert resumed.store.has(stored[0])
+    assert resumed.verify_snapshots()
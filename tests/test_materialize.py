@@ -0,0 +1,158 @@
+"""Alberi materializzati degli snapshot (reflink, hardlink, copia) e copia dei file"""
+
+import errno
+import os
+import re
+import stat
+
+import pytest
+
+from helpers import fast_timestamps, write
+
+FILES = {
+    "app/index.html": b"<h1>v1</h1>\n",
+    "app/run.sh": b"#!/bin/sh\n",
+    "docs/guida.md": b"# Guida\n",
+}
+
+
+@pytest.fixture(autouse=True)
+def quick(scatola, monkeypatch):
+    fast_timestamps(scatola, monkeypatch)
+
+
+@pytest.fixture
+def no_reflink(sn, monkeypatch):
+    """Filesystem senza reflink: il percorso hardlink/copia è deterministico"""
+    monkeypatch.setattr(sn, "reflink_file", lambda src, dst: False)
+    monkeypatch.setattr(sn, "_reflink", lambda fsrc, fdst: False)
+
+
+def methods(scatola):
+    """Conteggi (reflink, hardlink, copie) dell'ultima materializzazione"""
+    message = next(m for m in reversed(scatola.messages) if m.startswith("✅ File materializzati"))
+    return tuple(int(n) for n in re.search(r"(\d+) reflink, (\d+) hardlink, (\d+) copie", message).groups())
+
+
+def snapshot(scatola, tmp_path, files):
+    write(tmp_path, files)
+    scatola.create_snapshot("snapshot")
+    return scatola.state["snapshots"][-1]["name"]
+
+
+def test_tree_matches_snapshot(sn, scatola, tmp_path, no_reflink):
+    write(tmp_path, FILES)
+    os.chmod(tmp_path / "app/run.sh", 0o755)
+    os.utime(tmp_path / "docs/guida.md", (1_700_000_000, 1_700_000_000))
+    scatola.create_snapshot("snapshot")
+    name = scatola.state["snapshots"][-1]["name"]
+
+    tree = scatola.materialize_snapshot(name)
+
+    assert tree == sn.MATERIALIZE_DIR / name
+    for rel_path, data in FILES.items():
+        assert (tree / rel_path).read_bytes() == data
+        # In sola lettura: gli hardlink condividono il contenuto con altri alberi
+        assert not (tree / rel_path).stat().st_mode & 0o222
+    assert stat.S_IMODE((tree / "app/run.sh").stat().st_mode) == 0o555
+    assert (tree / "docs/guida.md").stat().st_mtime == 1_700_000_000
+    assert methods(scatola)[:2] == (0, 0)
+
+
+def test_unchanged_files_hardlinked_to_nearest_tree(sn, scatola, tmp_path, no_reflink):
+    first = snapshot(scatola, tmp_path, FILES)
+    first_tree = scatola.materialize_snapshot(first)
+    second = snapshot(scatola, tmp_path, {"app/index.html": b"<h1>v2</h1>\n"})
+
+    tree = scatola.materialize_snapshot(second)
+
+    assert (tree / "docs/guida.md").stat().st_ino == (first_tree / "docs/guida.md").stat().st_ino
+    assert (tree / "app/index.html").stat().st_ino != (first_tree / "app/index.html").stat().st_ino
+    assert (tree / "app/index.html").read_bytes() == b"<h1>v2</h1>\n"
+    assert (first_tree / "app/index.html").read_bytes() == FILES["app/index.html"]
+    # Nel progetto c'è anche scatola-nera.py, invariato
+    reflinks, hardlinks, copies = methods(scatola)
+    assert (reflinks, copies) == (0, 1) and hardlinks >= 2
+
+
+def test_reflink_preferred_over_hardlink(sn, scatola, tmp_path, monkeypatch):
+    def fake_reflink(src, dst):
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fdst.write(fsrc.read())
+        return True
+
+    monkeypatch.setattr(sn, "_reflink", lambda fsrc, fdst: False)
+    first = snapshot(scatola, tmp_path, FILES)
+    first_tree = scatola.materialize_snapshot(first)
+    monkeypatch.setattr(sn, "reflink_file", fake_reflink)
+    second = snapshot(scatola, tmp_path, {"app/index.html": b"<h1>v2</h1>\n"})
+
+    tree = scatola.materialize_snapshot(second)
+
+    # Un clone ha un inode suo, con permessi e data dello snapshot
+    cloned = tree / "docs/guida.md"
+    assert cloned.stat().st_ino != (first_tree / "docs/guida.md").stat().st_ino
+    assert cloned.stat().st_mtime == (first_tree / "docs/guida.md").stat().st_mtime
+    assert not cloned.stat().st_mode & 0o222
+    reflinks, hardlinks, copies = methods(scatola)
+    assert (hardlinks, copies) == (0, 1) and reflinks >= 2
+
+
+def test_existing_destination_refused(sn, scatola, tmp_path, no_reflink):
+    name = snapshot(scatola, tmp_path, FILES)
+    scatola.materialize_snapshot(name)
+
+    assert scatola.materialize_snapshot(name) is None
+    assert any("esiste già" in m for m in scatola.messages)
+
+
+def test_incomplete_tree_not_published(sn, scatola, tmp_path, no_reflink):
+    name = snapshot(scatola, tmp_path, FILES)
+    digest = sn.hash_file(tmp_path / "docs/guida.md")
+    scatola.store.path_for(digest).unlink()
+
+    assert scatola.materialize_snapshot(name) is None
+
+    assert not (sn.MATERIALIZE_DIR / name).exists()
+    assert not (sn.MATERIALIZE_DIR / (name + sn.STAGING_SUFFIX)).exists()
+
+
+def test_materialize_archive(sn, scatola, tmp_path, no_reflink):
+    scatola.archive_codec = "gzip"
+    name = snapshot(scatola, tmp_path, FILES)
+
+    tree = scatola.materialize_snapshot(name, tmp_path / "albero")
+
+    assert (tree / "app/index.html").read_bytes() == FILES["app/index.html"]
+
+
+def test_copy_file_fast_copies_content(sn, tmp_path):
+    src = tmp_path / "src.bin"
+    src.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+
+    method = sn.copy_file_fast(src, tmp_path / "dst.bin")
+
+    assert method in ("reflink", "copy")
+    assert (tmp_path / "dst.bin").read_bytes() == src.read_bytes()
+
+
+def test_unsupported_reflink_falls_back_and_is_remembered(sn, tmp_path, monkeypatch):
+    if not sn.HAS_FICLONE:
+        pytest.skip("FICLONE non disponibile")
+    calls = []
+
+    def unsupported(fd, request, arg):
+        calls.append(request)
+        raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+    monkeypatch.setattr(sn.fcntl, "ioctl", unsupported)
+    monkeypatch.setattr(sn, "_NO_REFLINK", set())
+    src = tmp_path / "src.txt"
+    src.write_bytes(b"contenuto\n")
+
+    assert sn.copy_file_fast(src, tmp_path / "a.txt") == "copy"
+    assert (tmp_path / "a.txt").read_bytes() == b"contenuto\n"
+    assert not sn.reflink_file(src, tmp_path / "b.txt")
+    assert not (tmp_path / "b.txt").exists()
+    # Dopo il primo errore la coppia di dispositivi non viene più provata
+    assert len(calls) == 1
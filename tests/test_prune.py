@@ -0,0 +1,54 @@
+"""Retention e GC dei blob: prune non cancella nulla che gli snapshot conservati usano"""
+
+from helpers import snapshot_contents, stored_blobs, write
+
+
+def test_prune_keeps_every_blob_of_kept_snapshots(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a v1\n", "b.txt": b"b v1\n", "c.txt": b"c v1\n"})
+    scatola.create_snapshot("primo")
+    old_b = sn.hash_file(tmp_path / "b.txt")
+    old_c = sn.hash_file(tmp_path / "c.txt")
+
+    write(tmp_path, {"b.txt": b"b v2\n", "d.txt": b"d v1\n"})
+    (tmp_path / "c.txt").unlink()
+    scatola.create_incremental_backup()
+
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    scatola.create_incremental_backup()
+    last = scatola.state["snapshots"][-1]["name"]
+    expected = snapshot_contents(scatola, last)
+
+    scatola.prune_snapshots(keep_last=1, keep_daily=0, keep_weekly=0)
+
+    assert [s["name"] for s in scatola.state["snapshots"]] == [last]
+    # L'incrementale conservato è stato compattato e ha ancora tutti i suoi blob
+    assert scatola.snapshot_refs(last) <= stored_blobs(scatola)
+    assert snapshot_contents(scatola, last) == expected
+    assert expected["a.txt"] == b"a v2\n" and expected["b.txt"] == b"b v2\n"
+    assert "c.txt" not in expected
+    # Le versioni che nessuno snapshot usa più sono state cancellate
+    assert not scatola.store.has(old_b)
+    assert not scatola.store.has(old_c)
+    assert scatola.verify_snapshots()
+
+    # Un secondo prune non trova altro da cancellare e non rompe nulla
+    blobs = stored_blobs(scatola)
+    scatola.prune_snapshots(keep_last=1, keep_daily=0, keep_weekly=0, full=True)
+    assert stored_blobs(scatola) == blobs
+    assert scatola.verify_snapshots()
+
+
+def test_backup_after_prune_reuses_only_live_blobs(sn, scatola, tmp_path):
+    # Il contenuto torna uguale a una versione cancellata da prune: va salvato di nuovo
+    write(tmp_path, {"a.txt": b"versione vecchia\n"})
+    scatola.create_snapshot("primo")
+    write(tmp_path, {"a.txt": b"versione nuova\n"})
+    scatola.create_incremental_backup()
+    scatola.prune_snapshots(keep_last=1, keep_daily=0, keep_weekly=0)
+
+    write(tmp_path, {"a.txt": b"versione vecchia\n"})
+    scatola.create_incremental_backup()
+    last = scatola.state["snapshots"][-1]["name"]
+
+    assert snapshot_contents(scatola, last)["a.txt"] == b"versione vecchia\n"
+    assert scatola.verify_snapshots()
@@ -0,0 +1,162 @@
+"""Replica degli snapshot in un'altra cartella (replicate)"""
+
+import fcntl
+import json
+
+import pytest
+
+from helpers import fast_timestamps, snapshot_contents, stored_blobs, write
+
+
+def open_replica(sn, root):
+    """ScatolaNera che legge la replica al posto della cartella dei backup"""
+    replica = sn.ScatolaNera()
+    replica.backup_dir = root
+    replica.store = sn.BlobStore(root / sn.OBJECTS_DIR.name)
+    with open(root / sn.STATE_FILE.name, encoding="utf-8") as f:
+        replica.state = json.load(f)
+    return replica
+
+
+@pytest.fixture
+def root(tmp_path_factory):
+    """Destinazione della replica, fuori dal progetto (che altrimenti la salverebbe)"""
+    return tmp_path_factory.mktemp("replica")
+
+
+def replica_names(sn, root):
+    with open(root / sn.STATE_FILE.name, encoding="utf-8") as f:
+        return [s["name"] for s in json.load(f)["snapshots"]]
+
+
+def test_replica_is_readable(sn, scatola, tmp_path, root):
+    write(tmp_path, {"a.txt": b"a v1\n", "dir/b.txt": b"b v1\n"})
+    scatola.create_snapshot("primo")
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    scatola.create_incremental_backup()
+
+    assert scatola.replicate(root)
+
+    replica = open_replica(sn, root)
+    assert replica_names(sn, root) == [s["name"] for s in scatola.state["snapshots"]]
+    assert stored_blobs(replica) == stored_blobs(scatola)
+    for snapshot in scatola.state["snapshots"]:
+        assert snapshot_contents(replica, snapshot["name"]) == snapshot_contents(scatola, snapshot["name"])
+    assert not (root / sn.REPLICA_JOURNAL_FILE).exists()
+
+
+def test_second_run_copies_nothing(sn, scatola, tmp_path, root):
+    write(tmp_path, {"a.txt": b"a\n"})
+    scatola.create_snapshot("primo")
+    assert scatola.replicate(root)
+    scatola.messages.clear()
+
+    assert scatola.replicate(root)
+
+    assert any("Blob copiati: 0 " in message for message in scatola.messages)
+    assert any("Manifest e archivi copiati: 0" in message for message in scatola.messages)
+
+
+def test_only_new_blobs_copied(sn, scatola, tmp_path, monkeypatch, root):
+    fast_timestamps(scatola, monkeypatch)
+    write(tmp_path, {"a.txt": b"a v1\n", "b.txt": b"b v1\n"})
+    scatola.create_snapshot("primo")
+    assert scatola.replicate(root)
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    scatola.create_incremental_backup()
+    copied = []
+    copy_to = scatola.store.copy_to
+
+    def counting(digest, target):
+        copied.append(digest)
+        return copy_to(digest, target)
+
+    monkeypatch.setattr(scatola.store, "copy_to", counting)
+
+    assert scatola.replicate(root)
+
+    assert copied == [sn.hash_file(tmp_path / "a.txt")]
+    newest = scatola.state["snapshots"][-1]["name"]
+    assert snapshot_contents(open_replica(sn, root), newest)["a.txt"] == b"a v2\n"
+
+
+def test_pruned_snapshots_kept_without_delete(sn, scatola, tmp_path, monkeypatch, root):
+    fast_timestamps(scatola, monkeypatch)
+    write(tmp_path, {"a.txt": b"a v1\n"})
+    scatola.create_snapshot("primo")
+    first = scatola.state["snapshots"][0]["name"]
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    scatola.create_snapshot("secondo")
+    assert scatola.replicate(root)
+    scatola.prune_snapshots(keep_last=1, keep_daily=0, keep_weekly=0)
+
+    assert scatola.replicate(root)
+
+    assert first in replica_names(sn, root)
+    assert snapshot_contents(open_replica(sn, root), first)["a.txt"] == b"a v1\n"
+
+
+def test_delete_mirrors_pruned_snapshots(sn, scatola, tmp_path, monkeypatch, root):
+    fast_timestamps(scatola, monkeypatch)
+    write(tmp_path, {"a.txt": b"a v1\n"})
+    scatola.create_snapshot("primo")
+    first = scatola.state["snapshots"][0]["name"]
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    scatola.create_snapshot("secondo")
+    assert scatola.replicate(root)
+    scatola.prune_snapshots(keep_last=1, keep_daily=0, keep_weekly=0)
+
+    assert scatola.replicate(root, delete=True)
+
+    assert replica_names(sn, root) == [s["name"] for s in scatola.state["snapshots"]]
+    assert not (root / first).exists()
+    assert stored_blobs(open_replica(sn, root)) == stored_blobs(scatola)
+
+
+def test_destination_equal_to_backups_refused(sn, scatola, tmp_path, root):
+    write(tmp_path, {"a.txt": b"a\n"})
+    scatola.create_snapshot("primo")
+
+    assert not scatola.replicate(scatola.backup_dir)
+    assert not (scatola.backup_dir / sn.REPLICA_LOCK_FILE).exists()
+
+
+def test_concurrent_replica_refused(sn, scatola, tmp_path, root):
+    write(tmp_path, {"a.txt": b"a\n"})
+    scatola.create_snapshot("primo")
+    with open(root / sn.REPLICA_LOCK_FILE, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        assert not scatola.replicate(root)
+
+    assert not (root / sn.STATE_FILE.name).exists()
+    assert any("in corso" in message for message in scatola.messages)
+
+
+def test_interrupted_replica_rechecks_journal(sn, scatola, tmp_path, root):
+    write(tmp_path, {"a.txt": b"contenuto da ricontrollare\n"})
+    scatola.create_snapshot("primo")
+    assert scatola.replicate(root)
+    # Blob arrivato a metà prima dell'interruzione, ancora elencato nel journal
+    digest = sn.hash_file(tmp_path / "a.txt")
+    replica_blob = sn.BlobStore(root / sn.OBJECTS_DIR.name).path_for(digest)
+    replica_blob.write_bytes(b"tronc")
+    (root / sn.REPLICA_JOURNAL_FILE).write_text(digest, encoding="utf-8")
+
+    assert scatola.replicate(root)
+
+    assert sn.hash_file(replica_blob) == digest
+
+
+def test_encrypted_archives_replicated_without_index(sn, scatola, tmp_path, root):
+    pytest.importorskip("cryptography")
+    scatola.encryption = "aes-gcm"
+    write(tmp_path, {"a.txt": b"a segreto\n"})
+    scatola.create_snapshot("cifrato")
+    name = scatola.state["snapshots"][-1]["name"]
+
+    assert scatola.replicate(root)
+
+    assert (root / f"{name}{sn.ARCHIVE_SUFFIX}").read_bytes() == scatola.archive_path(name).read_bytes()
+    assert not list(root.rglob("*.db"))
+    assert snapshot_contents(open_replica(sn, root), name)["a.txt"] == b"a segreto\n"
@@ -0,0 +1,105 @@
+"""Lock della cartella dei backup (RepoLock) tra processi che modificano lo stato"""
+
+import fcntl
+import json
+import threading
+
+from helpers import write
+
+
+def hold_lock(sn, mode=fcntl.LOCK_EX):
+    """Il lock preso come farebbe un altro processo (un'altra apertura del file)"""
+    f = open(sn.REPO_LOCK_FILE, "a")
+    fcntl.flock(f, mode)
+    return f
+
+
+def saved_snapshots(sn):
+    with open(sn.STATE_FILE, encoding="utf-8") as f:
+        return [s["name"] for s in json.load(f)["snapshots"]]
+
+
+def incremental_chain(scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a v1\n", "b.txt": b"b v1\n"})
+    scatola.create_snapshot("primo")
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    scatola.create_incremental_backup()
+    return scatola.state["snapshots"][-1]["name"]
+
+
+def run_in_thread(target, *args, **kwargs):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", target(*args, **kwargs)))
+    thread.start()
+    return thread, result
+
+
+def test_prune_waits_for_lock_holder(sn, scatola, tmp_path):
+    incremental_chain(scatola, tmp_path)
+    lock = hold_lock(sn)
+
+    thread, _ = run_in_thread(scatola.prune_snapshots, keep_last=1, keep_daily=0, keep_weekly=0)
+    thread.join(0.5)
+    assert thread.is_alive()
+    assert len(saved_snapshots(sn)) == 2
+
+    lock.close()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert len(saved_snapshots(sn)) == 1
+
+
+def test_compact_waits_for_lock_holder(sn, scatola, tmp_path):
+    name = incremental_chain(scatola, tmp_path)
+    lock = hold_lock(sn)
+
+    thread, result = run_in_thread(scatola.compact_snapshot, name)
+    thread.join(0.5)
+    assert thread.is_alive()
+
+    lock.close()
+    thread.join(10)
+    assert result["value"] is True
+
+
+def test_compact_keeps_snapshot_written_meanwhile(sn, scatola, tmp_path):
+    # Un altro processo aggiunge uno snapshot dopo che questo ha letto lo stato
+    name = incremental_chain(scatola, tmp_path)
+    other = sn.ScatolaNera()
+    write(tmp_path, {"b.txt": b"b v2\n"})
+    other.create_incremental_backup()
+    newest = other.state["snapshots"][-1]["name"]
+
+    assert scatola.compact_snapshot(name)
+
+    assert saved_snapshots(sn)[-1] == newest
+    entry = next(s for s in scatola.state["snapshots"] if s["name"] == name)
+    assert entry["type"] == "full"
+
+
+def test_migrate_keeps_snapshot_written_meanwhile(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a v1\n"})
+    other = sn.ScatolaNera()
+    other.create_snapshot("primo")
+
+    scatola.migrate_snapshots()
+
+    # Lo stato riletto sotto il lock è quello che verrebbe salvato
+    assert [s["name"] for s in scatola.state["snapshots"]] == saved_snapshots(sn)
+    assert saved_snapshots(sn) == [s["name"] for s in other.state["snapshots"]]
+
+
+def test_shared_holders_do_not_block_each_other(sn, scatola, tmp_path):
+    incremental_chain(scatola, tmp_path)
+    lock = hold_lock(sn, fcntl.LOCK_SH)
+    try:
+        with scatola.repo_lock.hold() as acquired:
+            assert acquired
+    finally:
+        lock.close()
+
+
+def test_lock_is_reentrant(sn, scatola):
+    with scatola.repo_lock.hold(exclusive=True) as outer:
+        with scatola.repo_lock.hold(exclusive=True) as inner:
+            assert outer and not inner
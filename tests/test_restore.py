@@ -0,0 +1,135 @@
+"""Ripristino selettivo e differenziale (restore_snapshot)"""
+
+import os
+
+from helpers import write
+
+FILES = {
+    "app/index.html": b"<html>v1</html>\n",
+    "app/js/main.js": b"console.log(1)\n",
+    "docs/guida.md": b"# Guida\n",
+    "README.md": b"readme v1\n",
+}
+
+
+def snapshot(scatola, tmp_path, files=FILES):
+    write(tmp_path, files)
+    scatola.create_snapshot("base")
+    return scatola.state["snapshots"][-1]["name"]
+
+
+def spy_restores(sn, scatola, monkeypatch):
+    """Percorsi effettivamente copiati nel progetto"""
+    restored = []
+    restore_file = scatola.restore_file
+
+    def spy(sources, dst, info, archive=None):
+        restored.append(os.path.relpath(dst, sn.PROJECT_ROOT))
+        return restore_file(sources, dst, info, archive)
+
+    monkeypatch.setattr(scatola, "restore_file", spy)
+    return restored
+
+
+def test_only_changed_files_copied(sn, scatola, tmp_path, monkeypatch):
+    name = snapshot(scatola, tmp_path)
+    write(tmp_path, {"app/index.html": b"<html>rotto</html>\n"})
+    (tmp_path / "docs/guida.md").unlink()
+    restored = spy_restores(sn, scatola, monkeypatch)
+
+    assert scatola.restore_snapshot(name)
+
+    assert sorted(restored) == ["app/index.html", "docs/guida.md"]
+    for rel_path, data in FILES.items():
+        assert (tmp_path / rel_path).read_bytes() == data
+    assert any("1 mancanti, 1 modificati" in m for m in scatola.messages)
+
+
+def test_files_outside_snapshot_untouched(sn, scatola, tmp_path):
+    name = snapshot(scatola, tmp_path)
+    write(tmp_path, {"app/nuovo.txt": b"non nello snapshot\n"})
+
+    scatola.restore_snapshot(name)
+
+    assert (tmp_path / "app/nuovo.txt").read_bytes() == b"non nello snapshot\n"
+
+
+def test_same_size_change_detected(sn, scatola, tmp_path):
+    name = snapshot(scatola, tmp_path)
+    write(tmp_path, {"README.md": b"readme v2\n"})
+
+    scatola.restore_snapshot(name)
+
+    assert (tmp_path / "README.md").read_bytes() == b"readme v1\n"
+
+
+def test_selective_restore_by_directory_and_glob(sn, scatola, tmp_path, monkeypatch):
+    name = snapshot(scatola, tmp_path)
+    for rel_path in FILES:
+        write(tmp_path, {rel_path: b"modificato\n"})
+    restored = spy_restores(sn, scatola, monkeypatch)
+
+    assert scatola.restore_snapshot(name, ["app/js", "*.md"])
+
+    assert sorted(restored) == ["README.md", "app/js/main.js", "docs/guida.md"]
+    assert (tmp_path / "app/index.html").read_bytes() == b"modificato\n"
+
+
+def test_pattern_without_matches(sn, scatola, tmp_path):
+    name = snapshot(scatola, tmp_path)
+
+    assert not scatola.restore_snapshot(name, ["non/esiste"])
+    assert any("Nessun file dello snapshot corrisponde" in m for m in scatola.messages)
+
+
+def test_dry_run_changes_nothing(sn, scatola, tmp_path):
+    name = snapshot(scatola, tmp_path)
+    write(tmp_path, {"app/index.html": b"<html>rotto</html>\n"})
+    (tmp_path / "docs/guida.md").unlink()
+
+    assert scatola.restore_snapshot(name, dry_run=True)
+
+    assert (tmp_path / "app/index.html").read_bytes() == b"<html>rotto</html>\n"
+    assert not (tmp_path / "docs/guida.md").exists()
+    assert "   ~ app/index.html" in scatola.messages
+    assert "   + docs/guida.md" in scatola.messages
+
+
+def test_mode_only_change_not_copied(sn, scatola, tmp_path, monkeypatch):
+    write(tmp_path, {"run.sh": b"#!/bin/sh\n"})
+    os.chmod(tmp_path / "run.sh", 0o755)
+    name = snapshot(scatola, tmp_path)
+    os.chmod(tmp_path / "run.sh", 0o644)
+    restored = spy_restores(sn, scatola, monkeypatch)
+
+    scatola.restore_snapshot(name)
+
+    assert restored == []
+    assert (tmp_path / "run.sh").stat().st_mode & 0o777 == 0o755
+
+
+def test_restore_from_incremental_chain(sn, scatola, tmp_path):
+    snapshot(scatola, tmp_path)
+    write(tmp_path, {"README.md": b"readme v2\n"})
+    scatola.create_incremental_backup()
+    name = scatola.state["snapshots"][-1]["name"]
+    write(tmp_path, {"README.md": b"altro\n", "app/index.html": b"altro\n"})
+
+    scatola.restore_snapshot(name)
+
+    assert (tmp_path / "README.md").read_bytes() == b"readme v2\n"
+    assert (tmp_path / "app/index.html").read_bytes() == FILES["app/index.html"]
+
+
+def test_restore_from_archive(sn, scatola, tmp_path):
+    scatola.archive_codec = "gzip"
+    name = snapshot(scatola, tmp_path)
+    (tmp_path / "app/js/main.js").unlink()
+
+    scatola.restore_snapshot(name, ["app/js/main.js"])
+
+    assert (tmp_path / "app/js/main.js").read_bytes() == FILES["app/js/main.js"]
+
+
+def test_unknown_snapshot(sn, scatola):
+    assert not scatola.restore_snapshot("snapshot_19700101_000000")
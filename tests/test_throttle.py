@@ -0,0 +1,132 @@
+"""Backup in sottofondo: limite di banda (IOThrottle), pausa con l'agent occupato e opzioni"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from helpers import write
+
+MB = 1024 * 1024
+
+
+def run(sn, *args):
+    return subprocess.run([sys.executable, sn.__file__, "list", *args], capture_output=True, text=True, timeout=60)
+
+
+@pytest.mark.parametrize("option", ["--limit=abc", "--limit=-5", "--limit", "--limit=nan", "--limit=inf"])
+def test_invalid_limit_rejected(sn, option):
+    result = run(sn, option)
+
+    assert result.returncode == 1
+    assert "Indica il limite in MB/s: --limit=20" in result.stdout
+    assert "Traceback" not in result.stderr
+
+
+@pytest.mark.parametrize("option", ["--pause-when-busy=alto", "--pause-when-busy=0"])
+def test_invalid_load_threshold_rejected(sn, option):
+    result = run(sn, option)
+
+    assert result.returncode == 1
+    assert "--pause-when-busy=4" in result.stdout
+    assert "Traceback" not in result.stderr
+
+
+@pytest.mark.parametrize("option", ["--limit=20", "--limit=0.5", "--pause-when-busy", "--pause-when-busy=6"])
+def test_valid_options_accepted(sn, option):
+    assert run(sn, option).returncode == 0
+
+
+def jobs_db(sn, tmp_path, monkeypatch, pids):
+    """Tabella dei job dell'agent con un job non concluso per ogni pid"""
+    path = tmp_path / "jobs.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE jobs (id INTEGER PRIMARY KEY, pid INTEGER, finished_at TEXT)")
+    conn.executemany("INSERT INTO jobs (pid) VALUES (?)", [(pid,) for pid in pids])
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(sn, "AGENT_JOBS_DB", path)
+
+
+def test_inactive_throttle_never_sleeps(sn, monkeypatch):
+    monkeypatch.setattr(sn.time, "sleep", lambda seconds: pytest.fail("sleep senza limiti"))
+
+    sn.IO_THROTTLE.consume(100 * MB)
+
+
+def test_rate_limits_total_bandwidth(sn):
+    # Due thread da 1 MB con 4 MB/s: la banda è condivisa, circa mezzo secondo in tutto
+    sn.IO_THROTTLE.configure(rate=4 * MB)
+    started = time.monotonic()
+    threads = [threading.Thread(target=sn.IO_THROTTLE.consume, args=(MB,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert 0.4 <= time.monotonic() - started < 2
+
+
+def test_busy_check_pauses_until_idle(sn, monkeypatch):
+    monkeypatch.setattr(sn, "BUSY_CHECK_INTERVAL", 0.01)
+    answers = iter(["1 job dell'agent in corso", "1 job dell'agent in corso", None])
+    messages = []
+    sn.IO_THROTTLE.configure(busy_check=lambda: next(answers), log=messages.append)
+
+    sn.IO_THROTTLE.consume(1)
+
+    assert next(answers, "finito") == "finito"
+    assert messages[0] == "⏸️  In pausa: 1 job dell'agent in corso"
+    assert messages[1].startswith("▶️  Ripresa")
+
+
+def test_agent_busy_with_running_job(sn, tmp_path, monkeypatch):
+    jobs_db(sn, tmp_path, monkeypatch, [os.getpid()])
+
+    assert sn.agent_busy() == "1 job dell'agent in corso"
+
+
+def test_agent_idle_when_job_process_is_gone(sn, tmp_path, monkeypatch):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    jobs_db(sn, tmp_path, monkeypatch, [dead.pid])
+
+    assert sn.agent_busy() is None
+
+
+def test_agent_busy_over_load_threshold(sn, tmp_path, monkeypatch):
+    monkeypatch.setattr(sn, "AGENT_JOBS_DB", tmp_path / "assente.db")
+    monkeypatch.setattr(sn.os, "getloadavg", lambda: (6.0, 1.0, 1.0), raising=False)
+
+    assert sn.agent_busy(max_load=4) == "carico del sistema 6.0 (soglia 4)"
+    assert sn.agent_busy(max_load=8) is None
+    assert sn.agent_busy() is None
+
+
+def test_background_mode_configures_throttle(sn, scatola, tmp_path, monkeypatch):
+    monkeypatch.setattr(sn, "AGENT_JOBS_DB", tmp_path / "assente.db")
+    scatola.set_background_mode(limit=2.5, pause_when_busy=True, max_load=4)
+
+    assert sn.IO_THROTTLE.active
+    assert sn.IO_THROTTLE.rate == int(2.5 * MB)
+    assert sn.IO_THROTTLE.busy_check() is None
+    assert any("max 2.5 MB/s" in message and "carico > 4" in message for message in scatola.messages)
+
+    scatola.set_background_mode()
+    assert not sn.IO_THROTTLE.active
+
+
+def test_limited_snapshot_reads_through_throttle(sn, scatola, tmp_path, monkeypatch):
+    write(tmp_path, {"grande.bin": os.urandom(MB)})
+    scatola.set_background_mode(limit=1000)
+    consumed = []
+    monkeypatch.setattr(sn.IO_THROTTLE, "consume", consumed.append)
+
+    scatola.create_snapshot("limitato")
+
+    # Il file viene almeno letto per l'hash e copiato nello store
+    assert sum(consumed) >= 2 * MB
@@ -0,0 +1,93 @@
+"""Verifica e scrub dei contenuti salvati (verify_snapshots) e lock della cartella dei backup"""
+
+import fcntl
+import threading
+
+from helpers import write
+
+
+def corrupt(path):
+    data = bytearray(path.read_bytes())
+    data[0] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+
+def test_clean_store_verifies(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a\n", "b.txt": b"b\n"})
+    scatola.create_snapshot("primo")
+
+    assert scatola.verify_snapshots()
+
+
+def test_corrupt_blob_quarantined_and_repaired(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"contenuto da riparare\n"})
+    scatola.create_snapshot("primo")
+    digest = sn.hash_file(tmp_path / "a.txt")
+    corrupt(scatola.store.path_for(digest))
+
+    assert not scatola.verify_snapshots()
+
+    assert (sn.QUARANTINE_DIR / digest).exists()
+    assert sn.hash_file(scatola.store.path_for(digest)) == digest
+    assert any("ricostruito" in message for message in scatola.messages)
+    assert scatola.verify_snapshots()
+
+
+def test_missing_blob_reported(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"sparira\n"})
+    scatola.create_snapshot("primo")
+    digest = sn.hash_file(tmp_path / "a.txt")
+    (tmp_path / "a.txt").unlink()
+    scatola.store.path_for(digest).unlink()
+
+    assert not scatola.verify_snapshots()
+    assert any("Mancante" in message and digest[:16] in message for message in scatola.messages)
+
+
+def test_verify_does_not_rewrite_refcounts(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a\n"})
+    scatola.create_snapshot("primo")
+    sn.REFCOUNT_FILE.unlink(missing_ok=True)
+
+    assert scatola.verify_snapshots()
+    assert not sn.REFCOUNT_FILE.exists()
+
+
+def test_verify_waits_for_exclusive_holder(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a\n"})
+    scatola.create_snapshot("primo")
+    lock = open(sn.REPO_LOCK_FILE, "a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("ok", scatola.verify_snapshots()))
+    thread.start()
+    thread.join(0.5)
+    assert thread.is_alive()
+
+    lock.close()
+    thread.join(10)
+    assert result["ok"] is True
+
+
+def test_blob_collected_before_repair_not_reported(sn, scatola, tmp_path):
+    # Un prune tra la verifica e la riparazione cancella il blob danneggiato, che nessuno
+    # snapshot usa più: non è un problema da segnalare né da riparare
+    write(tmp_path, {"a.txt": b"versione vecchia\n"})
+    scatola.create_snapshot("primo")
+    old = sn.hash_file(tmp_path / "a.txt")
+    write(tmp_path, {"a.txt": b"versione nuova\n"})
+    scatola.create_incremental_backup()
+    corrupt(scatola.store.path_for(old))
+
+    handle = scatola.handle_blob_problems
+
+    def prune_first(problems):
+        other = sn.ScatolaNera()
+        other.prune_snapshots(keep_last=1, keep_daily=0, keep_weekly=0)
+        return handle(problems)
+
+    scatola.handle_blob_problems = prune_first
+
+    assert scatola.verify_snapshots()
+    assert not (sn.QUARANTINE_DIR / old).exists()
@@ -0,0 +1,96 @@
+"""Backup del watch sui soli percorsi modificati (collect_dirty) e stat cache"""
+
+import os
+import time
+
+from helpers import snapshot_contents, write
+
+OLD_NS = 1_000_000_000 * 10**9
+
+
+def age(path, mtime_ns=OLD_NS):
+    """Porta la mtime fuori dalla finestra racy (come un file non toccato da tempo)"""
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def count_hashes(sn, scatola, monkeypatch):
+    hashed = []
+    get_file_hash = scatola.get_file_hash
+
+    def counting(path):
+        hashed.append(os.path.relpath(path, sn.PROJECT_ROOT))
+        return get_file_hash(path)
+
+    monkeypatch.setattr(scatola, "get_file_hash", counting)
+    return hashed
+
+
+def test_dirty_backup_saves_changes(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a v1\n", "b.txt": b"b v1\n"})
+    scatola.create_snapshot("primo")
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    (tmp_path / "b.txt").unlink()
+
+    scatola.create_incremental_backup(dirty=({"a.txt", "b.txt"}, set()))
+
+    contents = snapshot_contents(scatola, scatola.state["snapshots"][-1]["name"])
+    assert contents["a.txt"] == b"a v2\n"
+    assert "b.txt" not in contents
+
+
+def test_dirty_hashes_reach_stat_cache(sn, scatola, tmp_path, monkeypatch):
+    write(tmp_path, {"a.txt": b"a v1\n", "b.txt": b"b v1\n"})
+    scatola.create_snapshot("primo")
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    age(tmp_path / "a.txt")
+    scatola.create_incremental_backup(dirty=({"a.txt"}, set()))
+
+    # La scansione completa successiva trova l'hash nella stat cache
+    other = sn.ScatolaNera()
+    hashed = count_hashes(sn, other, monkeypatch)
+    other.scan_project()
+
+    assert "a.txt" not in hashed
+    assert sn.StatCache(sn.STAT_CACHE_FILE, sn.HASH_ALGORITHM).entries["a.txt"][4] == sn.hash_file(tmp_path / "a.txt")
+
+
+def test_dirty_racy_file_not_cached(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a v1\n"})
+    scatola.create_snapshot("primo")
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    age(tmp_path / "a.txt", time.time_ns())
+
+    scatola.create_incremental_backup(dirty=({"a.txt"}, set()))
+
+    # Modificato adesso: la stessa stat potrebbe nascondere un'altra scrittura
+    assert "a.txt" not in sn.StatCache(sn.STAT_CACHE_FILE, sn.HASH_ALGORITHM).entries
+
+
+def test_dirty_update_keeps_other_entries(sn, scatola, tmp_path):
+    write(tmp_path, {"a.txt": b"a v1\n", "b.txt": b"b v1\n", "c.txt": b"c v1\n"})
+    for name in ("a.txt", "b.txt", "c.txt"):
+        age(tmp_path / name)
+    scatola.create_snapshot("primo")
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    age(tmp_path / "a.txt")
+    (tmp_path / "c.txt").unlink()
+
+    scatola.create_incremental_backup(dirty=({"a.txt", "c.txt"}, set()))
+
+    entries = sn.StatCache(sn.STAT_CACHE_FILE, sn.HASH_ALGORITHM).entries
+    assert set(entries) >= {"a.txt", "b.txt"}
+    assert "c.txt" not in entries
+
+
+def test_dirty_update_drops_racy_entries_of_last_scan(sn, scatola, tmp_path):
+    # Una voce racy per la scansione precedente non diventa affidabile solo perché
+    # l'aggiornamento parziale sposta in avanti il momento della scansione
+    write(tmp_path, {"a.txt": b"a v1\n", "b.txt": b"b v1\n"})
+    scatola.create_snapshot("primo")
+    assert "b.txt" in sn.StatCache(sn.STAT_CACHE_FILE, sn.HASH_ALGORITHM).entries
+    write(tmp_path, {"a.txt": b"a v2\n"})
+    age(tmp_path / "a.txt")
+
+    scatola.create_incremental_backup(dirty=({"a.txt"}, set()))
+
+    assert "b.txt" not in sn.StatCache(sn.STAT_CACHE_FILE, sn.HASH_ALGORITHM).entries